@@ -21,11 +21,15 @@ import shutil
 import logging
 import json
 import uuid
+import signal
+import threading
 import pprint
 import time
 import pytz
 import datetime
+import requests
 import verboselogs
+from collections import OrderedDict
 from choppy.config import init_config, get_global_config
 from choppy import exit_code
 from choppy.check_utils import (is_valid_label, is_valid_project_name, is_valid,
@@ -33,7 +37,7 @@ from choppy.check_utils import (is_valid_label, is_valid_project_name, is_valid,
                                 is_valid_zip_or_dir, is_valid_app_name)
 from choppy.version import get_version
 from choppy.utils import (clean_temp, set_logger)
-from choppy.exceptions import NotFoundApp
+from choppy.exceptions import ChecksumError, NotFoundApp
 
 init_config()
 global_config = get_global_config()
@@ -48,12 +52,12 @@ def call_submit(args):
     :return: JSON response with Cromwell workflow ID.
     """
     from choppy.core.json_checker import check_json
-    from choppy.core.cromwell import Cromwell
-    from choppy.core.app_utils import generate_dependencies_zip, kv_list_to_dict
+    from choppy.core.cromwell import get_cromwell
+    from choppy.core.app_utils import build_dependencies_zip, kv_list_to_dict
 
     dependencies = args.dependencies
     if dependencies and os.path.isdir(dependencies):
-        dependencies = generate_dependencies_zip(dependencies)
+        dependencies = build_dependencies_zip(dependencies)
 
     check_json(json_file=args.json)
 
@@ -63,9 +67,7 @@ def call_submit(args):
     # prep labels and add user
     labels_dict = kv_list_to_dict(args.label) if kv_list_to_dict(args.label) is not None else {}
     labels_dict['username'] = args.username.lower()
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
+    cromwell = get_cromwell(args.server)
     result = cromwell.jstart_workflow(wdl_file=args.wdl, json_file=args.json,
                                       dependencies=dependencies,
                                       disable_caching=args.disable_caching,
@@ -102,28 +104,43 @@ def call_query(args):
     :param args:  query subparser arguments.
     :return: A list of json responses based on queries selected by the user.
     """
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
+    from choppy.core.cromwell_pool import (ALL_SERVERS, find_workflow_server,
+                                           query_all, resolve_servers)
     from choppy.core.app_utils import kv_list_to_dict, parse_json
 
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
     responses = []
     if args.workflow_id is None or args.workflow_id == "None" and not args.label:
         return call_list(args)
+
+    server = args.server
+    if server == ALL_SERVERS and args.workflow_id != "None":
+        # A workflow is only known by the server that runs it.
+        server = find_workflow_server(args.workflow_id)
+        if server is None:
+            logger.critical("Workflow %s is not found in any server." % args.workflow_id)
+            sys.exit(exit_code.GENERAL_ERROR)
+        logger.debug("Workflow %s is found in %s." % (args.workflow_id, server))
+    cromwell = get_cromwell(server) if server != ALL_SERVERS else None
+
     if args.label:
         logger.debug("Label query requested.")
-        labeled = cromwell.query_labels(labels=kv_list_to_dict(args.label))
+        labels = kv_list_to_dict(args.label)
+        if args.server == ALL_SERVERS:
+            labeled = query_all(resolve_servers(args.server),
+                                lambda cromwell: cromwell.query_labels(labels=labels))
+        else:
+            labeled = cromwell.query_labels(labels=labels)
         responses.append(labeled)
-    if args.status:
+    if args.status and cromwell:
         logger.debug("Status requested.")
         status = cromwell.query_status(args.workflow_id)
         responses.append(status)
-    if args.metadata:
+    if args.metadata and cromwell:
         logger.debug("Metadata requested.")
         metadata = cromwell.query_metadata(args.workflow_id)
         responses.append(metadata)
-    if args.logs:
+    if args.logs and cromwell:
         logger.debug("Logs requested.")
         logs = cromwell.query_logs(args.workflow_id)
         responses.append(logs)
@@ -153,17 +170,71 @@ def call_validate(args):
         logger.info(s)
 
 
+def is_bulk(args):
+    from choppy.core.cromwell_pool import ALL_SERVERS
+
+    return bool(args.ids_file or args.project or args.query_label or args.server == ALL_SERVERS)
+
+
+def call_bulk(args, action, **kwargs):
+    """Run abort, label or restart on all workflows of --ids-file, --project and --query-label.
+
+    :param args: abort, label or restart subparser arguments.
+    :param action: abort, label or restart.
+    :return: a list of per-workflow results.
+    """
+    from choppy.core.bulk import (read_workflow_ids, query_workflow_ids, unique_targets,
+                                  run_bulk, write_report, DONE, SKIPPED, FAILED)
+    from choppy.core.cromwell_pool import resolve_servers
+
+    targets = []
+    if args.workflow_id and args.workflow_id != "None":
+        targets.append((args.workflow_id, None))
+    if args.ids_file:
+        targets.extend(read_workflow_ids(args.ids_file))
+    if args.project or args.query_label:
+        targets.extend(query_workflow_ids(resolve_servers(args.server), project_name=args.project,
+                                          labels=args.query_label))
+    targets = unique_targets(targets)
+    if not targets:
+        logger.warning("No workflow is found.")
+        return []
+
+    logger.info("%s %s workflows" % (action.capitalize(), len(targets)))
+    reports = run_bulk(action, targets, server=args.server, jobs=args.jobs, **kwargs)
+    print("workflow-id\tserver\tresult\tmessage")
+    for report in reports:
+        print("\t".join(str(value) for value in report.values()))
+    if args.report:
+        write_report(args.report, reports)
+
+    results = [report['result'] for report in reports]
+    logger.info("Done: %s, Skipped: %s, Failed: %s" %
+                tuple(results.count(result) for result in (DONE, SKIPPED, FAILED)))
+    if FAILED in results:
+        sys.exit(exit_code.GENERAL_ERROR)
+    return reports
+
+
+def check_workflow_id(args):
+    if not args.workflow_id or args.workflow_id == "None":
+        logger.critical("A workflow id, --ids-file, --project or --query-label is needed.")
+        sys.exit(exit_code.GENERAL_ERROR)
+
+
 def call_abort(args):
     """Abort a workflow with a given workflow id.
 
     :param args: abort subparser args.
     :return: JSON containing abort response.
     """
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
+
+    if is_bulk(args):
+        return call_bulk(args, 'abort')
+    check_workflow_id(args)
 
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
+    cromwell = get_cromwell(args.server)
     logger.info("Abort requested")
     return cromwell.stop_workflow(workflow_id=args.workflow_id)
 
@@ -175,24 +246,55 @@ def call_monitor(args):
     :return:
     """
     from choppy.core.cromwell import print_log_exit
+    from choppy.core.cromwell_pool import ALL_SERVERS, fan_out, find_workflow_server, resolve_servers
     from choppy.core.monitor import Monitor
 
     logger.info("Monitoring requested")
 
     logger.info("-------------Monitoring Workflow-------------")
     try:
+        servers = resolve_servers(args.server)
         if args.daemon:
-            m = Monitor(host=args.server, user="*", no_notify=args.no_notify,
-                        verbose=args.verbosity, interval=args.interval)
-            m.run()
-        else:
-            m = Monitor(host=args.server, user=args.username.lower(),
-                        no_notify=args.no_notify, verbose=args.verbosity,
-                        interval=args.interval)
-            if args.workflow_id:
-                m.monitor_workflow(args.workflow_id)
+            monitors = []
+
+            def run_daemon(server):
+                m = Monitor(host=server, user="*", no_notify=args.no_notify,
+                            verbose=args.verbosity, interval=args.interval,
+                            digest_window=getattr(args, 'digest_window', None))
+                monitors.append(m)
+                m.run()
+
+            def stop_daemons(signum, frame):
+                logger.info("Stopping the monitor, buffered notifications are sent.")
+                for m in monitors:
+                    m.stop()
+
+            # Monitors finish their polls and flush notifications when choppy is stopped.
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, stop_daemons)
+                signal.signal(signal.SIGINT, stop_daemons)
+
+            if len(servers) == 1:
+                run_daemon(servers[0])
             else:
-                m.monitor_user_workflows()
+                # Every server is polled in its own thread, they run until choppy is stopped.
+                fan_out(run_daemon, servers)
+        else:
+            if args.workflow_id and args.server == ALL_SERVERS:
+                server = find_workflow_server(args.workflow_id, servers)
+                if server is None:
+                    print_log_exit("Workflow %s is not found in any server." % args.workflow_id,
+                                   ple_logger=logger)
+                servers = [server, ]
+
+            for server in servers:
+                m = Monitor(host=server, user=args.username.lower(),
+                            no_notify=args.no_notify, verbose=args.verbosity,
+                            interval=args.interval)
+                if args.workflow_id:
+                    m.monitor_workflow(args.workflow_id)
+                else:
+                    m.monitor_user_workflows()
     except Exception as e:
         print_log_exit(msg=str(e), sys_exit=False, ple_logger=logger)
 
@@ -203,21 +305,29 @@ def call_restart(args):
     :param args: restart subparser arguments.
     :return:
     """
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
+    from choppy.core.bulk import restart_workflow, DONE, SKIPPED
+    from choppy.core.app_utils import get_app_root_dir
+
+    # Cromwell doesn't keep the zip of imported WDLs, it's found in the project or the app.
+    project_dir = os.path.join(args.working_dir, args.project_dir or args.project or '')
+    app_dir = os.path.join(get_app_root_dir(), args.app_name) if args.app_name else None
+    kwargs = dict(disable_caching=args.disable_caching, project_dir=project_dir, app_dir=app_dir)
+    if is_bulk(args):
+        return call_bulk(args, 'restart', **kwargs)
+    check_workflow_id(args)
 
     logger.info("Restart requested")
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
-    result = cromwell.restart_workflow(workflow_id=args.workflow_id,
-                                       disable_caching=args.disable_caching)
-
-    if result is not None and "id" in result:
-        msg = "Workflow restarted successfully; new workflow-id: " + str(result['id'])
-        logger.info(msg)
+    cromwell = get_cromwell(args.server)
+    result, message = restart_workflow(cromwell, args.workflow_id, **kwargs)
+
+    if result == DONE:
+        logger.info("Workflow restarted successfully; new workflow-id: %s" % message)
+    elif result == SKIPPED:
+        logger.warning("Workflow is not restarted: %s" % message)
     else:
-        msg = "Workflow was not restarted successfully; server response: " + str(result)
-        logger.critical(msg)
+        logger.critical("Workflow was not restarted successfully: %s" % message)
+        sys.exit(exit_code.GENERAL_ERROR)
 
 
 def get_cromwell_links(server, workflow_id, port):
@@ -233,12 +343,10 @@ def get_cromwell_links(server, workflow_id, port):
 
 
 def call_explain(args):
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
 
     logger.info("Explain requested")
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
+    cromwell = get_cromwell(args.server)
     (result, additional_res, stdout_res) = cromwell.explain_workflow(workflow_id=args.workflow_id,
                                                                      include_inputs=args.input)
 
@@ -286,18 +394,21 @@ def call_explain(args):
 
 def call_list(args):
     from choppy.core.monitor import Monitor
+    from choppy.core.cromwell_pool import ALL_SERVERS, fan_out, merge_query_results, resolve_servers
     from choppy.core.app_utils import parse_json
 
     username = "*" if args.all else args.username.lower()
-    m = Monitor(host=args.server, user=username, no_notify=True, verbose=True,
-                interval=None)
+    monitors = OrderedDict((server, Monitor(host=server, user=username, no_notify=True,
+                                            verbose=True, interval=None))
+                           for server in resolve_servers(args.server))
 
     def get_iso_date(dt):
         tz = pytz.timezone("US/Eastern")
         return tz.localize(dt).isoformat()
 
     def process_job(job):
-        links = get_cromwell_links(args.server, job['id'], m.cromwell.port)
+        server = job.get('server', args.server)
+        links = get_cromwell_links(server, job['id'], monitors[server].cromwell.port)
         job['metadata'] = links['metadata']
         job['timing'] = links['timing']
         return job
@@ -312,7 +423,13 @@ def call_list(args):
         return pprint._safe_repr(object, context, maxlevels, level)
 
     start_date_str = get_iso_date(datetime.datetime.now() - datetime.timedelta(days=int(args.days)))
-    q = m.get_user_workflows(raw=True, start_time=start_date_str)
+    if args.server == ALL_SERVERS:
+        print('Determining {}\'s workflows in all servers...'.format(username))
+        responses, _ = fan_out(lambda server: monitors[server].get_user_workflows(
+            raw=True, start_time=start_date_str, silent=True), list(monitors))
+        q = merge_query_results(responses)
+    else:
+        q = monitors[args.server].get_user_workflows(raw=True, start_time=start_date_str)
     try:
         result = q["results"]
         if args.filter:
@@ -331,13 +448,18 @@ def call_label(args):
     :param args: label subparser arguments
     :return:
     """
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
     from choppy.core.app_utils import kv_list_to_dict
 
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
     labels_dict = kv_list_to_dict(args.label)
+    if not labels_dict:
+        logger.critical("No labels, please specify them by -l key:value.")
+        sys.exit(exit_code.GENERAL_ERROR)
+    if is_bulk(args):
+        return call_bulk(args, 'label', labels=labels_dict)
+    check_workflow_id(args)
+
+    cromwell = get_cromwell(args.server)
     response = cromwell.label_workflow(workflow_id=args.workflow_id, labels=labels_dict)
     if response.status_code == 200:
         logger.info("Labels successfully applied:\n{}".format(response.content))
@@ -351,7 +473,7 @@ def call_log(args):
     :param args: log subparser arguments.
     :return:
     """
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
     from choppy.core.oss import run_copy_files
     from choppy.core.app_utils import parse_json
 
@@ -359,10 +481,7 @@ def call_log(args):
                                  args.workflow_id, re.M | re.I)
 
     if matchedWorkflowId:
-        section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-        host, port, auth = global_config.get_conn_info(args.server, section_name)
-
-        cromwell = Cromwell(host, port, auth)
+        cromwell = get_cromwell(args.server)
         res = cromwell.get('logs', args.workflow_id)
         if res.get('calls'):
             logger.info("\n%s\n" % json.dumps(parse_json(res["calls"]), indent=2, sort_keys=True))
@@ -427,9 +546,10 @@ def call_email(args):
 
 
 def call_list_apps(args):
-    from choppy.core.app_utils import listapps
+    from choppy.core.app_registry import get_registry
 
-    apps = listapps()
+    registry = get_registry()
+    apps = registry.reindex() if args.reindex else registry.names()
     if len(apps) > 0:
         print(apps)
     else:
@@ -443,14 +563,18 @@ def call_batch(args):
     app_root_dir = get_app_root_dir()
     app_dir = os.path.join(app_root_dir, args.app_name)
     project_name = args.project_name
-    samples = args.samples
+    samples = os.path.join(args.working_dir, args.samples)
+    if not os.path.exists(samples):
+        logger.critical("%s is not a valid file/directory path." % args.samples)
+        sys.exit(exit_code.GENERAL_ERROR)
     label = args.label
     server = args.server
     dry_run = args.dry_run
     username = args.username.lower()
     force = args.force
     is_valid_app(app_dir)
-    run_batch(project_name, app_dir, samples, label, server, username, dry_run, force)
+    run_batch(project_name, app_dir, samples, label, server, username, dry_run, force,
+              validate=args.validate, working_dir=args.working_dir)
 
 
 def call_test(args):
@@ -488,8 +612,18 @@ def call_testapp(args):
     run_batch(project_name, app_dir, samples, label, server, username, dry_run, force=force)
 
 
+def call_rerun(args):
+    from choppy.core.workflow import rerun_project
+
+    result = rerun_project(args.project_name, server=args.server, username=args.username.lower(),
+                           jobs=args.jobs, dry_run=args.dry_run)
+    if result['failed']:
+        sys.exit(exit_code.GENERAL_ERROR)
+
+
 def call_installapp(args):
     from choppy.core.app_utils import parse_app_name, install_app, get_app_root_dir
+    from choppy.core.app_registry import get_registry
     choppy_app = args.choppy_app
     force = args.force
 
@@ -504,12 +638,14 @@ def call_installapp(args):
         app_name_lst.append('%s/%s-%s' % (namespace, app_name, version))
 
     app_root_dir = get_app_root_dir()
+    registry = get_registry(app_root_dir)
     for app_name in app_name_lst:
         app_path = os.path.join(app_root_dir, app_name)
         # Overwrite If an app is installed.
-        if os.path.exists(app_path):
+        if app_name in registry or os.path.exists(app_path):
             if force:
                 shutil.rmtree(app_path, ignore_errors=True)
+                registry.remove(app_name)
             else:
                 print("%s is installed. If you want to reinstall, you can specify a --force flag." % app_name)
                 sys.exit(exit_code.APP_IS_INSTALLED)
@@ -528,6 +664,31 @@ def call_uninstallapp(args):
     uninstall_app(app_dir)
 
 
+def call_build(args):
+    from choppy.core.app_bundle import build_bundle
+    from choppy.core.app_utils import is_valid_app, get_app_root_dir
+
+    app_dir = os.path.join(get_app_root_dir(), args.app_name)
+    is_valid_app(app_dir)
+    bundle = build_bundle(app_dir)
+    logger.success("Build %s successfully: %s" % (args.app_name, bundle.bundle_dir))
+
+
+def call_server(args):
+    from choppy.core.server import serve, get_socket_path
+
+    socket_path = args.socket or get_socket_path()
+    if not socket_path:
+        logger.critical("No socket path, please set server_socket in choppy.conf or specify --socket.")
+        sys.exit(exit_code.GENERAL_ERROR)
+
+    try:
+        serve(socket_path)
+    except OSError as err:
+        logger.critical(str(err))
+        sys.exit(exit_code.GENERAL_ERROR)
+
+
 def call_list_files(args):
     from subprocess import CalledProcessError, check_output
 
@@ -605,8 +766,31 @@ def call_cp_remote_files(args):
     run_copy_files(src_oss_link, dest_oss_link, include, exclude)
 
 
+def call_sync(args):
+    from choppy.core.oss_sync import sync
+
+    if not args.src.startswith('oss://') and not args.dest.startswith('oss://'):
+        raise argparse.ArgumentTypeError('One of src and dest must be an oss link.')
+
+    for path in (args.src, args.dest):
+        if path.startswith('oss://'):
+            is_valid_oss_link(path)
+
+    try:
+        manifest = sync(args.src, args.dest, include=args.include, exclude=args.exclude,
+                        jobs=args.jobs, dry_run=args.dry_run, manifest=args.manifest)
+    except ChecksumError as err:
+        logger.critical(str(err))
+        sys.exit(exit_code.GENERAL_ERROR)
+    failed = [record for record in manifest['files'] if not record.get('verified')]
+    if failed and not args.dry_run:
+        logger.error("%s files are not verified, see the manifest for more details." % len(failed))
+        sys.exit(exit_code.GENERAL_ERROR)
+
+
 def call_search(args):
-    from choppy.core.cromwell import Cromwell
+    from choppy.core.cromwell import get_cromwell
+    from choppy.core.cromwell_pool import ALL_SERVERS, query_all, resolve_servers
     from choppy.core.app_utils import parse_json
 
     status = args.status
@@ -624,19 +808,26 @@ def call_search(args):
     if status:
         query_dict.update({"status": status})
 
-    section_name = 'remote_%s' % args.server if args.server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(args.server, section_name)
-    cromwell = Cromwell(host, port, auth)
-    res = cromwell.query(query_dict)
+    if args.server == ALL_SERVERS:
+        res = query_all(resolve_servers(args.server), lambda cromwell: cromwell.query(query_dict))
+    else:
+        cromwell = get_cromwell(args.server)
+        res = cromwell.query(query_dict)
 
     if short_format:
-        print("workflow-id\tsample-id")
+        if args.server == ALL_SERVERS:
+            print("workflow-id\tsample-id\tserver")
+        else:
+            print("workflow-id\tsample-id")
         for result in res['results']:
             sample_id = result.get('labels').get('sample-id')
             if not sample_id:
                 sample_id = ""
 
-            print("%s\t%s" % (result.get('id'), sample_id.upper()))
+            if args.server == ALL_SERVERS:
+                print("%s\t%s\t%s" % (result.get('id'), sample_id.upper(), result['server']))
+            else:
+                print("%s\t%s" % (result.get('id'), sample_id.upper()))
     else:
         results = parse_json(res['results'])
         if len(results) > 0:
@@ -753,7 +944,8 @@ def call_save(args):
     msg = args.message
 
     check_dir(project_path, skip=True)
-    git = Git()
+    max_file_size = args.max_file_size * 1024 * 1024 if args.max_file_size else None
+    git = Git(max_file_size=max_file_size)
     git.init_repo(project_path)
 
     # Local Commit
@@ -826,9 +1018,12 @@ Choppy App Management:
     apps        List all apps that is supported by choppy.
     test        Run app test case.
     testapp     Test an app.
+    rerun       Rerun the failed and aborted workflows of a project.
     scaffold    Generate scaffold for a choppy app.
     install     Install an app.
     uninstall   Uninstall an app.
+    build       Build the bundle of an app.
+    server      Run a choppy server, batch/query/search are forwarded to it.
     samples     Generate or check samples file.
     search      Query cromwell for information on the submitted workflow.
     man         Get manual about app.
@@ -838,6 +1033,7 @@ OSS Management:
     upload      Upload file/directory to the specified bucket.
     download    Download file/directory to the specified bucket.
     copy        Copy file/directory from an oss path to another.
+    sync        Sync file/directory between local and oss by checksum.
     catlog      Cat log file.
 
 Project Management:
@@ -848,8 +1044,28 @@ Project Management:
 """
 
 
-def parse_args():
+def build_parser():
+    """Build the parser of all commands, choices of app names are listed from the app registry."""
     from choppy.core.app_utils import listapps
+    from choppy.core.cromwell_pool import ALL_SERVERS
+
+    # query, search, monitor, batch and bulk operations can work with all servers at once.
+    all_servers = global_config.servers + [ALL_SERVERS, ]
+
+    def add_bulk_arguments(subparser):
+        group = subparser.add_argument_group('bulk operation', 'Handle many workflows at once, '
+                                             'every workflow gets a result.')
+        group.add_argument('-F', '--ids-file', action='store', type=is_valid,
+                           help='A file with one workflow id per line, or a csv file with a workflow_id '
+                           'column, e.g. submitted.csv.')
+        group.add_argument('--project', action='store', type=is_valid_project_name,
+                           help='All workflows of a project.')
+        group.add_argument('--query-label', action='append',
+                           help='All workflows with a key:value label. May be used multiple times.')
+        group.add_argument('-j', '--jobs', action='store', type=int, default=8,
+                           help='The number of workflows that are handled at the same time.')
+        group.add_argument('--report', action='store', default=None,
+                           help='Save the result of every workflow into a csv file.')
 
     parser = argparse.ArgumentParser(
         description='Description: A tool for executing and monitoring WDLs to Cromwell instances.',
@@ -868,12 +1084,19 @@ def parse_args():
                              description='Restart a submitted workflow.',
                              usage='choppy restart <workflow id> [<args>]',
                              formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    restart.add_argument('workflow_id', action='store', help='workflow id of workflow to restart.')
+    restart.add_argument('workflow_id', action='store', nargs='?', default="None",
+                         help='workflow id of workflow to restart.')
     restart.add_argument('-S', '--server', action='store', default="localhost", type=str,
-                         choices=global_config.servers,
-                         help='Choose a cromwell server from {}'.format(global_config.servers))
+                         choices=all_servers,
+                         help='Choose a cromwell server from {}'.format(all_servers))
     restart.add_argument('-M', '--monitor', action='store_true', default=False, help=argparse.SUPPRESS)
     restart.add_argument('-D', '--disable_caching', action='store_true', default=False, help="Don't used cached data.")
+    restart.add_argument('--project-dir', action='store',
+                         help='The project directory of choppy batch, tasks of the samples are submitted with '
+                         'workflows. The default is --project or the working directory.')
+    restart.add_argument('--app-name', action='store', choices=listapps(),
+                         help='The app of workflows, its tasks are used when the project has none.')
+    add_bulk_arguments(restart)
     restart.set_defaults(func=call_restart)
 
     explain = sub.add_parser(name='explain',
@@ -903,11 +1126,13 @@ def parse_args():
                            description='Abort a submitted workflow.',
                            usage='choppy abort <workflow id> [<args>]',
                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    abort.add_argument('workflow_id', action='store', help='workflow id of workflow to abort.')
+    abort.add_argument('workflow_id', action='store', nargs='?', default="None",
+                       help='workflow id of workflow to abort.')
     abort.add_argument('-S', '--server', action='store', default="localhost", type=str,
-                       choices=global_config.servers,
-                       help='Choose a cromwell server from {}'.format(global_config.servers))
+                       choices=all_servers,
+                       help='Choose a cromwell server from {}'.format(all_servers))
     abort.add_argument('-M', '--monitor', action='store_false', default=False, help=argparse.SUPPRESS)
+    add_bulk_arguments(abort)
     abort.set_defaults(func=call_abort)
 
     monitor = sub.add_parser(name='monitor',
@@ -926,11 +1151,15 @@ def parse_args():
     monitor.add_argument('-n', '--no_notify', action='store_true', default=False,
                          help='When selected, disable choppy e-mail notification of workflow completion.')
     monitor.add_argument('-S', '--server', action='store', default="localhost", type=str,
-                         choices=global_config.servers,
-                         help='Choose a cromwell server from {}'.format(global_config.servers))
+                         choices=all_servers,
+                         help='Choose a cromwell server from {}'.format(all_servers))
     monitor.add_argument('-M', '--monitor', action='store_true', default=True, help=argparse.SUPPRESS)
     monitor.add_argument('-D', '--daemon', action='store_true', default=False,
                          help="Specify if this is a daemon for all users.")
+    monitor.add_argument('-W', '--digest-window', action='store', default=None, type=int,
+                         help="Daemon only. Group finished workflows per user and project, and send one "
+                         "email every n seconds. 0 means one email per workflow. "
+                         "The default is digest_window in the email section of config file.")
     monitor.set_defaults(func=call_monitor)
 
     query = sub.add_parser(name='query',
@@ -946,8 +1175,8 @@ def parse_args():
     query.add_argument('-L', '--label', action='append', help='Query status of all workflows with specific label(s).')
     query.add_argument('-d', '--days', action='store', default=7, help='Last n days to query.')
     query.add_argument('-S', '--server', action='store', default="localhost", type=str,
-                       choices=global_config.servers,
-                       help='Choose a cromwell server from {}'.format(global_config.servers))
+                       choices=all_servers,
+                       help='Choose a cromwell server from {}'.format(all_servers))
     query.add_argument('-f', '--filter', action='append', type=str, choices=global_config.status_list,
                        help='Filter by a workflow status from those listed above. May be specified more than once.')
     query.add_argument('-a', '--all', action='store_true', default=False, help='Query for all users.')
@@ -999,10 +1228,11 @@ def parse_args():
                            usage='choppy label <workflow_id> [<args>]',
                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     label.add_argument('workflow_id', nargs='?', default="None", help='workflow id for workflow to label.')
-    label.add_argument('-S', '--server', action='store', type=str, choices=global_config.servers, default="localhost",
-                       help='Choose a cromwell server from {}'.format(global_config.servers))
+    label.add_argument('-S', '--server', action='store', type=str, choices=all_servers, default="localhost",
+                       help='Choose a cromwell server from {}'.format(all_servers))
     label.add_argument('-l', '--label', action='append', help='A key:value pair to assign. May be used multiple times.')
     label.add_argument('-M', '--monitor', action='store_false', default=False, help=argparse.SUPPRESS)
+    add_bulk_arguments(label)
     label.set_defaults(func=call_label)
 
     email = sub.add_parser(name='email',
@@ -1025,7 +1255,8 @@ def parse_args():
                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     batch.add_argument('app_name', action='store', choices=listapps(), metavar="app_name",
                        help='The app name for your project.')
-    batch.add_argument('samples', action='store', type=is_valid, help='Path the samples file to validate.')
+    # Checked by call_batch, a relative path is resolved against the working directory.
+    batch.add_argument('samples', action='store', help='Path the samples file to validate.')
     batch.add_argument('-p', '--project-name', action='store', type=is_valid_project_name,
                        required=True, help='Your project name.')
     batch.add_argument('-D', '--dry-run', action='store_true', default=False,
@@ -1033,9 +1264,12 @@ def parse_args():
     batch.add_argument('-l', '--label', action='append',
                        help='A key:value pair to assign. May be used multiple times.')
     batch.add_argument('-S', '--server', action='store', default='localhost', type=str,
-                       help='Choose a cromwell server.', choices=global_config.servers)
+                       help='Choose a cromwell server, all means samples are spread across all servers '
+                       'by their running and queued workflows.', choices=all_servers)
     batch.add_argument('-f', '--force', action='store_true', default=False,
                        help='Force to overwrite files.')
+    batch.add_argument('-v', '--validate', action='store_true', default=False,
+                       help='Validate inputs of all samples against the WDL before submitting.')
     batch.add_argument('-u', '--username', action='store', default=global_config.getuser(),
                        type=is_valid_label, help=argparse.SUPPRESS)
     batch.set_defaults(func=call_batch)
@@ -1080,6 +1314,23 @@ def parse_args():
                          type=is_valid_label, help=argparse.SUPPRESS)
     testapp.set_defaults(func=call_testapp)
 
+    rerun = sub.add_parser(name="rerun",
+                           description="Submit the failed and aborted workflows of a project again, "
+                           "with call caching, only the failed calls are run again.",
+                           usage="choppy rerun <project_name> [<args>]",
+                           formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    rerun.add_argument('project_name', action='store', type=is_valid_project_name,
+                       help='The project in the current directory.')
+    rerun.add_argument('-S', '--server', action='store', default='localhost', type=str, choices=all_servers,
+                       help='The cromwell server of samples that are not marked with a server in submitted.csv.')
+    rerun.add_argument('-j', '--jobs', action='store', type=int, default=8,
+                       help='The number of workflows that are submitted at the same time.')
+    rerun.add_argument('-D', '--dry-run', action='store_true', default=False,
+                       help='Only show the samples to rerun.')
+    rerun.add_argument('-u', '--username', action='store', default=global_config.getuser(),
+                       type=is_valid_label, help=argparse.SUPPRESS)
+    rerun.set_defaults(func=call_rerun)
+
     installapp = sub.add_parser(name="install",
                                 description="Install an app from a zip file or choppy store.",
                                 usage="choppy install <choppy_app> [<args>]",
@@ -1098,10 +1349,29 @@ def parse_args():
                               help='App name.', choices=listapps())
     uninstallapp.set_defaults(func=call_uninstallapp)
 
+    build = sub.add_parser(name="build",
+                           description="Build the bundle of an app, it's used by batch, samples and config.",
+                           usage="choppy build app_name",
+                           formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    build.add_argument('app_name', action='store', metavar="app_name",
+                       help='App name.', choices=listapps())
+    build.set_defaults(func=call_build)
+
+    server = sub.add_parser(name="server",
+                            description="Run a choppy server with warm caches, "
+                                        "batch/query/search/monitor are forwarded to it when it's running.",
+                            usage="choppy server [<args>]",
+                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    server.add_argument('--socket', action='store', default=None,
+                        help='Unix socket path, the default is server_socket in choppy.conf.')
+    server.set_defaults(func=call_server)
+
     wdllist = sub.add_parser(name="apps",
                              description="List all apps that is supported by choppy.",
-                             usage="choppy apps",
+                             usage="choppy apps [--reindex]",
                              formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    wdllist.add_argument('--reindex', action='store_true', default=False,
+                         help='Rebuild the app registry from the app root directory.')
     wdllist.set_defaults(func=call_list_apps)
 
     listfiles = sub.add_parser(name="listfiles",
@@ -1147,6 +1417,23 @@ def parse_args():
     copy_files.add_argument('--exclude', action='store', help='Exclude Pattern of key, e.g., *.txt')
     copy_files.set_defaults(func=call_cp_remote_files)
 
+    sync_files = sub.add_parser(name="sync",
+                                description="Sync file/directory between local and oss, "
+                                "only the files that differ in checksum will be transferred.",
+                                usage="choppy sync <src> <dest> [<args>]",
+                                formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    sync_files.add_argument('src', action='store', help='Local path or OSS Link.')
+    sync_files.add_argument('dest', action='store', help='Local path or OSS Link.')
+    sync_files.add_argument('-j', '--jobs', action='store', default=4, type=int,
+                            help='The number of parallel transfers.')
+    sync_files.add_argument('--include', action='store', help='Include Pattern of key, e.g., *.jpg')
+    sync_files.add_argument('--exclude', action='store', help='Exclude Pattern of key, e.g., *.txt')
+    sync_files.add_argument('--manifest', action='store',
+                            help='Manifest file name, the default is in the log_dir.')
+    sync_files.add_argument('-D', '--dry-run', action='store_true', default=False,
+                            help='Compare all files but skipping transfer.')
+    sync_files.set_defaults(func=call_sync)
+
     cat_file = sub.add_parser(name="catlog",
                               description="Cat log file.",
                               usage="choppy catlog <oss_link>",
@@ -1193,8 +1480,8 @@ def parse_args():
                         help="Show by short format, if the option is not specified, show long format by default.")
     search.add_argument('-u', '--username', action='store', default=global_config.getuser(), type=is_valid_label,
                         help='Owner of workflows to query.')
-    search.add_argument('-S', '--server', action='store', default="localhost", type=str, choices=global_config.servers,
-                        help='Choose a cromwell server from {}'.format(global_config.servers))
+    search.add_argument('-S', '--server', action='store', default="localhost", type=str, choices=all_servers,
+                        help='Choose a cromwell server from {}'.format(all_servers))
     search.set_defaults(func=call_search)
 
     version = sub.add_parser(name="version",
@@ -1223,6 +1510,8 @@ def parse_args():
     save.add_argument('-u', '--username', action='store', type=is_valid_label,
                       help='Owner of remote git repo.')
     save.add_argument('-m', '--message', action='store', help='The comment of your project.')
+    save.add_argument('--max-file-size', action='store', type=int, default=None,
+                      help='Files larger than it (MB) are not saved, only their sha256 are recorded.')
     save.set_defaults(func=call_save)
 
     clone = sub.add_parser(name="clone",
@@ -1253,8 +1542,19 @@ def parse_args():
                           help='Template name that you want to generate')
     scaffold.set_defaults(func=call_scaffold)
 
+    return parser
+
+
+def parse_args(argv=None, parser=None, working_dir=None):
+    """Parse a command line.
+
+    :param parser: a parser from build_parser, it's built if not given.
+    :param working_dir: relative paths of the command line are resolved against it, the default is cwd.
+    """
+    parser = parser or build_parser()
     argcomplete.autocomplete(parser)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    args.working_dir = working_dir or os.getcwd()
     # Fix bug1: user need to set choppy.conf before running choppy.
     # Fix bug2: Python argparse args has no attribute func
     # For more details: https://stackoverflow.com/a/54161510
@@ -1272,45 +1572,71 @@ def parse_args():
     return args
 
 
-def main():
-    args = parse_args()
+def run(args):
+    if hasattr(args, 'project_name'):
+        check_identifier(args.project_name)
+
+    try:
+        args.func(args)
+    except requests.exceptions.ConnectionError as err:
+        # Cromwell clients connect on the first request, not when they are created.
+        logger.critical("Unable to connect to Cromwell: %s" % err)
+        sys.exit(exit_code.GENERAL_ERROR)
+    except AttributeError:
+        print("Missing argument('%s --help' for help)" % sys.argv[0])
+        print(description)
+
 
+def get_loglevel(args):
     if args.debug:
-        loglevel = logging.DEBUG
+        return logging.DEBUG
     elif args.verbose:
         verbose = args.verbose
         # Configure logger for requested verbosity.
         if verbose >= 3:
-            loglevel = logging.SPAM
+            return logging.SPAM
         elif verbose >= 2:
-            loglevel = logging.DEBUG
-        elif verbose >= 1:
-            loglevel = logging.VERBOSE
+            return logging.DEBUG
+        return logging.VERBOSE
     elif args.quite:
-        loglevel = logging.ERROR
-    else:
-        loglevel = global_config.get('general', 'log_level')
+        return logging.ERROR
+    return global_config.get('general', 'log_level')
 
-    user = global_config.getuser()
-    # Get user's username so we can tag workflows and logs for them.
+
+def get_logger_args(args):
+    """Get the arguments of set_logger for a command line, a project has its own log.
+
+    :return: (log_name, kwargs).
+    """
     log_dir = global_config.get_path('general', 'log_dir')
+    log_kwargs = dict(loglevel=get_loglevel(args), handler=args.handler, log_dir=log_dir)
     if hasattr(args, 'project_name'):
-        check_identifier(args.project_name)
-        set_logger(args.project_name, loglevel=loglevel,
-                   handler=args.handler, log_dir=log_dir)
-    else:
-        set_logger(user, loglevel=loglevel, handler=args.handler,
-                   subdir=None, log_dir=log_dir)
+        return args.project_name, log_kwargs
+    # Get user's username so we can tag workflows and logs for them.
+    return global_config.getuser(), dict(log_kwargs, subdir=None)
+
 
+def clean_cache():
     # Clean up the temp directory
     if global_config.get_boolean('general', 'clean_cache'):
         clean_temp(global_config.get_path('general', 'tmp_dir'))
 
-    try:
-        args.func(args)
-    except AttributeError:
-        print("Missing argument('%s --help' for help)" % sys.argv[0])
-        print(description)
+
+def main():
+    from choppy.core.server import forward
+
+    # Run by the choppy server if it's running, the caches are warm there.
+    code = forward(sys.argv[1:])
+    if code is not None:
+        return code
+
+    args = parse_args()
+
+    log_name, log_kwargs = get_logger_args(args)
+    set_logger(log_name, **log_kwargs)
+    clean_cache()
+
+    run(args)
 
 
 if __name__ == "__main__":
@@ -7,4 +7,4 @@
     :license: AGPL, see LICENSE.md for more details.
 """
 
-from .config import ChoppyConfig, Section, init_config, get_global_config
+from .config import ChoppyConfig, Section, init_config, get_global_config, set_global_config
@@ -349,6 +349,12 @@ def init_config(config_file=None, chosen_conf_key=None, format='ini'):
         pass
 
 
+def set_global_config(config):
+    """The config is thread local, a thread can share the config of another thread."""
+    global g
+    g.config = config
+
+
 def get_global_config():
     global g
     if hasattr(g, 'config'):
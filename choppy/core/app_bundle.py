@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.app_bundle
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Prebuilt app bundles. A bundle keeps the precompiled templates, the
+    template variables, the WDL input signature and the dependencies zip of
+    an app, so they are not computed again by every batch.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from jinja2 import Environment, FileSystemLoader, ModuleLoader, meta
+from choppy.core.app_registry import template_hashes
+from choppy.exceptions import WdlParseError, WomtoolError
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_DIR = '.choppy-build'
+BUNDLE_FORMAT = 2
+TEMPLATE_FILES = ('inputs', 'workflow.wdl')
+MANIFEST_FILE = 'manifest.json'
+TEMPLATES_ZIP = 'templates.zip'
+TASKS_ZIP = 'tasks.zip'
+
+WORKFLOW_NAME_PATTERN = re.compile(r'^(\s*workflow\s+)([^\s{]+)', re.MULTILINE)
+WDL_COMMENT_PATTERN = re.compile(r'#.*$', re.MULTILINE)
+# Two sets of placeholders with different lengths, a variable that changes the WDL changes its rendering.
+PLACEHOLDERS = ('choppy_a_%s', 'choppy_bb_%s')
+
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+
+def sha256sum(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def bundle_key(app_dir):
+    """The key of a bundle, it's changed with the templates and the tasks.
+
+    Templates are hashed by content, tasks by their paths, sizes and mtimes.
+    Defaults are not a part of the key, they are read at run time.
+    """
+    app_dir = os.path.abspath(app_dir)
+    sha = hashlib.sha256()
+    hashes = template_hashes(app_dir)
+    for filename in TEMPLATE_FILES:
+        sha.update(('%s\0%s\0' % (filename, hashes.get(filename))).encode('utf-8'))
+
+    tasks_dir = os.path.join(app_dir, 'tasks')
+    for root, dirs, files in os.walk(tasks_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            stat = os.stat(filepath)
+            sha.update(('%s\0%s\0%s\0' % (os.path.relpath(filepath, tasks_dir),
+                                          stat.st_size, stat.st_mtime)).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+class AppBundle:
+    """A built bundle, it's never changed after it's built."""
+
+    def __init__(self, app_dir, bundle_dir):
+        self.app_dir = app_dir
+        self.bundle_dir = bundle_dir
+        with open(os.path.join(bundle_dir, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        self.env = Environment(loader=ModuleLoader(os.path.join(bundle_dir, TEMPLATES_ZIP)))
+
+    @property
+    def signature(self):
+        """The input signature of the app without the workflow name, e.g. {'threads': 'Int'}.
+        None if template variables may change the inputs of samples."""
+        return self.manifest['signature']
+
+    def get_signature(self, wdl):
+        """Get the input signature of a rendered WDL, the same as get_wdl_signature.
+
+        :param wdl: the workflow.wdl of a sample.
+        :return: a dict, {param: type}, None if it's not known by the bundle.
+        """
+        matched = WORKFLOW_NAME_PATTERN.search(wdl)
+        if self.signature is None or matched is None:
+            return None
+        return dict(('%s.%s' % (matched.group(2), param), param_type)
+                    for param, param_type in self.signature.items())
+
+    def get_vars(self, template_file):
+        return set(self.manifest['variables'][template_file])
+
+    def render(self, template_file, data):
+        return self.env.get_template(template_file).render(**data)
+
+    def dependencies_zip(self):
+        tasks_zip = os.path.join(self.bundle_dir, TASKS_ZIP)
+        if os.path.isfile(tasks_zip):
+            with open(tasks_zip, 'rb') as f:
+                return f.read()
+
+    def verify(self):
+        """Check the content hashes of all bundle files."""
+        for filename, digest in self.manifest['files'].items():
+            if sha256sum(os.path.join(self.bundle_dir, filename)) != digest:
+                return False
+        return True
+
+
+def _normalize_wdl(wdl):
+    """Remove comments and the workflow name, they don't change the inputs."""
+    return WORKFLOW_NAME_PATTERN.sub(r'\1_', WDL_COMMENT_PATTERN.sub('', wdl))
+
+
+def get_template_signature(app_dir, variables):
+    """Get the WDL input signature of the workflow template.
+
+    It's the signature of every sample only if template variables can't
+    change the inputs: the template is rendered with two sets of placeholders,
+    and the results may only differ in comments and the workflow name.
+
+    :return: a dict, {param: type}, params are without the workflow name.
+             None if it's not the same for all samples or it can't be computed.
+    """
+    from choppy.core.wdl_signature import get_wdl_signature
+
+    template = Environment(loader=FileSystemLoader(app_dir)).get_template('workflow.wdl')
+    wdls = [template.render(**dict((var, placeholder % var) for var in variables))
+            for placeholder in PLACEHOLDERS]
+    if _normalize_wdl(wdls[0]) != _normalize_wdl(wdls[1]):
+        logger.debug("Template variables may change the inputs of %s, the signature is not kept." % app_dir)
+        return None
+    workflow_name = WORKFLOW_NAME_PATTERN.search(wdls[0])
+    if workflow_name is None:
+        return None
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmp_dir, 'workflow.wdl'), 'w') as f:
+            f.write(wdls[0])
+        if os.path.isdir(os.path.join(app_dir, 'tasks')):
+            shutil.copytree(os.path.join(app_dir, 'tasks'), os.path.join(tmp_dir, 'tasks'))
+        signature = get_wdl_signature(os.path.join(tmp_dir, 'workflow.wdl'))
+    except (WdlParseError, WomtoolError, OSError) as err:
+        logger.warning("Can't get the input signature of %s: %s" % (app_dir, err))
+        return None
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    prefix = workflow_name.group(2) + '.'
+    if not all(param.startswith(prefix) for param in signature):
+        return None
+    return dict((param[len(prefix):], param_type) for param, param_type in signature.items())
+
+
+def build_bundle(app_dir):
+    """Build the bundle of an app into app_dir/.choppy-build/<key>.
+
+    The bundle is written in a staging directory and renamed into place,
+    older bundles of the app are removed.
+
+    :return: an AppBundle object.
+    """
+    from choppy.core.app_utils import build_dependencies_zip, get_version
+
+    app_dir = os.path.abspath(app_dir)
+    key = bundle_key(app_dir)
+    builds_dir = os.path.join(app_dir, BUNDLE_DIR)
+    bundle_dir = os.path.join(builds_dir, key)
+    if not os.path.isdir(builds_dir):
+        os.makedirs(builds_dir)
+
+    staging_dir = tempfile.mkdtemp(dir=builds_dir, prefix='.staging-')
+    try:
+        env = Environment(loader=FileSystemLoader(app_dir))
+        variables = {}
+        for template_file in TEMPLATE_FILES:
+            source = env.loader.get_source(env, template_file)[0]
+            variables[template_file] = sorted(meta.find_undeclared_variables(env.parse(source)))
+
+        env.compile_templates(os.path.join(staging_dir, TEMPLATES_ZIP), zip='deflated',
+                              filter_func=lambda name: name in TEMPLATE_FILES,
+                              ignore_errors=False)
+
+        tasks_dir = os.path.join(app_dir, 'tasks')
+        if os.path.isdir(tasks_dir):
+            with open(os.path.join(staging_dir, TASKS_ZIP), 'wb') as f:
+                f.write(build_dependencies_zip(tasks_dir))
+
+        all_variables = set(variables['inputs']) | set(variables['workflow.wdl'])
+        files = dict((filename, sha256sum(os.path.join(staging_dir, filename)))
+                     for filename in os.listdir(staging_dir))
+        manifest = {
+            'format': BUNDLE_FORMAT,
+            'key': key,
+            'app_version': get_version(app_dir),
+            'templates': template_hashes(app_dir),
+            'variables': variables,
+            'signature': get_template_signature(app_dir, all_variables),
+            'files': files
+        }
+        with open(os.path.join(staging_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        if os.path.isdir(bundle_dir):
+            shutil.rmtree(bundle_dir)
+        os.rename(staging_dir, bundle_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    for name in os.listdir(builds_dir):
+        if name != key and not name.startswith('.'):
+            shutil.rmtree(os.path.join(builds_dir, name), ignore_errors=True)
+
+    with _bundles_lock:
+        _bundles.pop(bundle_dir, None)
+    return load_bundle(app_dir)
+
+
+def load_bundle(app_dir):
+    """Get the bundle of an app if it's built and up to date.
+
+    :return: an AppBundle object or None.
+    """
+    app_dir = os.path.abspath(app_dir)
+    builds_dir = os.path.join(app_dir, BUNDLE_DIR)
+    if not os.path.isdir(builds_dir):
+        return None
+
+    bundle_dir = os.path.join(builds_dir, bundle_key(app_dir))
+    with _bundles_lock:
+        bundle = _bundles.get(bundle_dir)
+    if bundle is not None:
+        return bundle
+
+    if not os.path.isfile(os.path.join(bundle_dir, MANIFEST_FILE)):
+        logger.debug("The bundle of %s is out of date, it's not used." % app_dir)
+        return None
+
+    bundle = AppBundle(app_dir, bundle_dir)
+    if bundle.manifest.get('format') != BUNDLE_FORMAT or not bundle.verify():
+        logger.warning("The bundle of %s is broken or too old, please rebuild it." % app_dir)
+        return None
+
+    with _bundles_lock:
+        _bundles[bundle_dir] = bundle
+    return bundle
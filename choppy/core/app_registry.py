@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.app_registry
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    An index of installed apps, so apps can be looked up without walking
+    the app root directory.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_FILE = '.registry.json'
+TEMPLATE_FILES = ('inputs', 'workflow.wdl', 'defaults')
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+@contextmanager
+def _file_lock(lock_file):
+    """Lock a file exclusively, processes that install apps at the same time wait for each other."""
+    with open(lock_file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def template_hashes(app_dir):
+    hashes = {}
+    for filename in TEMPLATE_FILES:
+        filepath = os.path.join(app_dir, filename)
+        if os.path.isfile(filepath):
+            with open(filepath, 'rb') as f:
+                hashes[filename] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+
+def template_digest(app_dir, hashes=None):
+    """A digest of all templates of an app."""
+    sha = hashlib.sha256()
+    for filename, digest in sorted((hashes or template_hashes(app_dir)).items()):
+        sha.update(('%s\0%s\0' % (filename, digest)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def split_app_name(name):
+    """Split an installed app name to (namespace, app_name, version).
+
+    Apps installed from a git repo live in `namespace/app_name-version`,
+    apps installed from a zip file have no namespace and version.
+    """
+    if '/' not in name:
+        return None, name, None
+
+    namespace, dirname = name.split('/', 1)
+    if '-' in dirname:
+        app_name, version = dirname.rsplit('-', 1)
+        return namespace, app_name, version
+    return namespace, dirname, None
+
+
+class AppRegistry:
+    """Installed apps, saved as a json file in the app root directory."""
+
+    def __init__(self, app_root_dir):
+        self.app_root_dir = app_root_dir
+        self.registry_file = os.path.join(app_root_dir, REGISTRY_FILE)
+        # The registry file is replaced when it's saved, so a separate file is locked.
+        self.lock_file = self.registry_file + '.lock'
+        self.lock = threading.RLock()
+        self.stat = None
+        self.apps = self._load()
+        if self.apps is None:
+            # First use or a broken registry, build it from the installed apps.
+            self.reindex()
+
+    def _get_stat(self):
+        try:
+            stat = os.stat(self.registry_file)
+        except OSError:
+            return None
+        # The file is replaced when it's saved, so a new inode means it's changed.
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        try:
+            stat = self._get_stat()
+            with open(self.registry_file, 'r') as f:
+                apps = json.load(f).get('apps', {})
+            self.stat = stat
+            return apps
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            logger.warning("App registry %s is broken, reindexing." % self.registry_file)
+            return None
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({'apps': self.apps}, indent=2, sort_keys=True)
+            tmp_file = '%s.%s.tmp' % (self.registry_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                f.write(data)
+            os.replace(tmp_file, self.registry_file)
+            self.stat = self._get_stat()
+
+    def refresh(self):
+        """Load the registry again if it's changed by another process, e.g. choppy install."""
+        if self._get_stat() == self.stat:
+            return
+        with self.lock:
+            apps = self._load()
+            if apps is not None:
+                self.apps = apps
+
+    @contextmanager
+    def update(self):
+        """Change the registry safely with other processes.
+
+        The file is locked and read again, so changes saved by other
+        processes since it was loaded are kept, and it's saved on exit.
+        """
+        with self.lock, _file_lock(self.lock_file):
+            apps = self._load()
+            if apps is not None:
+                self.apps = apps
+            elif self.apps is None:
+                self.apps = {}
+            yield self.apps
+            self.save()
+
+    def make_record(self, name, namespace=None, app_name=None, version=None):
+        from choppy.core.app_utils import get_git_info
+
+        app_dir = os.path.join(self.app_root_dir, name)
+        default_namespace, default_app_name, default_version = split_app_name(name)
+        git_info = get_git_info(os.path.abspath(app_dir))
+        templates = template_hashes(app_dir)
+
+        return {
+            'namespace': namespace or default_namespace,
+            'app_name': app_name or default_app_name,
+            'version': version or default_version,
+            'commit': git_info['commit_id'],
+            'remote': git_info['app_name'],
+            'tags': git_info['version'],
+            'path': name,
+            'templates': templates,
+            'template_hash': template_digest(app_dir, templates),
+            'installed_at': int(os.path.getmtime(app_dir))
+        }
+
+    def add(self, name, **kwargs):
+        """Register an installed app.
+
+        :param name: the app name relative to the app root directory, e.g. namespace/app-version.
+        :param kwargs: namespace, app_name and version, guessed from the name by default.
+        """
+        record = self.make_record(name, **kwargs)
+        record['installed_at'] = int(time.time())
+        with self.update() as apps:
+            apps[name] = record
+        return record
+
+    def remove(self, name):
+        with self.update() as apps:
+            apps.pop(name, None)
+
+    def get(self, name):
+        return self.apps.get(name)
+
+    def get_path(self, name):
+        record = self.apps.get(name)
+        if record:
+            return os.path.join(self.app_root_dir, record['path'])
+
+    def names(self):
+        return sorted(self.apps.keys())
+
+    def __contains__(self, name):
+        return name in self.apps
+
+    def scan(self):
+        from choppy.core.app_utils import is_valid_app
+
+        names = []
+        # backwards compatibility:
+        # 1. No owner name as a namespace.
+        # 2. User owner name as a namespace.
+        for entry in sorted(os.listdir(self.app_root_dir)):
+            abs_dir = os.path.join(self.app_root_dir, entry)
+            if entry.startswith('.') or not os.path.isdir(abs_dir):
+                continue
+
+            if is_valid_app(abs_dir, ignore_error=True):
+                names.append(entry)
+            else:
+                for subdir in sorted(os.listdir(abs_dir)):
+                    if is_valid_app(os.path.join(abs_dir, subdir), ignore_error=True):
+                        names.append('%s/%s' % (entry, subdir))
+        return names
+
+    def reindex(self):
+        """Rebuild the registry from the installed apps."""
+        with self.update() as old_apps:
+            apps = {}
+            for name in self.scan():
+                record = self.make_record(name)
+                old_record = old_apps.get(name)
+                if old_record:
+                    # Keep the exact version and the install time recorded by install.
+                    for key in ('namespace', 'app_name', 'version', 'installed_at'):
+                        record[key] = old_record.get(key)
+                apps[name] = record
+            old_apps.clear()
+            old_apps.update(apps)
+        return self.names()
+
+
+def get_registry(app_root_dir=None):
+    """Get the registry of an app root directory, it's shared in a process and reloaded when its file changes."""
+    if app_root_dir is None:
+        from choppy.core.app_utils import get_app_root_dir
+        app_root_dir = get_app_root_dir()
+
+    app_root_dir = os.path.abspath(app_root_dir)
+    with _registries_lock:
+        registry = _registries.get(app_root_dir)
+        if registry is None:
+            registry = _registries[app_root_dir] = AppRegistry(app_root_dir)
+            return registry
+    registry.refresh()
+    return registry
@@ -10,21 +10,24 @@
 """
 
 from __future__ import unicode_literals
+import io
 import json
 import os
 import sys
 import re
 import csv
-import uuid
 import shutil
 import zipfile
+import tempfile
 import logging
+import threading
 import verboselogs
+from concurrent.futures import ThreadPoolExecutor
 from choppy.config import get_global_config
 from markdown2 import Markdown
-from subprocess import Popen, PIPE, check_output
+from subprocess import Popen, PIPE
 from jinja2 import Environment, FileSystemLoader, meta
-from choppy.core.cromwell import Cromwell
+from choppy.core.cromwell import get_cromwell
 from choppy import exit_code
 from choppy.exceptions import (InValidApp, AppInstallationFailed,
                                AppUnInstallationFailed)
@@ -137,102 +140,164 @@ def parse_app_name(app_name):
         return False
 
 
-def dfs_get_zip_file(input_path, result):
-    files = os.listdir(input_path)
-    for file in files:
-        filepath = os.path.join(input_path, file)
-        if os.path.isdir(filepath):
-            dfs_get_zip_file(filepath, result)
-        else:
-            result.append(filepath)
-
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 
-def zip_path(input_path, output_path):
-    f = zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED)
-    filelists = []
-    dfs_get_zip_file(input_path, filelists)
-    for file in filelists:
-        f.write(file)
-    f.close()
-    return output_path
 
+def _zip_info(arcname, mode):
+    # Fixed timestamps and attributes, so the same tree gives the same bytes.
+    info = zipfile.ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+    info.create_system = 3
+    if arcname.endswith('/'):
+        info.external_attr = (0o40755 << 16) | 0x10
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.external_attr = (0o100755 if mode & 0o111 else 0o100644) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+    return info
 
-def zip_path_by_ext_program(input_path, output_path):
-    cmd = ['zip', '-r', '-q', output_path, input_path]
-    logger.debug('ZIP: Working Directory %s, CMD: %s' % (os.getcwd(), cmd))
-    proc = Popen(cmd, stdin=PIPE)
-    proc.communicate()
 
+def build_dependencies_zip(dependencies_path, arcroot='tasks'):
+    """Zip a dependencies directory in memory.
 
-def check_cmd(command):
-    for cmdpath in os.environ['PATH'].split(':'):
-        if os.path.isdir(cmdpath) and command in os.listdir(cmdpath):
-            return True
+    Files are stored under `arcroot/` in a sorted order with fixed timestamps,
+    so the output is deterministic. The working directory is never changed,
+    it's safe to be called from many threads.
 
-    return False
+    :param dependencies_path: the tasks directory of an app.
+    :param arcroot: the top directory in the zip file.
+    :return: bytes of the zip file.
+    """
+    dependencies_path = os.path.abspath(dependencies_path)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zfile:
+        # Directory entries are kept like `zip -r` does, Cromwell needs them.
+        zfile.writestr(_zip_info(arcroot + '/', 0), b'')
+        for root, dirs, files in os.walk(dependencies_path):
+            dirs.sort()
+            relpath = os.path.relpath(root, dependencies_path)
+            prefix = arcroot if relpath == '.' else '/'.join([arcroot] + relpath.split(os.sep))
+            for dirname in dirs:
+                zfile.writestr(_zip_info('%s/%s/' % (prefix, dirname), 0), b'')
+            for filename in sorted(files):
+                filepath = os.path.join(root, filename)
+                with open(filepath, 'rb') as f:
+                    data = f.read()
+                zfile.writestr(_zip_info('%s/%s' % (prefix, filename), os.stat(filepath).st_mode), data)
+    return buffer.getvalue()
 
 
 def generate_dependencies_zip(dependencies_path):
-    # Fix Bug: When Changing Directory, you need a abs path.
-    dependencies_path = os.path.abspath(dependencies_path)
-    previous_workdir = os.getcwd()
-    par_dir = str(uuid.uuid1())
-    workdir = os.path.join('/', 'tmp', par_dir)
-    os.mkdir(workdir)
-    zip_output = os.path.join('/', 'tmp', par_dir, 'tasks.zip')
-
-    os.chdir(workdir)
-    # Fix bug:
-    # Need two levels or one level?
-    # dest_path = os.path.join('tasks', 'tasks')
-    dest_path = 'tasks'
-    shutil.copytree(dependencies_path, dest_path)
-
-    # 外部命令
-    if check_cmd('zip'):
-        zip_path_by_ext_program('tasks', zip_output)
-    else:
-        # TODO: Fix the Bug
-        # Python zipfile generate a zip that are version 2.0;
-        # But Cromwell need a zip that are version 1.0;
-        zip_path(dest_path, zip_output)
+    """Write the dependencies zip into a temporary file.
 
-    os.chdir(previous_workdir)
+    :return: path of the zip file.
+    """
+    workdir = tempfile.mkdtemp(prefix='choppy-')
+    zip_output = os.path.join(workdir, 'tasks.zip')
+    with open(zip_output, 'wb') as f:
+        f.write(build_dependencies_zip(dependencies_path))
     return zip_output
 
 
-def get_version(app_dir):
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def get_git_info(app_dir):
+    """Read the remote url, HEAD commit and tags of an app repo in process.
+
+    It's memoized by the app directory and the HEAD commit.
+    """
+    import git
+    from git.refs import SymbolicReference
+
     try:
-        app_name = get_remote_url(app_dir)
-    except Exception:
-        logger.warn("Git's version is too low, please upgrade it.")
+        repo = git.Repo(app_dir)
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        # Apps installed from a zip file.
+        return {"app_name": "", "commit_id": None, "version": ""}
+
+    try:
+        commit_id = SymbolicReference.dereference_recursive(repo, 'HEAD')
+    except ValueError:
+        commit_id = None
+
+    key = (app_dir, commit_id)
+    with _versions_lock:
+        if key in _versions:
+            return dict(_versions[key])
+
+    try:
+        app_name = repo.remotes.origin.url
+    except (AttributeError, IndexError):
         app_name = ""
 
-    return {
+    info = {
         "app_name": app_name,
-        "commit_id": get_app_commit_id(app_dir),
-        "version": get_app_tag(app_dir)
+        "commit_id": commit_id,
+        # Same as the output of `git tag`.
+        "version": '\n'.join(sorted(tag.name for tag in repo.tags))
     }
+    with _versions_lock:
+        _versions[key] = info
+    return dict(info)
+
+
+def get_version(app_dir):
+    from choppy.core.app_registry import template_digest
+
+    version = get_git_info(os.path.abspath(app_dir))
+    version["template_hash"] = template_digest(app_dir)
+    return version
+
+
+def run_git(cmd, password=None):
+    logger.debug('Git Repo Cmd: %s' % ' '.join(cmd))
+    proc = Popen(cmd, stdin=PIPE)
+    proc.communicate(password)
+    return proc.returncode
+
 
+def get_mirror_dir(app_root_dir, namespace, app_name):
+    return os.path.join(app_root_dir, '.mirrors', namespace, '%s.git' % app_name)
 
-def get_remote_url(app_dir):
-    output = check_output(['git', 'remote', 'get-url', 'origin'], cwd=app_dir, universal_newlines=True).strip()
-    return output
 
+def update_mirror(repo_url, mirror_dir, password=None):
+    """Create or update a bare mirror of an app repo, only new objects are fetched.
 
-def get_app_commit_id(app_dir):
-    output = check_output(['git', 'rev-parse', 'HEAD'], cwd=app_dir, universal_newlines=True).strip()
-    return output
+    :return: True if the mirror is usable, it may be stale when the fetch failed.
+    """
+    if os.path.isdir(mirror_dir):
+        rc = run_git(['git', '--git-dir', mirror_dir, 'fetch', '-q', '--prune', 'origin'], password)
+        if rc != 0:
+            logger.warning('Failed to update the mirror %s, the cached one is used.' % mirror_dir)
+        return True
+
+    # Clone into a temporary directory, so a broken clone is never used as a mirror.
+    parent_dir = os.path.dirname(mirror_dir)
+    if not os.path.isdir(parent_dir):
+        os.makedirs(parent_dir)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.tmp-')
+    rc = run_git(['git', 'clone', '--mirror', '-q', repo_url, tmp_dir], password)
+    if rc != 0:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+    os.rename(tmp_dir, mirror_dir)
+    return True
 
 
-def get_app_tag(app_dir):
-    output = check_output(['git', 'tag'], cwd=app_dir, universal_newlines=True).strip()
-    return output
+def clone_from_mirror(mirror_dir, version, dest_dir, origin_url=None):
+    # A local clone hardlinks the objects of the mirror, nothing is downloaded,
+    # and the app still works when the mirror is removed.
+    rc = run_git(['git', 'clone', '--local', '-q', '-b', version, '--single-branch',
+                  mirror_dir, dest_dir])
+    if rc == 0 and origin_url:
+        rc = run_git(['git', '-C', dest_dir, 'remote', 'set-url', 'origin', origin_url])
+    return rc
 
 
 def install_app_by_git(base_url, namespace, app_name, dest_dir='./',
                        version='', username=None, password=None,
-                       is_terminal=True):
+                       is_terminal=True, mirror_dir=None):
     from urllib.parse import quote_plus
     repo_url = "%s/%s/%s.git" % (base_url.strip('http://'),
                                  namespace, app_name)
@@ -241,13 +306,15 @@ def install_app_by_git(base_url, namespace, app_name, dest_dir='./',
     # Urlencode a string: https://stackoverflow.com/a/9345102
     auth_repo_url = "http://%s@%s" % (quote_plus(username), repo_url)
     version = version if version != 'latest' else 'master'
-    # How to clone a specific tag with git: https://stackoverflow.com/a/31666461
-    cmd = ['git', 'clone', '-b', version, '--single-branch', '-q',
-           '--progress', '--depth', '1', auth_repo_url, dest_dir]
-    logger.debug('Git Repo Cmd: %s' % ' '.join(cmd))
-    proc = Popen(cmd, stdin=PIPE)
-    proc.communicate(password)
-    rc = proc.returncode
+    if os.path.exists(dest_dir):
+        rc = 1
+    elif mirror_dir and update_mirror(auth_repo_url, mirror_dir, password):
+        rc = clone_from_mirror(mirror_dir, version, dest_dir, origin_url=auth_repo_url)
+    else:
+        # How to clone a specific tag with git: https://stackoverflow.com/a/31666461
+        cmd = ['git', 'clone', '-b', version, '--single-branch', '-q',
+               '--progress', '--depth', '1', auth_repo_url, dest_dir]
+        rc = run_git(cmd, password)
     if rc == 0:
         try:
             is_valid_app(dest_dir)
@@ -284,7 +351,19 @@ def get_app_root_dir():
     return app_root_dir
 
 
+def build_app_bundle(app_dir):
+    """Build the bundle of an installed app, an app still works without it."""
+    from choppy.core.app_bundle import build_bundle
+
+    try:
+        return build_bundle(app_dir)
+    except Exception as err:
+        logger.warning("Failed to build the bundle of %s: %s" % (os.path.basename(app_dir), err))
+
+
 def install_app(app_root_dir, choppy_app, is_terminal=True):
+    from choppy.core.app_registry import get_registry
+
     parsed_dict = parse_app_name(choppy_app)
     if parsed_dict:
         base_url = global_config.get('repo', 'base_url')
@@ -296,39 +375,91 @@ def install_app(app_root_dir, choppy_app, is_terminal=True):
         app_name = parsed_dict.get('app_name')
         version = parsed_dict.get('version')
         app_dir_version = os.path.join(app_root_dir, "%s/%s-%s" % (namespace, app_name, version))
-        install_app_by_git(base_url, namespace, app_name, version=version,
-                           dest_dir=app_dir_version, username=username,
-                           password=password, is_terminal=is_terminal)
+        msg = install_app_by_git(base_url, namespace, app_name, version=version,
+                                 dest_dir=app_dir_version, username=username,
+                                 password=password, is_terminal=is_terminal,
+                                 mirror_dir=get_mirror_dir(app_root_dir, namespace, app_name))
+        get_registry(app_root_dir).add(os.path.relpath(app_dir_version, app_root_dir),
+                                       namespace=namespace, app_name=app_name, version=version)
+        build_app_bundle(app_dir_version)
+        return msg
     else:
-        app_name = os.path.splitext(os.path.basename(choppy_app))[0]
-        dest_namelist = [os.path.join(app_name, 'inputs'),
-                         os.path.join(app_name, 'workflow.wdl')]
-
-        tasks_dirpath = os.path.join(app_name, 'tasks')
-        choppy_app_handler = zipfile.ZipFile(choppy_app)
-        namelist = choppy_app_handler.namelist()
-
-        # Only wdl files.
-        tasks_namelist = [name for name in namelist
-                          if re.match('%s/.*.wdl$' % tasks_dirpath, name)]
-        dest_namelist.extend(tasks_namelist)
-
-        def check_app(dest_namelist, namelist):
-            for file in dest_namelist:
-                if file in namelist:
-                    continue
-                else:
-                    return False
-            return True
+        app_name = install_app_by_zip(app_root_dir, choppy_app)
+        get_registry(app_root_dir).add(app_name)
+        build_app_bundle(os.path.join(app_root_dir, app_name))
+        logger.success("Install %s successfully." % app_name)
+
+
+def _extract_member(zip_path, name, dest_path, local, opened):
+    # ZipFile objects are not shared between threads, every worker opens its own.
+    zfile = getattr(local, 'zfile', None)
+    if zfile is None:
+        zfile = local.zfile = zipfile.ZipFile(zip_path)
+        opened.append(zfile)
+
+    dest_dir = os.path.dirname(dest_path)
+    if not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+    # The CRC-32 is checked when the member is read to the end.
+    with zfile.open(name) as src, open(dest_path, 'wb') as dest:
+        shutil.copyfileobj(src, dest)
 
-        if check_app(dest_namelist, namelist):
-            choppy_app_handler.extractall(app_root_dir, dest_namelist)
-            logger.success("Install %s successfully." % app_name)
-        else:
-            raise InValidApp("Not a valid app.")
+
+def install_app_by_zip(app_root_dir, zip_path, workers=8):
+    """Install an app from a zip file.
+
+    Files are extracted in parallel into a staging directory, and moved into
+    app_root_dir by a rename, so a failed install never leaves a half app.
+
+    :return: the app name.
+    """
+    app_name = os.path.splitext(os.path.basename(zip_path))[0]
+    required = set([app_name + '/inputs', app_name + '/workflow.wdl'])
+    tasks_prefix = app_name + '/tasks/'
+
+    with zipfile.ZipFile(zip_path) as zfile:
+        # Only wdl files of tasks.
+        names = [name for name in zfile.namelist()
+                 if name in required or (name.startswith(tasks_prefix) and name.endswith('.wdl'))]
+    if not required.issubset(names):
+        raise InValidApp("Not a valid app.")
+
+    for name in names:
+        if os.path.isabs(name) or '..' in name.split('/'):
+            raise InValidApp("Not a valid app, unsafe path: %s" % name)
+
+    dest_dir = os.path.join(app_root_dir, app_name)
+    staging_dir = tempfile.mkdtemp(dir=app_root_dir, prefix='.staging-')
+    local, opened = threading.local(), []
+    try:
+        # The tasks directory is needed even if there is no task.
+        os.makedirs(os.path.join(staging_dir, app_name, 'tasks'))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_member, zip_path, name,
+                                       os.path.join(staging_dir, *name.split('/')), local, opened)
+                       for name in names]
+            for future in futures:
+                future.result()
+
+        is_valid_app(os.path.join(staging_dir, app_name))
+        os.rename(os.path.join(staging_dir, app_name), dest_dir)
+    except zipfile.BadZipFile as err:
+        raise AppInstallationFailed("%s is broken: %s" % (zip_path, err))
+    except OSError as err:
+        raise AppInstallationFailed("Install %s unsuccessfully: %s" % (app_name, err))
+    finally:
+        for zfile in opened:
+            zfile.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return app_name
 
 
 def uninstall_app(app_dir, is_terminal=True):
+    from choppy.core.app_registry import get_registry
+
+    registry = get_registry()
+    app_name = os.path.relpath(os.path.abspath(app_dir), registry.app_root_dir)
     if not os.path.exists(app_dir):
         logger.debug("App root directory: %s" % os.path.dirname(app_dir))
         msg = 'No such app: %s' % os.path.basename(app_dir)
@@ -343,6 +474,7 @@ def uninstall_app(app_dir, is_terminal=True):
             answer = answer.upper()
             if answer == "YES" or answer == "Y":
                 shutil.rmtree(app_dir)
+                registry.remove(app_name)
                 logger.success("Uninstall %s successfully." % os.path.basename(app_dir))
             elif answer == "NO" or answer == "N":
                 logger.warning("Cancel uninstall %s." % os.path.basename(app_dir))
@@ -350,6 +482,7 @@ def uninstall_app(app_dir, is_terminal=True):
                 logger.info("Please enter Yes/No.")
     else:
         shutil.rmtree(app_dir)
+        registry.remove(app_name)
         msg = "Uninstall %s successfully." % os.path.basename(app_dir)
         logger.success(msg)
         return msg
@@ -422,22 +555,8 @@ def render_readme(app_path, app_name, readme="README.md",
 
 
 def listapps():
-    app_root_dir = get_app_root_dir()
-    apps = []
-    if os.path.isdir(app_root_dir):
-        # backwards compatibility:
-        # 1. No owner name as a namespace.
-        # 2. User owner name as a namespace.
-        for dir in os.listdir(app_root_dir):
-            abs_dir = os.path.join(app_root_dir, dir)
-            if is_valid_app(abs_dir, ignore_error=True):
-                apps.append(dir)
-            elif os.path.isdir(abs_dir):
-                for subdir in os.listdir(abs_dir):
-                    abs_dir_subdir = os.path.join(abs_dir, subdir)
-                    if is_valid_app(abs_dir_subdir, ignore_error=True):
-                        apps.append('%s/%s' % (dir, subdir))
-    return apps
+    from choppy.core.app_registry import get_registry
+    return get_registry().names()
 
 
 def get_header(file):
@@ -452,17 +571,17 @@ def write(path, filename, data):
 
 
 def submit_workflow(wdl, inputs, dependencies, label, username=None,
-                    server='localhost', extra_options=None, labels_dict=None):
+                    server='localhost', extra_options=None, labels_dict=None,
+                    wdl_string=False):
     labels_dict = kv_list_to_dict(
         label) if kv_list_to_dict(label) is not None else {}
     if username is None:
         username = global_config.getuser()
     labels_dict['username'] = username
-    section_name = 'remote_%s' % server if server != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(server, section_name)
-    cromwell = Cromwell(host=host, port=port, auth=auth)
+    cromwell = get_cromwell(server)
     result = cromwell.jstart_workflow(wdl_file=wdl, json_file=inputs,
                                       dependencies=dependencies,
+                                      wdl_string=wdl_string,
                                       extra_options=kv_list_to_dict(
                                           extra_options),
                                       custom_labels=labels_dict)
@@ -517,17 +636,23 @@ def get_all_variables(app_dir, no_default=False):
 
 
 def get_vars_from_app(app_path, template_file, no_default=False):
-    env = Environment()
-    template = os.path.join(app_path, template_file)
-    with open(template) as f:
-        templ_str = f.read()
-        ast = env.parse(templ_str)
-        variables = meta.find_undeclared_variables(ast)
-
-        if no_default:
-            app_default_var = AppDefaultVar(app_path)
-            diff_variables = app_default_var.diff(variables)
-            return diff_variables
+    from choppy.core.app_bundle import load_bundle
+
+    bundle = load_bundle(app_path)
+    if bundle:
+        variables = bundle.get_vars(template_file)
+    else:
+        env = Environment()
+        template = os.path.join(app_path, template_file)
+        with open(template) as f:
+            templ_str = f.read()
+            ast = env.parse(templ_str)
+            variables = meta.find_undeclared_variables(ast)
+
+    if no_default:
+        app_default_var = AppDefaultVar(app_path)
+        diff_variables = app_default_var.diff(variables)
+        return diff_variables
 
     return variables
 
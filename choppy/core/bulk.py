@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.bulk
+    ~~~~~~~~~~~~~~~~
+
+    Abort, label and restart many workflows at once. Workflows come from a
+    file (e.g. submitted.csv) or a query, they are handled concurrently by
+    the shared clients of their servers, and every workflow gets a result.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import csv
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from choppy.config import get_global_config, set_global_config
+from choppy.core.cromwell import RESTARTED_LABEL, RESTART_METADATA_KEYS, get_cromwell
+from choppy.core.cromwell_pool import ALL_SERVERS, find_workflow_server, query_all
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+DONE = 'done'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+REPORT_FIELDS = ('workflow_id', 'server', 'result', 'message')
+
+
+def read_workflow_ids(path):
+    """Read workflow ids from a file.
+
+    :param path: a csv file with a workflow_id column (e.g. submitted.csv) or a file with one id per line.
+    :return: a list of (workflow_id, server), server is None if it's not in the file.
+    """
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f]
+
+    header = next((line for line in lines if line), '')
+    if 'workflow_id' in [column.strip() for column in header.split(',')]:
+        reader = csv.DictReader(lines)
+        return [(row['workflow_id'].strip(), row.get('server') or None)
+                for row in reader if row.get('workflow_id')]
+    return [(line.split()[0], None) for line in lines if line and not line.startswith('#')]
+
+
+def query_workflow_ids(servers, project_name=None, labels=None):
+    """Find workflows by a project and labels.
+
+    :param labels: a list of key:value.
+    :return: a list of (workflow_id, server), subworkflows are not included.
+    """
+    query_dict = {}
+    if project_name:
+        query_dict['name'] = project_name
+    if labels:
+        query_dict['label'] = list(labels)
+    # A large project has more than one page of results.
+    res = query_all(servers, lambda cromwell: {'results': cromwell.query_pages(query_dict)})
+    return [(result['id'], result['server']) for result in res['results']
+            if not result.get('parentWorkflowId')]
+
+
+def unique_targets(targets):
+    """Remove duplicated workflows, a known server is kept."""
+    unique = OrderedDict()
+    for workflow_id, server in targets:
+        unique[workflow_id] = server or unique.get(workflow_id)
+    return list(unique.items())
+
+
+def get_status(cromwell, workflow_id):
+    """Get the status of a workflow.
+
+    :return: (status, error), error is the message of cromwell if the workflow is not found, e.g. a wrong server.
+    """
+    response = cromwell.query_status(workflow_id)
+    status = response.get('status')
+    if not response.get('id') or status not in global_config.status_list:
+        return None, response.get('message') or 'Unknown status: %s' % status
+    return status, None
+
+
+def abort_workflow(cromwell, workflow_id):
+    status, error = get_status(cromwell, workflow_id)
+    if error:
+        return FAILED, error
+    if status not in global_config.run_states:
+        return SKIPPED, 'Already %s' % status
+    response = cromwell.stop_workflow(workflow_id)
+    if response.get('status') in ('Aborting', 'Aborted'):
+        return DONE, response['status']
+    return FAILED, response.get('message', str(response))
+
+
+def label_workflow(cromwell, workflow_id, labels):
+    current = cromwell.get('labels', workflow_id).get('labels') or {}
+    if all(current.get(key) == value for key, value in labels.items()):
+        return SKIPPED, 'Already labeled'
+    response = cromwell.label_workflow(workflow_id, labels)
+    if response.status_code == 200:
+        return DONE, ', '.join('%s:%s' % item for item in sorted(labels.items()))
+    return FAILED, response.text
+
+
+def find_dependencies(wdl, labels, project_dir=None, app_dir=None):
+    """Find the zip of the imported WDLs of a workflow, Cromwell doesn't keep it.
+
+    The tasks of the sample in the project are used first, the same as rerun,
+    then the tasks of the app.
+
+    :param wdl: the submitted WDL.
+    :param labels: the labels of the workflow, sample-id is the directory of the sample.
+    :param project_dir: the project directory of choppy batch. Optional.
+    :param app_dir: the app of the workflow. Optional.
+    :return: bytes of the zip, None if the WDL imports nothing. ValueError if it's not found.
+    """
+    from choppy.core.app_bundle import load_bundle
+    from choppy.core.app_utils import build_dependencies_zip
+    from choppy.core.womtool import get_relative_imports
+
+    if not get_relative_imports(wdl):
+        return None
+
+    sample_id = labels.get('sample-id')
+    if project_dir and sample_id and os.path.isdir(project_dir):
+        # sample-id is lower case in labels.
+        for name in sorted(os.listdir(project_dir)):
+            tasks_dir = os.path.join(project_dir, name, 'tasks')
+            if name.lower() == sample_id.lower() and os.path.isdir(tasks_dir):
+                return build_dependencies_zip(tasks_dir)
+
+    if app_dir:
+        bundle = load_bundle(app_dir)
+        dependencies = bundle.dependencies_zip() if bundle else None
+        if dependencies is None and os.path.isdir(os.path.join(app_dir, 'tasks')):
+            dependencies = build_dependencies_zip(os.path.join(app_dir, 'tasks'))
+        if dependencies is not None:
+            return dependencies
+
+    raise ValueError('No dependencies for the imports of the WDL, '
+                     'set the project directory or the app of the workflow.')
+
+
+def restart_workflow(cromwell, workflow_id, disable_caching=False, project_dir=None, app_dir=None):
+    status, error = get_status(cromwell, workflow_id)
+    if error:
+        return FAILED, error
+    if status not in ('Failed', 'Aborted'):
+        return SKIPPED, 'It is %s' % status
+    # A restarted workflow is labeled with its new workflow, so it's never restarted twice.
+    labels = cromwell.get('labels', workflow_id).get('labels') or {}
+    if labels.get(RESTARTED_LABEL):
+        return SKIPPED, 'Already restarted as %s' % labels[RESTARTED_LABEL]
+
+    metadata = cromwell.query_metadata(workflow_id, include_keys=RESTART_METADATA_KEYS)
+    wdl = (metadata.get('submittedFiles') or {}).get('workflow')
+    if wdl is None:
+        return FAILED, metadata.get('message') or 'No submitted files'
+    try:
+        dependencies = find_dependencies(wdl, labels, project_dir=project_dir, app_dir=app_dir)
+    except ValueError as err:
+        return FAILED, str(err)
+
+    result = cromwell.restart_workflow(workflow_id, disable_caching=disable_caching,
+                                       dependencies=dependencies, metadata=metadata)
+    if result is None or 'id' not in result:
+        return FAILED, str(result)
+    cromwell.label_workflow(workflow_id, {RESTARTED_LABEL: result['id']})
+    return DONE, result['id']
+
+
+BULK_ACTIONS = {
+    'abort': abort_workflow,
+    'label': label_workflow,
+    'restart': restart_workflow,
+}
+
+
+def run_bulk(action, targets, server='localhost', jobs=8, **kwargs):
+    """Run an action on workflows concurrently.
+
+    :param action: abort, label or restart.
+    :param targets: a list of (workflow_id, server), the server may be None.
+    :param server: the server of workflows without a server, all means it's looked up.
+    :param jobs: the number of workflows that are handled at the same time.
+    :param kwargs: arguments of the action, e.g. labels, disable_caching or project_dir.
+    :return: a list of dicts with REPORT_FIELDS, in the order of targets.
+    """
+    func = BULK_ACTIONS[action]
+    config = get_global_config()
+    lock = threading.Lock()
+    progress = {'finished': 0}
+
+    def run(target):
+        # The global config is thread local.
+        set_global_config(config)
+        workflow_id, workflow_server = target
+        workflow_server = workflow_server or server
+        try:
+            if workflow_server == ALL_SERVERS:
+                workflow_server = find_workflow_server(workflow_id)
+            if workflow_server is None:
+                result, message = FAILED, 'Not found in any server'
+            else:
+                result, message = func(get_cromwell(workflow_server), workflow_id, **kwargs)
+        except SystemExit:
+            result, message = FAILED, 'Unable to connect to %s' % workflow_server
+        except Exception as err:
+            result, message = FAILED, str(err)
+
+        with lock:
+            progress['finished'] += 1
+            logger.info("[%s/%s] %s %s: %s" % (progress['finished'], len(targets),
+                                               action, workflow_id, result))
+        return OrderedDict(zip(REPORT_FIELDS, (workflow_id, workflow_server, result, message)))
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        return list(executor.map(run, targets))
+
+
+def write_report(path, reports):
+    with open(path, 'wt') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(reports)
@@ -14,14 +14,15 @@ import logging
 import json
 import requests
 import sys
-from ratelimit import rate_limited
 from requests.compat import urljoin
 from choppy import exit_code
+from choppy.core.throttle import RetryPolicy, get_limiter
 from choppy.exceptions import (UnauthorizedException, UnFoundException, BadRequestException)
 
 
 module_logger = logging.getLogger(__name__)
-ONE_MINUTE = 60
+# Requests per minute to an app store.
+STORE_RATE_LIMIT = 300
 
 
 class ChoppyStore:
@@ -31,6 +32,7 @@ class ChoppyStore:
     def __init__(self, choppy_web_api, username=None, password=None):
         self.choppy_web_api = choppy_web_api
         self.auth = (username, password) if username and password else None
+        self.retry_policy = RetryPolicy()
 
         self.logger = logging.getLogger('choppy.choppy_store.ChoppyStore')
         self.logger.debug('URL:{}'.format(self.choppy_web_api))
@@ -38,15 +40,21 @@ class ChoppyStore:
         v_url = urljoin(self.choppy_web_api, "/api/v1/version")
 
         try:
-            self.version = json\
-                .loads(requests
-                       .get(v_url, auth=self.auth)
-                       .content)['version']
+            self.version = json.loads(self.request('GET', v_url).content)['version']
         except (requests.ConnectionError, ValueError) as e:
             msg = "Unable to connect to {}:\n{}".format(
                 self.choppy_web_api, str(e))
             print_log_exit(msg, sys_exit=False)
 
+    def request(self, method, url, **kwargs):
+        """Send a request under the rate limit of the store, throttled requests are retried.
+
+        :return: a requests.Response object.
+        """
+        limiter = get_limiter(self.choppy_web_api, 'api', STORE_RATE_LIMIT)
+        return self.retry_policy.send(lambda: requests.request(method, url, auth=self.auth, **kwargs),
+                                      limiter=limiter)
+
     def get(self, endpoint, params=None, headers=None, v2=False):
         """A generic get request function.
 
@@ -60,11 +68,7 @@ class ChoppyStore:
         api_url = urljoin(self.choppy_web_api, api_prefix)
         url = urljoin(api_url, endpoint)
         self.logger.debug("GET REQUEST:{}".format(url))
-        if headers:
-            r = requests.get(url, headers=headers,
-                             params=params, auth=self.auth)
-        else:
-            r = requests.get(url, params=params, auth=self.auth)
+        r = self.request('GET', url, headers=headers, params=params)
 
         # TODO: More Conditions
         if r.status_code == 200:
@@ -92,11 +96,7 @@ class ChoppyStore:
         api_url = urljoin(self.choppy_web_api, api_prefix)
         url = urljoin(api_url, endpoint)
         self.logger.debug("GET REQUEST:{}".format(url))
-        if headers:
-            r = requests.post(url, params=params,
-                              headers=headers, auth=self.auth)
-        else:
-            r = requests.post(url, params=params, auth=self.auth)
+        r = self.request('POST', url, params=params, headers=headers)
 
         # TODO: More Conditions
         if r.status_code == 201:
@@ -125,22 +125,15 @@ class ChoppyStore:
         api_url = urljoin(self.choppy_web_api, api_prefix)
         url = urljoin(api_url, endpoint)
         self.logger.debug("GET REQUEST:{}".format(url))
-        tries = 4
-        while tries != 0:
-            r = requests.patch(url, data=payload,
-                               headers=headers, auth=self.auth)
-            if r.status_code == 200:
-                logging.info('{} request succeeded.'.format(endpoint))
-                tries = 0
-            else:
-                logging.warning("{} failed. Error {}: {}".format(
-                    endpoint, r.status_code, json.loads(r.text)['message']))
-                logging.info("Retrying...")
-                tries -= tries
-        # Should return none only if patch request fails.
+        # 429 and 503 are retried by the retry policy, other errors are final.
+        r = self.request('PATCH', url, data=payload, headers=headers)
+        if r.status_code == 200:
+            logging.info('{} request succeeded.'.format(endpoint))
+        else:
+            logging.warning("{} failed. Error {}: {}".format(
+                endpoint, r.status_code, r.text))
         return r
 
-    @rate_limited(300, ONE_MINUTE)
     def search(self, q_str, page=1, limit=10, mode='source',
                sort='created', order='asc', topic_only=True):
         """Search apps from choppy app store.
@@ -181,7 +174,6 @@ class ChoppyStore:
             }
             return results, 500
 
-    @rate_limited(300, ONE_MINUTE)
     def list_releases(self, owner, repo_name):
         """List a repo's releases.
 
@@ -14,16 +14,97 @@ import logging
 import json
 import requests
 import datetime
+import os
 import sys
+import time
+import threading
 from choppy.config import get_global_config
 from choppy import exit_code
+from choppy.utils import read_tail
+from choppy.core.throttle import (DEFAULT_RATE_LIMITS, RetryPolicy, get_limiter,
+                                  get_throttle_settings)
 
 from requests.utils import quote
-from ratelimit import rate_limited
 
 global_config = get_global_config()
 module_logger = logging.getLogger(__name__)
-ONE_MINUTE = 60
+# Only the tail of a log file will be loaded.
+MAX_LOG_BYTES = 64 * 1024
+# A restarted workflow is labeled with its new workflow.
+RESTARTED_LABEL = 'restarted-as'
+# Call caching is enabled explicitly for restarted workflows, only failed calls are run again.
+CALL_CACHING_OPTIONS = {'read_from_cache': True, 'write_to_cache': True}
+# Only these keys of the metadata are needed to restart a workflow.
+RESTART_METADATA_KEYS = ['submittedFiles', 'labels']
+
+_clients = {}
+_clients_lock = threading.Lock()
+_versions = {}
+
+
+def get_version_ttl():
+    """Seconds to keep cromwell versions on disk, 0 means they are only kept in memory."""
+    ttl = global_config.get('general', 'cromwell_version_ttl')
+    return int(ttl) if ttl else 0
+
+
+def get_version_cache_file():
+    return os.path.join(global_config.get_path('general', 'log_dir'), 'cromwell_versions.json')
+
+
+def get_cached_version(key):
+    if key in _versions:
+        return _versions[key]
+
+    ttl = get_version_ttl()
+    if ttl <= 0:
+        return None
+    try:
+        with open(get_version_cache_file(), 'r') as f:
+            cached = json.load(f).get(key)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if cached and time.time() - cached['timestamp'] < ttl:
+        _versions[key] = cached['version']
+        return cached['version']
+
+
+def set_cached_version(key, version):
+    _versions[key] = version
+    if get_version_ttl() <= 0:
+        return
+
+    cache_file = get_version_cache_file()
+    try:
+        with open(cache_file, 'r') as f:
+            versions = json.load(f)
+    except (IOError, OSError, ValueError):
+        versions = {}
+    versions[key] = {'version': version, 'timestamp': time.time()}
+    tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(versions, f)
+        os.replace(tmp_file, cache_file)
+    except (IOError, OSError) as err:
+        module_logger.debug("Can't save cromwell versions: %s" % err)
+
+
+def get_cromwell(server='localhost'):
+    """Get the shared client of a cromwell server in choppy.conf.
+
+    :param server: localhost or the name of a remote server.
+    """
+    with _clients_lock:
+        if server not in _clients:
+            section_name = 'remote_%s' % server if server != 'localhost' else 'local'
+            host, port, auth = global_config.get_conn_info(server, section_name)
+            rate_limits, retry_policy = get_throttle_settings(
+                global_config.get_section(section_name, is_dict=True))
+            _clients[server] = Cromwell(host, port, auth, rate_limits=rate_limits,
+                                        retry_policy=retry_policy)
+        return _clients[server]
 
 
 class Cromwell:
@@ -37,10 +118,14 @@ class Cromwell:
         {"VesperWorkflow.project_name":"Vesper_Anid_test"}
     """
 
-    def __init__(self, host='localhost', port=8000, auth=None):
+    def __init__(self, host='localhost', port=8000, auth=None, rate_limits=None,
+                 retry_policy=None):
         self.host = host
         self.port = port
         self.auth = auth
+        # Limiters are shared by all clients of a server, see choppy.core.throttle.
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.retry_policy = retry_policy or RetryPolicy()
 
         self.url = 'http://' + host + ':' + \
             str(self.port) + '/api/workflows/v1'
@@ -49,27 +134,61 @@ class Cromwell:
         self.logger = logging.getLogger(__name__)
         self.logger.debug('URL:{}'.format(self.url))
 
-        v_url = "http://{}:{}/engine/v1/version".format(host, str(self.port))
+        # Connections are kept alive and shared by all requests.
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self._long_version = None
+        self._version_lock = threading.Lock()
+        self.cached_metadata = {}
+
+    def request(self, method, url, endpoint_class='default', **kwargs):
+        """Send a request under the rate limit of its endpoint class, throttled requests are retried.
 
+        :param endpoint_class: metadata, query, submit or default.
+        :return: a requests.Response object.
+        """
+        limiter = get_limiter('%s:%s' % (self.host, self.port), endpoint_class,
+                              self.rate_limits.get(endpoint_class))
+        return self.retry_policy.send(lambda: self.session.request(method, url, **kwargs),
+                                      limiter=limiter)
+
+    @property
+    def long_version(self):
+        """The version of cromwell, it's probed on the first use."""
+        if self._long_version is None:
+            with self._version_lock:
+                if self._long_version is None:
+                    self._long_version = self._get_version()
+        return self._long_version
+
+    @property
+    def short_version(self):
+        return int(self.long_version.split('-')[0])
+
+    def _get_version(self):
+        key = '%s:%s' % (self.host, self.port)
+        version = get_cached_version(key)
+        if version:
+            return version
+
+        v_url = "http://{}:{}/engine/v1/version".format(self.host, str(self.port))
         try:
-            self.long_version = json\
-                .loads(requests
-                       .get(v_url, auth=self.auth)
-                       .content)['cromwell']
+            version = json.loads(self.request('GET', v_url).content)['cromwell']
         except (requests.ConnectionError, ValueError) as e:
             msg = "Unable to connect to {}:{}:\n{}".format(
                 self.host, self.port, str(e))
             print_log_exit(msg)
 
-        self.short_version = int(self.long_version.split('-')[0])
-        self.cached_metadata = {}
+        set_cached_version(key, version)
+        return version
 
-    def get(self, rtype, workflow_id=None, headers=None, v2=False):
+    def get(self, rtype, workflow_id=None, headers=None, v2=False, params=None):
         """A generic get request function.
 
         :param rtype: a type of request such as 'abort' or 'status'.
         :param workflow_id: The ID of a workflow if get request requires one.
         :param headers: Optional headers for request.
+        :param params: Optional query parameters, a dict or a list of (key, value).
         :return: json of request response
         """
         url = self.url if not v2 else self.url2
@@ -78,10 +197,8 @@ class Cromwell:
         else:
             workflow_url = url + '/' + rtype
         self.logger.debug("GET REQUEST:{}".format(workflow_url))
-        if headers:
-            r = requests.get(workflow_url, headers=headers, auth=self.auth)
-        else:
-            r = requests.get(workflow_url, auth=self.auth)
+        endpoint_class = 'metadata' if rtype == 'metadata' else 'default'
+        r = self.request('GET', workflow_url, endpoint_class, headers=headers, params=params)
         return json.loads(r.content)
 
     def post(self, rtype, workflow_id=None):
@@ -96,7 +213,7 @@ class Cromwell:
         else:
             workflow_url = self.url + '/' + rtype
         self.logger.debug("POST REQUEST:{}".format(workflow_url))
-        r = requests.post(workflow_url, auth=self.auth)
+        r = self.request('POST', workflow_url)
         return json.loads(r.text)
 
     def patch(self, rtype, workflow_id, payload, headers):
@@ -110,49 +227,62 @@ class Cromwell:
         """
         workflow_url = self.url + '/' + workflow_id + '/' + rtype
         self.logger.debug("POST REQUEST:{}".format(workflow_url))
-        tries = 4
-        while tries != 0:
-            r = requests.patch(url=workflow_url, data=payload,
-                               headers=headers, auth=self.auth)
-            if r.status_code == 200:
-                logging.info('{} request succeeded.'.format(rtype))
-                tries = 0
-            else:
-                logging.warning("{} failed. Error {}: {}".format(
-                    rtype, r.status_code, json.loads(r.text)['message']))
-                logging.info("Retrying...")
-                tries -= tries
-        # Should return none only if patch request fails.
+        # 429 and 503 are retried by the retry policy, other errors are final.
+        r = self.request('PATCH', workflow_url, data=payload, headers=headers)
+        if r.status_code == 200:
+            logging.info('{} request succeeded.'.format(rtype))
+        else:
+            logging.warning("{} failed. Error {}: {}".format(
+                rtype, r.status_code, r.text))
         return r
 
-    def restart_workflow(self, workflow_id, disable_caching=False):
+    def restart_workflow(self, workflow_id, disable_caching=False, dependencies=None, metadata=None):
         """Restart a workflow given an existing workflow id.
 
+        Only the submitted files and labels are fetched, not the whole metadata.
+        Cromwell doesn't keep the dependency zip, so a workflow with imports
+        needs it from the caller.
+
         :param workflow_id: the id of the existing workflow
         :param disable_caching: If true, do not use cached data to restart the workflow. # noqa
+        :param dependencies: The zip file or bytes of the imported WDLs. Optional.
+        :param metadata: The submitted files and labels if they are fetched by the caller. Optional.
         :return: Request response json.
         """
-        metadata = self.query_metadata(workflow_id)
-        processed_labels = self.process_metadata_label(metadata)
+        if metadata is None:
+            metadata = self.query_metadata(workflow_id, include_keys=RESTART_METADATA_KEYS)
 
         try:
-            workflow_input = metadata['submittedFiles']['inputs']
-            wdl = metadata['submittedFiles']['workflow']
-            self.logger.info(
-                'Workflow restarting with inputs: {}'.format(workflow_input))
-            restarted_wf = self.jstart_workflow(wdl, workflow_input,
-                                                wdl_string=True, v2=True,
-                                                disable_caching=disable_caching,
-                                                custom_labels=processed_labels)
-            return restarted_wf
+            submitted_files = metadata['submittedFiles']
+            workflow_input = submitted_files['inputs']
+            wdl = submitted_files['workflow']
         except KeyError:
             return None
 
+        # The original options are kept, call caching is set explicitly.
+        options = json.loads(submitted_files.get('options') or '{}')
+        options.update(CALL_CACHING_OPTIONS)
+        if disable_caching:
+            options['read_from_cache'] = False
+        self.logger.info(
+            'Workflow restarting with inputs: {}'.format(workflow_input))
+        return self.jstart_workflow(wdl, workflow_input, dependencies=dependencies,
+                                    wdl_string=True, extra_options=options,
+                                    custom_labels=self.process_metadata_label(metadata))
+
     @staticmethod
-    def getCalls(status, call_arr, full_logs=False, limit_n=3):
+    def getCalls(status, call_arr, full_logs=False, limit_n=3,
+                 max_log_bytes=MAX_LOG_BYTES):
         filteredCalls = list(
             filter(lambda c: c[1][0]['executionStatus'] == status, call_arr.items()))
-        filteredCalls = map(lambda c: (c[0], c[1][0]), filteredCalls)
+        filteredCalls = list(map(lambda c: (c[0], c[1][0]), filteredCalls))
+
+        def read_log(path):
+            data, truncated = read_tail(path, max_log_bytes)
+            log = data.decode('utf-8', 'replace')
+            if truncated:
+                log = '... (only the last %s bytes)\n%s' % (max_log_bytes, log)
+            return log
 
         def parse_logs(call_tuple):
             call = call_tuple[1]
@@ -171,18 +301,16 @@ class Cromwell:
                 log['stderr'] = e
             if full_logs:
                 try:
-                    with open(call['stdout'], 'r') as stdout_in:
-                        log['stdout']['log'] = stdout_in.read()
-                except IOError as e:
+                    log['stdout']['log'] = read_log(call['stdout'])
+                except (IOError, OSError) as e:
                     log['stdout']['log'] = e
                 try:
-                    with open(call['stderr'], 'r') as stderr_in:
-                        log["stderr"]['log'] = stderr_in.read()
-                except IOError as e:
+                    log["stderr"]['log'] = read_log(call['stderr'])
+                except (IOError, OSError) as e:
                     log["stderr"]['log'] = e
             return log
 
-        return map(lambda c: parse_logs(c), filteredCalls[:limit_n])
+        return list(map(lambda c: parse_logs(c), filteredCalls[:limit_n]))
 
     def explain_workflow(self, workflow_id, include_inputs=True):
         def assign(sdict, ddict, key):
@@ -232,14 +360,16 @@ class Cromwell:
         print("args_string:")
         print(args_string)
 
-        files = {'wdlSource': (wdl_file, open(wdl_file, 'rb'), 'application/octet-stream'),
-                 'workflowInputs': ('report.csv', args_string, 'application/json')}
+        # Files are read into memory, so a throttled request can be sent again.
+        with open(wdl_file, 'rb') as fh:
+            files = {'wdlSource': (wdl_file, fh.read(), 'application/octet-stream'),
+                     'workflowInputs': ('report.csv', args_string, 'application/json')}
 
         if dependencies:
             # add dependency as zip file
-            files['wdlDependencies'] = (dependencies, open(
-                dependencies, 'rb'), 'application/zip')
-        r = requests.post(self.url, files=files, auth=self.auth)
+            with open(dependencies, 'rb') as fh:
+                files['wdlDependencies'] = (dependencies, fh.read(), 'application/zip')
+        r = self.request('POST', self.url, 'submit', files=files)
         return json.loads(r.text)
 
     def jstart_workflow(self, wdl_file, json_file, dependencies=None,
@@ -248,30 +378,34 @@ class Cromwell:
         """Start a workflow using json file for argument inputs.
 
         :param wdl_file: Workflow description file or WDL string (specify wdl_string if so). # noqa
-        :param json_file: JSON file or JSON string containing arguments.
-        :param dependencies: The subworkflow zip file. Optional.
+        :param json_file: JSON file, JSON string, a parsed dict or serialized bytes containing arguments. # noqa
+        :param dependencies: The subworkflow zip file or bytes of a zip file. Optional.
         :param wdl_string: If the wdl_file argument is actually a string. Optional. # noqa
         :param disable_caching: Disable Cromwell cacheing.
         :param extra_options: additional options to be passed to Cromwell.
         :return: Request response json.
         """
 
-        if not json_file.startswith("{"):
+        if isinstance(json_file, dict):
+            # Submitted from memory, the caller's dict is not changed.
+            args = dict(json_file)
+            args['user'] = global_config.getuser()
+            j_args = json.dumps(args)
+        elif isinstance(json_file, bytes):
+            # Already serialized, it's submitted as is.
+            j_args = json_file
+        elif not json_file.startswith("{"):
             with open(json_file) as fh:
                 args = json.load(fh)
-            fh.close()
             args['user'] = global_config.getuser()
-            # j_args = json.dumps(args)
+            j_args = json.dumps(args)
         else:
-            args = json.loads(json_file)
-            # j_args = json_file
-
-        # j_args needs to be a string at this point
-        j_args = json.dumps(args)
+            j_args = json_file
 
         if not wdl_string:
-            files = {'wdlSource': (wdl_file, open(wdl_file, 'rb'), 'application/octet-stream'),
-                     'workflowInputs': ('report.csv', j_args, 'application/json')}
+            with open(wdl_file, 'rb') as fh:
+                files = {'wdlSource': (wdl_file, fh.read(), 'application/octet-stream'),
+                         'workflowInputs': ('report.csv', j_args, 'application/json')}
         else:
             files = {'wdlSource': ('workflow.wdl', wdl_file, 'application/text-plain'),
                      'workflowInputs': ('report.csv', j_args, 'application/json')}
@@ -282,10 +416,13 @@ class Cromwell:
                 label_key = "customLabels"
             files[label_key] = ('labels.json', json.dumps(
                 custom_labels), 'application/json')
-        if dependencies:
+        if isinstance(dependencies, bytes):
+            # add dependency as zip bytes built in memory
+            files['wdlDependencies'] = ('tasks.zip', dependencies, 'application/zip')
+        elif dependencies:
             # add dependency as zip file
-            files['wdlDependencies'] = (dependencies, open(
-                dependencies, 'rb'), 'application/zip')
+            with open(dependencies, 'rb') as fh:
+                files['wdlDependencies'] = (dependencies, fh.read(), 'application/zip')
         workflow_options = {}
         if disable_caching:
             workflow_options.update({"read_from_cache": False})
@@ -298,9 +435,7 @@ class Cromwell:
             for k, v in workflow_options.items():
                 print("{}:{}".format(k, v))
 
-        r = requests.post(self.url, files=files, auth=self.auth) \
-            if not v2 else requests.post(self.url2, files=files,
-                                         auth=self.auth)
+        r = self.request('POST', self.url if not v2 else self.url2, 'submit', files=files)
         if r.status_code not in [200, 201]:
             print_log_exit("Request Failed: {}".format(r.content))
         return json.loads(r.text)
@@ -331,35 +466,33 @@ class Cromwell:
         self.cached_metadata[workflow_id] = metadata
         return metadata
 
-    @rate_limited(300, ONE_MINUTE)
-    def query_metadata(self, workflow_id, v2=False):
+    def query_metadata(self, workflow_id, v2=False, include_keys=None):
         """Return all metadata for a given workflow.
 
         :param workflow_id: The workflow identifier.
+        :param include_keys: Only these keys are returned, e.g. ['submittedFiles', 'labels']. Optional.
         :return: Request Response json.
         """
         self.logger.info(
             'Querying metadata for workflow {}'.format(workflow_id))
+        params = None
+        if include_keys:
+            params = [('includeKey', key) for key in include_keys] + [('expandSubWorkflows', 'false')]
         return self.get('metadata', workflow_id,
                         {'Accept': 'application/json',
-                         'Accept-Encoding': 'identity'}, v2=v2)
+                         'Accept-Encoding': 'identity'}, v2=v2, params=params)
 
-    def process_metadata_label(self, metadata):
+    def process_metadata_label(self, metadata, username=None):
         """Transfer the labels from an old workflow id to a new one. Labels applied by the system are removed so as to avoid conflicts.
 
-        :param old_id: The old workflow to take labels from.
-        :param new_id: The new workflow id to apply the labels to.
-        :return: void.
+        :param metadata: The metadata or a query result of the old workflow, with its labels.
+        :param username: The owner of the new workflow, the current user by default.
+        :return: The labels of the new workflow.
         """
-        processed_labels = metadata['labels']
-        try:
-            del processed_labels['cromwell-workflow-id']
-            del processed_labels['username']
-            processed_labels['username'] = global_config.getuser()
-        except KeyError as e:
-            logging.debug(
-                "{}. No cromwell-workflow-id in old labels.".format(str(e.message)))
-
+        processed_labels = dict(metadata.get('labels') or {})
+        processed_labels.pop('cromwell-workflow-id', None)
+        processed_labels.pop(RESTARTED_LABEL, None)
+        processed_labels['username'] = username or global_config.getuser()
         return processed_labels
 
     def label_workflow(self, workflow_id, labels):
@@ -377,10 +510,11 @@ class Cromwell:
         return self.patch('labels', workflow_id, labels_json, headers)
 
     def query_labels(self, labels, start_time=None, status_filter=None,
-                     running_jobs=False):
+                     running_jobs=False, additional_fields=None):
         """Query cromwell database with a given set of labels.
 
         :param labels: A dictionary of label keys and values.
+        :param additional_fields: e.g. ['labels'], fields to be added into each result.
         :return: Query results.
         """
         label_dict = {}
@@ -391,13 +525,17 @@ class Cromwell:
         if status_filter:
             for status in status_filter:
                 status_query += "status={}&".format(status)
+        fields_query = "&".join("additionalQueryResultFields={}".format(field)
+                                for field in additional_fields or [])
 
         url = self.build_query_url(
-            self.url + '/query?' + "&".join([time_query, status_query]).lstrip("&"), label_dict, "%3A")
-        url = url + 'status=Running' if running_jobs else url
+            self.url + '/query?' + "&".join(
+                [q for q in (time_query, status_query.rstrip("&"), fields_query) if q]) + "&",
+            label_dict, "%3A")
+        url = url.rstrip('&') + '&status=Running' if running_jobs else url
 
         # In some cases we can get a dangling & so this removed that.
-        r = requests.get(url.rstrip('&'), auth=self.auth)
+        r = self.request('GET', url.rstrip('&'), 'query')
         return json.loads(r.content)
 
     def query_status(self, workflow_id):
@@ -436,9 +574,26 @@ class Cromwell:
         base_url = self.url + '/query?'
         query_url = self.build_query_url(base_url, query_dict)
         self.logger.debug("QUERY REQUEST:{}".format(query_url))
-        r = requests.get(query_url, auth=self.auth)
+        r = self.request('GET', query_url, 'query')
         return json.loads(r.text)
 
+    def query_pages(self, query_dict, page_size=1000):
+        """Query all pages of results.
+
+        :param query_dict: Dictionary of query terms, without page and pageSize.
+        :return: A list of results.
+        """
+        results = []
+        page = 1
+        while True:
+            res = self.query(dict(query_dict, page=page, pageSize=page_size))
+            if 'results' not in res:
+                raise ValueError(res.get('message', res))
+            results.extend(res['results'])
+            if not res['results'] or len(results) >= res.get('totalResultsCount', 0):
+                return results
+            page += 1
+
     @staticmethod
     def build_query_url(base_url, url_dict, sep='='):
         """A function for building a query URL given a dictionary of key/value pairs to query. # noqa
@@ -457,8 +612,7 @@ class Cromwell:
                 dt = quote(str(value)) + 'Z'
                 value = dt.replace('%20', 'T')
             if isinstance(value, list):
-                for item in value:
-                    url_string += '{}{}{}'.format(key, sep, item)
+                url_string += '&'.join('{}{}{}'.format(key, sep, item) for item in value)
             else:
                 url_string += '{}{}{}'.format(key, sep, value)
             first = False
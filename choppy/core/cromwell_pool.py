@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.cromwell_pool
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Work with all cromwell servers in choppy.conf at once: fan-out queries
+    with merged results, and load-aware routing of batch submissions.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from choppy.config import get_global_config, set_global_config
+from choppy.core.cromwell import get_cromwell
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+ALL_SERVERS = 'all'
+# Workflows that are waiting for or using the resources of a server.
+LOAD_STATES = ('Submitted', 'Running')
+
+
+def resolve_servers(server):
+    """Get the server names of a --server option, `all` means all servers in choppy.conf."""
+    if server == ALL_SERVERS:
+        return list(global_config.servers)
+    return [server, ]
+
+
+def fan_out(func, servers):
+    """Call func(server) for all servers concurrently.
+
+    :param func: a function with a server name as the only argument.
+    :param servers: a list of server names.
+    :return: (results, errors), two OrderedDicts keyed by server names in the order of servers.
+    """
+    config = get_global_config()
+
+    def call(server):
+        # The global config is thread local.
+        set_global_config(config)
+        try:
+            return func(server), None
+        except SystemExit:
+            # An unreachable server exits in print_log_exit, it mustn't stop the others.
+            return None, 'unable to connect'
+        except Exception as err:
+            return None, err
+
+    results = OrderedDict()
+    errors = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max(len(servers), 1)) as executor:
+        for server, (result, error) in zip(servers, executor.map(call, servers)):
+            if error is None:
+                results[server] = result
+            else:
+                logger.warning("Server %s is skipped: %s" % (server, error))
+                errors[server] = error
+    return results, errors
+
+
+def merge_query_results(responses):
+    """Merge query responses of several servers, every result is marked with its server.
+
+    :param responses: an OrderedDict, {server: query response}.
+    :return: a query response, {'results': [...], 'totalResultsCount': n}.
+    """
+    results = []
+    for server, response in responses.items():
+        for result in response.get('results') or []:
+            result['server'] = server
+            results.append(result)
+    return {'results': results, 'totalResultsCount': len(results)}
+
+
+def query_all(servers, func):
+    """Run a query function on all servers and merge their responses.
+
+    :param func: a function with a Cromwell object as the only argument, it returns a query response.
+    """
+    responses, _ = fan_out(lambda server: func(get_cromwell(server)), servers)
+    return merge_query_results(responses)
+
+
+def find_workflow_server(workflow_id, servers=None):
+    """Find the server that runs a workflow.
+
+    :return: the server name or None.
+    """
+    def query_status(server):
+        return get_cromwell(server).query_status(workflow_id)
+
+    statuses, _ = fan_out(query_status, servers or global_config.servers)
+    for server, status in statuses.items():
+        # Unknown workflows are answered by {"status": "fail", "message": "Unrecognized workflow ID..."}
+        if status.get('id') == workflow_id:
+            return server
+    return None
+
+
+def get_load(server):
+    """The number of submitted and running workflows of a server."""
+    # Only totalResultsCount is needed, not the results.
+    response = get_cromwell(server).query({'status': list(LOAD_STATES), 'pageSize': 1})
+    if 'results' not in response:
+        raise ValueError(response.get('message', response))
+    return response.get('totalResultsCount', len(response['results']))
+
+
+def get_loads(servers):
+    """Get the loads of servers concurrently, unreachable servers are not included.
+
+    :return: an OrderedDict, {server: load}.
+    """
+    loads, _ = fan_out(get_load, servers)
+    return loads
+
+
+class Router:
+    """Pick the least loaded server for every submission.
+
+    Loads are probed once, then counted locally, because a server
+    doesn't report the workflows that are just submitted immediately.
+    """
+
+    def __init__(self, loads):
+        """
+        :param loads: an OrderedDict, {server: load}, ties go to the first server.
+        """
+        if not loads:
+            raise ValueError("No cromwell server is available.")
+        self.loads = OrderedDict(loads)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_servers(cls, servers):
+        loads = get_loads(servers)
+        logger.info("Loads of cromwell servers: %s" %
+                    ', '.join('%s: %s' % (server, load) for server, load in loads.items()))
+        return cls(loads)
+
+    def next(self):
+        with self.lock:
+            server = min(self.loads, key=lambda server: self.loads[server])
+            self.loads[server] += 1
+            return server
+
+    def release(self, server):
+        """A submission to server is failed."""
+        with self.lock:
+            self.loads[server] -= 1
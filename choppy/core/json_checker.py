@@ -10,88 +10,111 @@
 """
 
 from __future__ import unicode_literals
-import re
 import sys
+import json
 import logging
+from json.decoder import JSONDecodeError
 from choppy import exit_code
 
 logger = logging.getLogger(__name__)
 
-try:
-    import json
-except Exception:
-    import simplejson as json
 
-try:  # For Python2.7
-    from cStringIO import StringIO
-except Exception:  # For Python3
-    from io import StringIO
+def _get_backend():
+    """Use the fastest json library, the stdlib json is only needed to locate errors."""
+    try:
+        import orjson
+        return 'orjson', orjson.loads, (orjson.JSONDecodeError, TypeError)
+    except ImportError:
+        pass
 
-try:  # For Python3
-    from json.decoder import JSONDecodeError
-except Exception:  # For Python2.7
-    JSONDecodeError = ValueError
+    try:
+        import ujson
+        return 'ujson', ujson.loads, (ValueError, TypeError)
+    except ImportError:
+        pass
+
+    return 'json', json.loads, (JSONDecodeError, )
+
+
+BACKEND, _fast_loads, _fast_errors = _get_backend()
+
+
+class JsonError(object):
+    """A structured json syntax error."""
+
+    def __init__(self, msg, lineno, colno, pos, line, source=None):
+        self.msg = msg
+        self.lineno = lineno
+        self.colno = colno
+        self.pos = pos
+        self.line = line
+        self.source = source
+
+    @classmethod
+    def from_exception(cls, error, string, source=None):
+        # Only the offending line is sliced out, the document is never scanned line by line.
+        start = string.rfind('\n', 0, error.pos) + 1
+        end = string.find('\n', error.pos)
+        line = string[start:] if end == -1 else string[start:end]
+        return cls(error.msg, error.lineno, error.colno, error.pos, line.rstrip('\r'), source)
+
+    def to_dict(self):
+        return {
+            'msg': self.msg,
+            'lineno': self.lineno,
+            'colno': self.colno,
+            'pos': self.pos,
+            'line': self.line,
+            'source': self.source
+        }
+
+    def __str__(self):
+        return "%s: line %d column %d (char %d)\n\n%s\n%s^-- %s\n" % (
+            self.msg, self.lineno, self.colno, self.pos, self.line,
+            " " * (self.colno - 1), self.msg)
+
+
+def load_json(json_file=None, string='', source=None):
+    """Parse json without exiting.
+
+    :param json_file: path of a json file.
+    :param string: json string, it's used when json_file is None.
+    :param source: a name to be reported with the error, the default is json_file.
+    :return: (obj, None) if valid, otherwise (None, JsonError object).
+    """
+    if json_file:
+        with open(json_file, 'rb') as f:
+            data = f.read()
+        source = source or json_file
+    else:
+        data = string
 
+    try:
+        return _fast_loads(data), None
+    except _fast_errors:
+        pass
 
-class DictStruct:
-    def __init__(self, **entries):
-        self.__dict__.update(entries)
+    # Parse again by the stdlib json only for invalid documents, to get the position.
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    try:
+        # e.g. orjson rejects NaN, but json accepts it.
+        return json.loads(data), None
+    except JSONDecodeError as error:
+        return None, JsonError.from_exception(error, data, source)
 
 
-def parse_error(err):
-    """Parse error string (formats) raised by (simple)json:
+def check_json(json_file=None, string=''):
+    """Check json syntax, exit when it's invalid.
 
-    '%s: line %d column %d (char %d)'
-    '%s: line %d column %d - line %d column %d (char %d - %d)'
+    :return: the parsed object.
     """
-    return re.match(r"""^
-      (?P<msg>.+):\s+
-      line\ (?P<lineno>\d+)\s+
-      column\ (?P<colno>\d+)\s+
-      (?:-\s+
-        line\ (?P<endlineno>\d+)\s+
-        column\ (?P<endcolno>\d+)\s+
-      )?
-      \(char\ (?P<pos>\d+)(?:\ -\ (?P<end>\d+))?\)$""", err, re.VERBOSE)
-
-
-def check_json(json_file=None, string=''):
-    try:
-        if json_file:
-            with open(json_file) as f:
-                json.load(f)
-        else:
-            json.loads(string)
-    except JSONDecodeError as error:
+    obj, error = load_json(json_file=json_file, string=string)
+    if error:
         if json_file:
             logger.error("Invalid JSON: %s" % json_file)
         else:
             logger.error("Invalid JSON")
-
-        if json_file:
-            with open(json_file) as f:
-                string = f.read()
-
-        string = StringIO(string)
-
-        try:  # For Python2.7
-            err_msg = error.message
-            err_dict = parse_error(err_msg).groupdict()
-        # Python3 AttributeError: 'JSONDecodeError' object has no attribute 'message'
-        except Exception:  # For Python3
-            err_msg = str(error)
-            err_dict = parse_error(err_msg).groupdict()
-
-        # cast int captures to int
-        for k, v in err_dict.items():
-            if v and v.isdigit():
-                err_dict[k] = int(v)
-
-        err = DictStruct(**err_dict)
-        for ii, line in enumerate(string.readlines()):
-            if ii == err.lineno - 1:
-                logger.error("%s\n\n%s\n%s^-- %s\n" % (err_msg, line.replace("\n", ""),
-                                                       " " * (err.colno - 1),
-                                                       err.msg))
-
+        logger.error(str(error))
         sys.exit(exit_code.JSON_NOT_VALID)
+    return obj
@@ -13,18 +13,19 @@ from __future__ import unicode_literals
 import logging
 import time
 import json
-import os
 from dateutil.parser import parse
 from choppy.config import get_global_config
-from choppy.core.cromwell import Cromwell
-from choppy.notification import Messenger, EmailNotification
+from choppy.core.cromwell import get_cromwell
+from choppy.notification import Messenger, EmailNotification, NotificationDispatcher
+from choppy.notification.digest_notification import DigestNotification, get_digest_window
+from choppy.notification.attachments import generate_logs_archive, get_attachment_limits
+from choppy.utils import read_tail
 from email.mime.text import MIMEText
 import pytz
 import threading
 import datetime
-from choppy.core.models import Workflow, Base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from choppy.core.models import Workflow, get_session, bulk_upsert
+from sqlalchemy import or_
 
 import traceback
 
@@ -42,10 +43,7 @@ def is_user_workflow(host, user, workflow_id):
     :param workflow_id: workflow
     :return:  The workflow_id if it's the user owns the workflow. Otherwise None.
     """
-    section_name = 'remote_%s' % host if host != 'localhost' else 'local'
-    host, port, auth = global_config.get_conn_info(host, section_name)
-    metadata = Cromwell(host=host, port=port,
-                        auth=auth).query_metadata(workflow_id)
+    metadata = get_cromwell(host).query_metadata(workflow_id)
 
     try:
         j_input = json.loads(metadata['submittedFiles']['inputs'])
@@ -63,25 +61,31 @@ class Monitor:
     """A class for monitoring a user's workflows, providing status reports at regular intervals as well as e-mail notification.
     """
 
-    def __init__(self, user, host, no_notify, verbose, interval, workflow_id=None):
+    def __init__(self, user, host, no_notify, verbose, interval, workflow_id=None,
+                 digest_window=None):
         section_name = 'remote_%s' % host if host != 'localhost' else 'local'
         self.host, self.port, self.auth = global_config.get_conn_info(host, section_name)
         self.user = user
         self.interval = interval
-        self.cromwell = Cromwell(
-            host=self.host, port=self.port, auth=self.auth)
+        self.cromwell = get_cromwell(host)
         self.messenger = Messenger(self.user)
         self.no_notify = no_notify
         self.verbose = verbose
         self.workflow_id = workflow_id
+        self.stopped = threading.Event()
         if user == "*":
-            self.event_subscribers = [EmailNotification(self.cromwell), ]
+            # Notifications are sent by a background thread, so that a slow
+            # smtp server never blocks polling.
+            self.dispatcher = NotificationDispatcher().start()
+            digest_window = get_digest_window() if digest_window is None else digest_window
+            if digest_window > 0:
+                notification = DigestNotification(self.cromwell, dispatcher=self.dispatcher,
+                                                  window=digest_window)
+            else:
+                notification = EmailNotification(self.cromwell, dispatcher=self.dispatcher)
+            self.event_subscribers = [notification, ]
 
-            engine = create_engine("sqlite:///" + global_config.get_path('general', 'workflow_db'))
-            Base.metadata.bind = engine
-            DBSession = sessionmaker()
-            DBSession.bind = engine
-            self.session = DBSession()
+            self.session = get_session()
 
     def get_user_workflows(self, raw=False, start_time=None, silent=False):
         """A function for creating a list of workflows owned by a particular user.
@@ -113,9 +117,15 @@ class Monitor:
         return user_workflows
 
     def process_events(self, workflow):
+        # Subscribers only care about terminal workflows, so the metadata is
+        # fetched only for them, and only once for all subscribers.
+        metadata = getattr(workflow, 'cached_metadata', None)
+        if workflow.status in global_config.run_states:
+            metadata = metadata or {'id': workflow.id, 'status': workflow.status}
+        elif metadata is None or metadata.get('status') != workflow.status:
+            metadata = self.cromwell.query_metadata(workflow.id)
+
         for event_subscriber in self.event_subscribers:
-            metadata = self.cromwell.query_metadata(
-                workflow.id)  # get final metadata
             try:
                 event_subscriber.on_changed_workflow_status(
                     workflow, metadata, self.host, self.port)
@@ -124,33 +134,69 @@ class Monitor:
                 traceback.print_exc()
                 print("Event processing error occurred above.")
 
-    def run(self):
-        while True:
-            try:
-                one_day_ago = datetime.datetime.now() - datetime.timedelta(days=int(1))
-                db_workflows = dict((d.id, d) for d in self.session.query(
-                    Workflow).filter(Workflow.start > one_day_ago))
-                cromwell_workflows = dict((c["id"], c) for c in self.get_user_workflows(
-                    raw=True, start_time=get_iso_datestr(one_day_ago), silent=True)['results'])
-
-                new_workflows = map(lambda c: Workflow(self.cromwell, c["id"]), filter(
-                    lambda w: w["id"] not in db_workflows, cromwell_workflows.values()))
-                [self.session.add(w) for w in new_workflows]
-
-                changed_workflows = filter(lambda d: d.id in cromwell_workflows and d.status !=  # noqa
-                                           cromwell_workflows[d.id]["status"], db_workflows.values())
-                [w.update_status(cromwell_workflows[w.id]["status"])
-                 for w in changed_workflows]
-
-                workflows_to_notify = new_workflows + changed_workflows
-                [self.process_events(w) for w in workflows_to_notify]
-
-                self.session.flush()
-                self.session.commit()
-            except Exception:
-                traceback.print_exc()
+    def sync_workflows(self, start_time):
+        """Save new and changed workflows into database.
 
-            time.sleep(self.interval)
+        :param start_time: a datetime object, only the workflows started after it are compared.
+        :return: A list of workflows to notify.
+        """
+        # Only the needed columns, no orm objects for all rows.
+        db_workflows = dict((row.id, row) for row in self.session.query(
+            Workflow.id, Workflow.status, Workflow.person_id).filter(
+                or_(Workflow.start > start_time, Workflow.start.is_(None))))
+        # All statuses are needed, otherwise workflows that are finished never show up.
+        results = self.cromwell.query_labels({}, start_time=get_iso_datestr(start_time),
+                                             additional_fields=['labels'])['results']
+
+        workflows_to_notify = []
+        for result in results:
+            row = db_workflows.get(result['id'])
+            if row is None:
+                workflow = Workflow.from_query_result(result)
+            elif row.status != result['status']:
+                workflow = Workflow.from_query_result(result, person_id=row.person_id)
+                workflow.update_status(result['status'])
+            else:
+                continue
+            workflows_to_notify.append(workflow)
+
+        bulk_upsert(self.session, [w.to_dict() for w in workflows_to_notify])
+        self.session.commit()
+        return workflows_to_notify
+
+    def run(self):
+        """Poll the server until stop() is called."""
+        try:
+            while not self.stopped.is_set():
+                try:
+                    one_day_ago = datetime.datetime.now() - datetime.timedelta(days=int(1))
+                    workflows_to_notify = self.sync_workflows(one_day_ago)
+                    [self.process_events(w) for w in workflows_to_notify]
+                    [subscriber.flush() for subscriber in self.event_subscribers
+                     if hasattr(subscriber, 'flush')]
+                except Exception:
+                    self.session.rollback()
+                    traceback.print_exc()
+
+                self.stopped.wait(self.interval)
+        finally:
+            self.close()
+
+    def stop(self):
+        """Stop run() after the current poll, it's safe to call from a signal handler."""
+        self.stopped.set()
+
+    def close(self):
+        """Send the buffered notifications, e.g. digests, before the daemon exits.
+        Messages that are not sent yet are kept in the spool of the dispatcher.
+        """
+        for subscriber in self.event_subscribers:
+            if hasattr(subscriber, 'flush'):
+                try:
+                    subscriber.flush(force=True)
+                except Exception:
+                    traceback.print_exc()
+        self.dispatcher.stop()
 
     def monitor_user_workflows(self):
         """A function for monitoring a several workflows.
@@ -182,19 +228,13 @@ class Monitor:
             if query_status['status'] not in global_config.run_states:
                 if not self.no_notify:
                     filename = '{}.metadata.json'.format(query_status['id'])
-                    log_dir = global_config.get_path('general', 'log_dir')
-                    filepath = os.path.join(log_dir, '{}.metadata.json'.format(query_status['id']))
-                    metadata = open(filepath, 'w+')
-                    json.dump(self.cromwell.query_metadata(
-                        workflow_id), indent=4, fp=metadata)
-                    metadata.close()
+                    jdata = self.cromwell.query_metadata(workflow_id)
                     email_content = self.generate_content(
-                        query_status=query_status, workflow_id=workflow_id)
+                        query_status=query_status, workflow_id=workflow_id, metadata=jdata)
                     msg = self.messenger.compose_email(email_content)
 
-                    file_dict = {filename: filepath}
+                    file_dict = {}
                     if 'Failed' in query_status['status']:
-                        jdata = self.cromwell.query_metadata(workflow_id)
                         for task, call in jdata['calls'].items():
                             for shard in call:
                                 if 'Failed' in shard['executionStatus']:
@@ -212,7 +252,8 @@ class Monitor:
                                         logging.warn(str(e))
                                     break
 
-                    attachments = self.generate_attachments(file_dict)
+                    data_dict = {filename: json.dumps(jdata, indent=4)}
+                    attachments = self.generate_attachments(file_dict, data_dict=data_dict)
                     for attachment in attachments:
                         if attachment:
                             msg.attach(attachment)
@@ -224,24 +265,22 @@ class Monitor:
                             email_account, email_domain))
                     else:
                         self.messenger.send_email(msg)
-
-                    os.unlink(filepath)
                 return 0
             else:
                 time.sleep(self.interval)
 
     @staticmethod
     def generate_attachment(filename, filepath):
-        """Create attachment from a file.
+        """Create attachment from the tail of a file.
 
         :param filename: The name to assign to the attachment.
         :param filepath: The absolute path of the file including the file itself.
         :return: An attachment object.
         """
         try:
-            read_data = open(filepath, 'r')
-            attachment = MIMEText(read_data.read())
-            read_data.close()
+            tail_bytes, _ = get_attachment_limits()
+            data, _ = read_tail(filepath, tail_bytes)
+            attachment = MIMEText(data.decode('utf-8', 'replace'))
             attachment.add_header('Content-Disposition',
                                   'attachment', filename=filename)
             return attachment
@@ -249,30 +288,14 @@ class Monitor:
             logging.warn(
                 'Unable to generate attachment for {}:\n{}'.format(filename, e))
 
-    def generate_attachments(self, file_dict):
-        """Generates a list of attachments to be added to an e-mail
+    def generate_attachments(self, file_dict, data_dict=None):
+        """Generates a list of attachments to be added to an e-mail. All files are packed into a single zip file, only the tail of each file is loaded.
 
         :param file_dict: A dictionary of filename:filepath pairs. Note the name is what the file will be called, and does not refer to the name of the file as it exists prior to attaching. That should be part of the filepath.
+        :param data_dict: A dictionary of filename:data pairs that are already in memory, e.g. metadata.
         :return: A list of attachments
         """
-        attachments = list()
-        # if file_dict.items() > 3:
-        #     attachment = MIMEBase('application', 'zip')
-        #     with zipfile.ZipFile('workflow_logs.zip', mode='w') as zf:
-        #         for file_name, path in file_dict.items():
-        #             try:
-        #                 zf.write(path, os.path.basename(file_name))
-        #             except Exception as e:
-        #                 logging.warn('Unable to generate attachment for {}:\n{}'.format(file_name, e))
-        #     zf.close()
-        #     attachment.set_payload('workflow_logs.zip')
-        #     encoders.encode_base64(attachment)
-        #     attachment.add_header('Content-Disposition', 'attachment', filename='workflow_logs.zip')
-        #     attachments.append(attachment)
-        # else:
-        for name, path in file_dict.items():
-            attachments.append(self.generate_attachment(name, path))
-        return attachments
+        return [generate_logs_archive(file_dict, data_dict=data_dict), ]
 
     def generate_content(self, query_status, workflow_id, metadata=None, user=None):
         """A method for generating the email content to be sent to user.
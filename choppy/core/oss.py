@@ -11,10 +11,11 @@
 
 from __future__ import unicode_literals
 import os
+import re
 import sys
 import logging
 from choppy.config import get_global_config
-from subprocess import CalledProcessError, PIPE, Popen
+from subprocess import CalledProcessError, PIPE, Popen, check_output
 
 global_config = get_global_config()
 logger = logging.getLogger(__name__)
@@ -32,8 +33,30 @@ def run_copy_files(first_path, second_path, include=None, exclude=None,
                       recursive=recursive, silent=silent)
 
 
+def get_oss_bin():
+    """Get the path of ossutil, fallback to the bundled one."""
+    oss_bin = global_config.get('oss', 'oss_bin')
+    if not oss_bin:
+        oss_bin_name = 'ossutil64' if os.uname().sysname == 'Linux' else 'ossutilmac64'
+        oss_bin = os.path.join(global_config.resource_dir, 'lib', oss_bin_name)
+    return oss_bin
+
+
+def get_oss_cmd(subcommand):
+    """Build an ossutil command with the credentials in the oss section.
+
+    :param subcommand: ossutil subcommand, such as cp, ls, stat.
+    :return: A list of command line arguments.
+    """
+    access_key = global_config.get('oss', 'access_key')
+    access_secret = global_config.get('oss', 'access_secret')
+    endpoint = global_config.get('oss', 'endpoint')
+    return [get_oss_bin(), subcommand, "-i", access_key, "-k", access_secret,
+            "-e", endpoint]
+
+
 def oss_copy_func(first_path, second_path, include=None, exclude=None,
-                  recursive=True, silent=False):
+                  recursive=True, silent=False, update=True):
     """Call ossutil and copy files from one place to anothers.
 
     :param: first_path: source path.
@@ -48,23 +71,20 @@ def oss_copy_func(first_path, second_path, include=None, exclude=None,
     :type: recursive: bool
     :param: silent: no any exception and warning, just let it go.
     :type: silent: bool
-    :return:
+    :param: update: only copy when the source is newer than the destination,
+                    otherwise force to overwrite the destination.
+    :type: update: bool
+    :return: the return code of ossutil.
     """
     log_dir = global_config.get_path('general', 'log_dir')
     output_dir = os.path.join(log_dir, 'oss_outputs')
     checkpoint_dir = os.path.join(log_dir, 'oss_checkpoint')
 
     try:
-        oss_bin = global_config.get('oss', 'oss_bin')
-        if not oss_bin:
-            oss_bin_name = 'ossutil64' if os.uname().sysname == 'Linux' else 'ossutilmac64'
-            oss_bin = os.path.join(global_config.resource_dir, 'lib', oss_bin_name)
-        access_key = global_config.get('oss', 'access_key')
-        access_secret = global_config.get('oss', 'access_secret')
-        endpoint = global_config.get('oss', 'endpoint')
-        shell_cmd = [oss_bin, "cp", "-u", "-i", access_key, "-k", access_secret,
-                     "--output-dir=%s" % output_dir, "--checkpoint-dir=%s" % checkpoint_dir,
-                     "-e", endpoint]
+        shell_cmd = get_oss_cmd("cp")
+        shell_cmd.extend(["-u" if update else "-f",
+                          "--output-dir=%s" % output_dir,
+                          "--checkpoint-dir=%s" % checkpoint_dir])
         if include:
             shell_cmd.extend(["--include", include])
 
@@ -86,6 +106,62 @@ def oss_copy_func(first_path, second_path, include=None, exclude=None,
                 print(output.strip().decode())
                 sys.stdout.flush()
             process.poll()
+        return process.wait()
     except CalledProcessError as e:
         logger.critical(e)
         logger.critical("access_key/access_secret or oss_link is not valid.")
+
+
+# LastModifiedTime  Size(B)  StorageClass  ETAG  ObjectName
+OSS_LS_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}\s+\S+\s+\S+\s+'
+                            r'(?P<size>\d+)\s+(?P<storage_class>\S+)\s+'
+                            r'(?P<etag>\S+)\s+(?P<key>oss://.+)$')
+
+
+def list_objects(oss_link):
+    """List all objects (recursively) under an oss link by a single `ossutil ls`.
+
+    :param oss_link: oss link, a prefix or an object.
+    :return: A dict, {oss_url: {'size': int, 'etag': str}}.
+    """
+    shell_cmd = get_oss_cmd("ls")
+    shell_cmd.append(oss_link)
+    logger.debug('Running Command: %s' % ' '.join(shell_cmd))
+    try:
+        output = check_output(shell_cmd).decode()
+    except (CalledProcessError, OSError) as err:
+        logger.debug("Error msg: %s" % str(err))
+        return {}
+
+    objects = {}
+    for line in output.splitlines():
+        matched = OSS_LS_PATTERN.match(line.strip())
+        if matched:
+            objects[matched.group('key').strip()] = {
+                'size': int(matched.group('size')),
+                'etag': matched.group('etag').strip('"').upper()
+            }
+    return objects
+
+
+def stat_object(oss_url):
+    """Get the meta of an object by `ossutil stat`.
+
+    :param oss_url: the oss link of an object.
+    :return: A dict, the keys are lower case header names, e.g. etag, x-oss-hash-crc64ecma. # noqa
+    """
+    shell_cmd = get_oss_cmd("stat")
+    shell_cmd.append(oss_url)
+    logger.debug('Running Command: %s' % ' '.join(shell_cmd))
+    try:
+        output = check_output(shell_cmd).decode()
+    except (CalledProcessError, OSError) as err:
+        logger.debug("Error msg: %s" % str(err))
+        return {}
+
+    meta = {}
+    for line in output.splitlines():
+        if ':' in line:
+            key, value = line.split(':', 1)
+            meta[key.strip().lower()] = value.strip()
+    return meta
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.oss_sync
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Checksum-aware sync between a local directory and an oss link.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from choppy.config import get_global_config
+from choppy.exceptions import ChecksumError
+from choppy.core.oss import oss_copy_func, list_objects, stat_object
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _get_crc64():
+    """CRC-64/ECMA-182 by the C extension of crcmod, the same as oss2.
+
+    Hashing large files in pure Python is much slower than transferring them,
+    and nothing else can verify multipart objects, so there is no fallback.
+
+    :return: a function, crc64(data, crc) -> int, crc is the value of the previous chunks.
+             None if crcmod or its C extension is not installed.
+    """
+    try:
+        import crcmod
+        from crcmod.crcmod import _usingExtension
+    except ImportError:
+        return None
+    if not _usingExtension:
+        return None
+    return crcmod.mkCrcFun(0x142F0E1EBA9EA3693, initCrc=0, xorOut=0xFFFFFFFFFFFFFFFF, rev=True)
+
+
+crc64 = _get_crc64()
+
+
+def is_md5_etag(etag):
+    """ETag is the md5 of an object only when it is uploaded by a single PUT."""
+    return etag is not None and len(etag) == 32 and '-' not in etag
+
+
+class DigestCache:
+    """Cache local file digests, keyed by the stat info of each file.
+
+    A file will not be re-hashed unless its size, mtime or inode is changed.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.digests = self._load()
+
+    def _load(self):
+        if os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file, 'r') as f:
+                    return json.load(f)
+            except ValueError:
+                logger.warning('Digest cache is broken, rebuild it: %s' % self.cache_file)
+        return dict()
+
+    @staticmethod
+    def _stat_key(stat):
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get(self, path, with_crc64=False):
+        """Get digests of a local file.
+
+        :param path: local file path.
+        :param with_crc64: compute crc64 if it is not cached, it needs the C extension of crcmod.
+        :return: A dict, {'size': int, 'md5': str, 'crc64': str or None}
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat_key = self._stat_key(stat)
+        with self.lock:
+            cached = self.digests.get(path)
+
+        if cached and cached.get('stat') == stat_key and \
+                (not with_crc64 or cached.get('crc64')):
+            return cached
+
+        digest = self._hash_file(path, with_crc64=with_crc64)
+
+        digest['stat'] = stat_key
+        digest['size'] = stat.st_size
+        with self.lock:
+            self.digests[path] = digest
+        return digest
+
+    @staticmethod
+    def _hash_file(path, with_crc64=False):
+        if with_crc64:
+            check_crc64()
+
+        md5 = hashlib.md5()
+        crc = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                md5.update(chunk)
+                if with_crc64:
+                    crc = crc64(chunk, crc)
+
+        return {
+            'md5': md5.hexdigest().upper(),
+            'crc64': str(crc) if with_crc64 else None
+        }
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.digests)
+        tmp_file = '%s.%s.tmp' % (self.cache_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+        os.replace(tmp_file, self.cache_file)
+
+
+def get_digest_cache():
+    log_dir = global_config.get_path('general', 'log_dir')
+    return DigestCache(os.path.join(log_dir, 'oss_digest_cache.json'))
+
+
+def check_crc64():
+    """Multipart objects can only be verified by crc64, sync refuses to run without it."""
+    if crc64 is None:
+        raise ChecksumError('choppy sync needs crcmod with its C extension to verify '
+                            'multipart objects, `pip install crcmod`.')
+
+
+def is_same(local_path, remote, digest_cache):
+    """Compare a local file with a remote object.
+
+    :return: (same, method), method is one of size, md5 and crc64.
+    """
+    size = os.path.getsize(local_path)
+    if remote is None or remote['size'] != size:
+        return False, 'size'
+
+    if is_md5_etag(remote['etag']):
+        digest = digest_cache.get(local_path)
+        return digest['md5'] == remote['etag'], 'md5'
+
+    # Multipart objects: ETag is not a md5, so compare the crc64.
+    check_crc64()
+    remote_crc64 = remote.get('crc64')
+    if remote_crc64 is None:
+        remote_crc64 = stat_object(remote['url']).get('x-oss-hash-crc64ecma')
+        remote['crc64'] = remote_crc64
+    if not remote_crc64:
+        return False, 'crc64'
+    digest = digest_cache.get(local_path, with_crc64=True)
+    return digest['crc64'] == remote_crc64, 'crc64'
+
+
+def _is_included(name, include=None, exclude=None):
+    if include and not fnmatch.fnmatch(name, include):
+        return False
+    if exclude and fnmatch.fnmatch(name, exclude):
+        return False
+    return True
+
+
+def _join_oss(prefix, relpath):
+    return prefix.rstrip('/') + '/' + relpath.replace(os.sep, '/')
+
+
+def _list_remote(oss_link):
+    objects = list_objects(oss_link)
+    for url, obj in objects.items():
+        obj['url'] = url
+    return objects
+
+
+def collect_pairs(src, dest, include=None, exclude=None):
+    """Pair local files with remote objects.
+
+    :return: (direction, [(local_path, oss_url)], remote_objects)
+    """
+    if src.startswith('oss://'):
+        direction = 'download'
+        remote_objects = _list_remote(src)
+        pairs = []
+        prefix = src if src.endswith('/') else src + '/'
+        for url in sorted(remote_objects.keys()):
+            if url.endswith('/'):
+                continue
+            if url == src:
+                # src is a single object.
+                local_path = os.path.join(dest, os.path.basename(url)) \
+                    if os.path.isdir(dest) else dest
+            elif url.startswith(prefix):
+                local_path = os.path.join(dest, *url[len(prefix):].split('/'))
+            else:
+                continue
+            if _is_included(os.path.basename(url), include, exclude):
+                pairs.append((local_path, url))
+    elif dest.startswith('oss://'):
+        direction = 'upload'
+        remote_objects = _list_remote(dest)
+        pairs = []
+        if os.path.isfile(src):
+            pairs.append((src, dest if not dest.endswith('/')
+                          else _join_oss(dest, os.path.basename(src))))
+        else:
+            for root, dirnames, filenames in os.walk(src):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if not _is_included(filename, include, exclude):
+                        continue
+                    local_path = os.path.join(root, filename)
+                    relpath = os.path.relpath(local_path, src)
+                    pairs.append((local_path, _join_oss(dest, relpath)))
+    else:
+        raise ValueError('One of src and dest must be an oss link.')
+
+    return direction, pairs, remote_objects
+
+
+def sync(src, dest, include=None, exclude=None, jobs=4, dry_run=False,
+         manifest=None):
+    """Transfer the files that differ between src and dest in parallel.
+
+    :param src: a local path or an oss link.
+    :param dest: a local path or an oss link.
+    :param include: include pattern of file name, e.g. *.jpg
+    :param exclude: exclude pattern of file name, e.g. *.txt
+    :param jobs: the number of parallel transfers.
+    :param dry_run: only compare files, skipping transfer.
+    :param manifest: the path of manifest file, the default is in log_dir.
+    :return: A manifest dict.
+    """
+    check_crc64()
+    digest_cache = get_digest_cache()
+    direction, pairs, remote_objects = collect_pairs(src, dest, include, exclude)
+
+    def compare(pair):
+        local_path, url = pair
+        record = {'local': local_path, 'remote': url}
+        if not os.path.isfile(local_path):
+            record.update({'action': 'transfer', 'method': 'missing', 'verified': False})
+            return record
+        same, method = is_same(local_path, remote_objects.get(url), digest_cache)
+        record.update({'action': 'skip' if same else 'transfer', 'method': method,
+                       'verified': same})
+        return record
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        records = list(executor.map(compare, pairs))
+
+    to_transfer = [r for r in records if r['action'] == 'transfer']
+    logger.info('%s files in total, %s files need to %s.' %
+                (len(records), len(to_transfer), direction))
+
+    if not dry_run and to_transfer:
+        def transfer(record):
+            if direction == 'upload':
+                rc = oss_copy_func(record['local'], record['remote'],
+                                   recursive=False, silent=True, update=False)
+            else:
+                parent_dir = os.path.dirname(record['local'])
+                if parent_dir:
+                    os.makedirs(parent_dir, exist_ok=True)
+                rc = oss_copy_func(record['remote'], record['local'],
+                                   recursive=False, silent=True, update=False)
+            record['action'] = 'transferred' if rc == 0 else 'failed'
+            return record
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for idx, record in enumerate(executor.map(transfer, to_transfer)):
+                logger.info('[%s/%s] %s %s' % (idx + 1, len(to_transfer),
+                                               record['action'], record['remote']))
+
+        # Verify transferred files against the remote checksums.
+        if direction == 'upload':
+            remote_objects = _list_remote(dest)
+        transferred = [r for r in to_transfer if r['action'] == 'transferred']
+
+        def verify(record):
+            same, method = is_same(record['local'], remote_objects.get(record['remote']),
+                                   digest_cache)
+            record.update({'verified': same, 'method': method})
+            if not same:
+                logger.warning('Checksum mismatch after transfer: %s' % record['remote'])
+            return record
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(verify, transferred))
+
+    for record in records:
+        if os.path.isfile(record['local']):
+            digest = digest_cache.get(record['local'])
+            record.update({'size': digest['size'], 'md5': digest['md5'],
+                           'crc64': digest.get('crc64')})
+    digest_cache.save()
+
+    manifest_dict = {
+        'src': src,
+        'dest': dest,
+        'direction': direction,
+        'dry_run': dry_run,
+        'created_time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': records
+    }
+
+    if manifest is None:
+        manifest_dir = os.path.join(global_config.get_path('general', 'log_dir'),
+                                    'sync_manifests')
+        os.makedirs(manifest_dir, exist_ok=True)
+        manifest = os.path.join(manifest_dir, '%s.json' % time.strftime('%Y%m%d%H%M%S'))
+
+    with open(manifest, 'w') as f:
+        json.dump(manifest_dict, f, indent=2)
+    logger.info('Save sync manifest to %s' % manifest)
+    return manifest_dict
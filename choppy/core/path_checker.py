@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.path_checker
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Check the existence of many paths (local or oss) in parallel.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from choppy.core.oss import list_objects
+
+logger = logging.getLogger(__name__)
+
+# One scandir reads the whole directory, it's cheaper than a stat for each name only when
+# the names are enough and not too few of its entries.
+SCANDIR_THRESHOLD = 16
+SCANDIR_RATIO = 64
+# A directory takes about this many bytes for an entry in its size, e.g. ext4 and xfs.
+DIRENT_SIZE = 32
+# Every `ossutil ls` is a subprocess, a prefix is listed at once for this many urls,
+# however many objects it has.
+OSS_LIST_THRESHOLD = 32
+MAX_WORKERS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """A shared thread pool, path probes are io bound."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def _estimate_entries(stat):
+    # Subdirectories are counted by st_nlink, files by the size of the directory.
+    return max(stat.st_nlink - 2, stat.st_size // DIRENT_SIZE, 1)
+
+
+def _probe_local_dir(dirname, names):
+    """Check which names exist in a local directory.
+
+    :return: A dict, {name: bool}
+    """
+    def stat_names():
+        return dict((name, os.path.exists(os.path.join(dirname, name))) for name in names)
+
+    if len(names) < SCANDIR_THRESHOLD:
+        return stat_names()
+    try:
+        stat = os.stat(dirname)
+    except FileNotFoundError:
+        return dict((name, False) for name in names)
+    except (IOError, OSError):
+        return stat_names()
+    if len(names) * SCANDIR_RATIO < _estimate_entries(stat):
+        return stat_names()
+
+    try:
+        found = set()
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if entry.name in names:
+                    # Broken symlinks are listed, but they don't exist.
+                    if not entry.is_symlink() or os.path.exists(entry.path):
+                        found.add(entry.name)
+        return dict((name, name in found) for name in names)
+    except (IOError, OSError):
+        # e.g. a directory that can be traversed but not read (--x).
+        return stat_names()
+
+
+def _probe_oss_prefix(prefix, urls):
+    """Check a group of oss urls by a single listing.
+
+    :return: A dict, {url: bool}
+    """
+    # Only list the object itself when there are few urls.
+    if len(urls) < OSS_LIST_THRESHOLD:
+        objects = {}
+        for url in urls:
+            objects.update(list_objects(url))
+    else:
+        objects = list_objects(prefix)
+
+    def exists(url):
+        if url in objects:
+            return True
+        # A "directory" exists when any object is in it.
+        dir_prefix = url.rstrip('/') + '/'
+        return any(key.startswith(dir_prefix) for key in objects)
+
+    return dict((url, exists(url)) for url in urls)
+
+
+def check_paths(paths):
+    """Check the existence of paths, they are deduplicated and grouped by parent directory.
+
+    :param paths: an iterable of local paths or oss links (oss://bucket/key).
+    :return: A dict, {path: bool}
+    """
+    local_groups = defaultdict(set)
+    oss_groups = defaultdict(set)
+    # path -> (is_oss, group, name)
+    index = {}
+    for path in set(paths):
+        cleaned = path.rstrip()
+        if cleaned.startswith('oss://'):
+            url = cleaned.rstrip('/') if cleaned.count('/') > 3 else cleaned
+            prefix = url.rsplit('/', 1)[0] + '/'
+            oss_groups[prefix].add(url)
+            index[path] = (True, prefix, url)
+        else:
+            normed = os.path.normpath(os.path.abspath(cleaned))
+            dirname, name = os.path.split(normed)
+            local_groups[dirname].add(name)
+            index[path] = (False, dirname, name)
+
+    executor = get_executor()
+    local_futures = dict((dirname, executor.submit(_probe_local_dir, dirname, names))
+                         for dirname, names in local_groups.items())
+    oss_futures = dict((prefix, executor.submit(_probe_oss_prefix, prefix, urls))
+                       for prefix, urls in oss_groups.items())
+    local_results = dict((key, future.result()) for key, future in local_futures.items())
+    oss_results = dict((key, future.result()) for key, future in oss_futures.items())
+
+    results = {}
+    for path, (is_oss, group, name) in index.items():
+        if is_oss:
+            results[path] = oss_results[group][name]
+        else:
+            # The root directory has no name.
+            results[path] = local_results[group][name] if name else os.path.exists(group)
+    logger.debug('Checked %s paths in %s directories.' %
+                 (len(results), len(local_groups) + len(oss_groups)))
+    return results
@@ -12,14 +12,32 @@
 from __future__ import unicode_literals
 import git
 import os
+import json
+import hashlib
 from getpass import getpass
 
+LARGE_FILES_MANIFEST = '.choppy-large-files.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256sum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
 
 class Git:
-    def __init__(self):
+    def __init__(self, max_file_size=None):
+        """
+        :param max_file_size: files larger than it (bytes) are not saved as git blobs,
+                              only their size and sha256 are recorded in the large files manifest.
+        """
         self.path = None
         self.repo = None
         self.remote = None
+        self.max_file_size = max_file_size
 
     def init_repo(self, path):
         self.path = path
@@ -59,33 +77,95 @@ class Git:
             self._set_auth(username)
         self.remote = self.repo.create_remote(name=name, url=url)
 
-    def _get_all_files(self):
-        previous_dir = os.getcwd()
-        os.chdir(self.path)
-
-        all_files = []
-        for root, dirnames, filenames in os.walk(os.getcwd()):
-            if '.git' in dirnames:
-                dirnames.remove('.git')
-
-            for filename in filenames:
-                all_files.append(os.path.join(root, filename))
-
-        os.chdir(previous_dir)
-        return all_files
+    def get_changes(self):
+        """Get changed files by the stat info in the index, unchanged files are not hashed again.
+
+        :return: (changed and untracked paths, deleted paths), untracked files honor .gitignore.
+        """
+        changed, deleted = [], []
+        for diff in self.repo.index.diff(None):
+            if diff.deleted_file:
+                deleted.append(diff.a_path)
+            else:
+                changed.append(diff.a_path)
+        changed.extend(self.repo.untracked_files)
+        return changed, deleted
+
+    def _load_manifest(self):
+        manifest_file = os.path.join(self.path, LARGE_FILES_MANIFEST)
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _update_manifest(self, paths):
+        """Record large files in the manifest instead of the index.
+
+        :return: paths to be added to the index, the manifest is included when it's changed.
+        """
+        manifest = self._load_manifest()
+        old_manifest = json.dumps(manifest, sort_keys=True)
+        small_files, large_files = [], []
+        for path in paths:
+            abs_path = os.path.join(self.path, path)
+            if os.path.isfile(abs_path) and os.path.getsize(abs_path) > self.max_file_size:
+                large_files.append(path)
+            elif path != LARGE_FILES_MANIFEST:
+                small_files.append(path)
+
+        # Known large files are excluded from git, so they are checked by their stat here.
+        for path in set(manifest) | set(large_files):
+            abs_path = os.path.join(self.path, path)
+            if not os.path.isfile(abs_path):
+                manifest.pop(path, None)
+                continue
+
+            stat = os.stat(abs_path)
+            entry = manifest.get(path)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+                manifest[path] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                  'sha256': sha256sum(abs_path)}
+
+        if large_files:
+            exclude_file = os.path.join(self.repo.git_dir, 'info', 'exclude')
+            if not os.path.isdir(os.path.dirname(exclude_file)):
+                os.makedirs(os.path.dirname(exclude_file))
+            with open(exclude_file, 'a') as f:
+                f.writelines('/%s\n' % path for path in large_files)
+
+        if json.dumps(manifest, sort_keys=True) != old_manifest:
+            with open(os.path.join(self.path, LARGE_FILES_MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            small_files.append(LARGE_FILES_MANIFEST)
+        return small_files
 
     def add(self):
+        """Add changed and untracked files, and remove deleted files from the index.
+
+        :return: True if the index is changed.
+        """
         self._check_repo(
             "Attempting to add but the repo doesn't exist. "
             "You need to call init_repo firstly.")
-        self.repo.index.add(items=self._get_all_files())
+        changed, deleted = self.get_changes()
+        if self.max_file_size:
+            small_files = self._update_manifest(changed)
+            # Tracked files which become too large are moved out of git.
+            deleted.extend(path for path in set(changed) - set(small_files)
+                           if path != LARGE_FILES_MANIFEST and (path, 0) in self.repo.index.entries)
+            changed = small_files
+
+        if changed:
+            self.repo.index.add(items=changed)
+        if deleted:
+            self.repo.index.remove(items=deleted)
+        return bool(changed or deleted)
 
     def commit(self, msg="Add new files."):
         self._check_repo(
             "Attempting to commit but the repo doesn't exist. "
             "You need to call init_repo firstly.")
-        if self.is_dirty():
-            self.repo.index.add(items=self._get_all_files())
+        if self.add():
             self.repo.index.commit(msg)
 
     def push(self):
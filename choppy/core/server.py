@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.server
+    ~~~~~~~~~~~~~~~~~~
+
+    A long-running choppy server. It keeps config, app registry, bundles,
+    the workflow database and cromwell clients warm, and runs batch, query
+    and search for the command-line over a HTTP API on a unix socket.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import logging
+import threading
+import http.client
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+from choppy.config import get_global_config, set_global_config
+from choppy.utils import get_log_file, get_log_format
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+# monitor is not here, a monitor daemon never returns and it would block other actions.
+SERVER_ACTIONS = ('batch', 'query', 'search')
+# batch renders a whole project and drives the shared womtool worker, only one runs at a time.
+# query and search are read-only, they run concurrently.
+EXCLUSIVE_ACTIONS = ('batch',)
+
+_exclusive_lock = threading.Lock()
+# The output of an action is bound to the thread that runs it.
+_local = threading.local()
+
+# The parser of command lines is built once, it lists all apps for the choices of app names.
+_parser = None
+_parser_apps = None
+_parser_lock = threading.Lock()
+
+
+def get_socket_path():
+    socket_path = global_config.get('general', 'server_socket')
+    return os.path.expanduser(socket_path) if socket_path else None
+
+
+def get_parser():
+    """Get the parser of command lines, it's built again only when apps are installed or removed."""
+    from choppy import choppy_pipe
+    from choppy.core.app_registry import get_registry
+
+    global _parser, _parser_apps
+    apps = get_registry().names()
+    with _parser_lock:
+        if _parser is None or apps != _parser_apps:
+            _parser = choppy_pipe.build_parser()
+            _parser_apps = apps
+        return _parser
+
+
+class ResponseStream(io.TextIOBase):
+    """Write to a response as json lines, e.g. {"stream": "stdout", "data": "..."}"""
+
+    def __init__(self, wfile, name, lock):
+        self.wfile = wfile
+        self.name = name
+        self.lock = lock
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            line = json.dumps({'stream': self.name, 'data': data}) + '\n'
+            with self.lock:
+                self.wfile.write(line.encode('utf-8'))
+                self.wfile.flush()
+        return len(data)
+
+
+class ThreadStream(io.TextIOBase):
+    """sys.stdout or sys.stderr of the server, an action writes to the stream of its thread."""
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    @property
+    def stream(self):
+        return getattr(_local, self.name, None) or self.default
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def fileno(self):
+        return self.default.fileno()
+
+
+class ActionLogHandler(logging.Handler):
+    """A root handler, it sends a record to the handler of the action that logs it."""
+
+    def emit(self, record):
+        handler = getattr(_local, 'log_handler', None)
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+
+
+def _is_server_record(record):
+    # Records of actions are not logged by the handlers of the server.
+    return getattr(_local, 'log_handler', None) is None
+
+
+@contextmanager
+def route_output():
+    """Route stdout, stderr and logs by threads, so actions can run concurrently."""
+    stdout, stderr = sys.stdout, sys.stderr
+    root_logger = logging.getLogger()
+    handlers, level = list(root_logger.handlers), root_logger.level
+    action_handler = ActionLogHandler()
+
+    sys.stdout = ThreadStream('stdout', stdout)
+    sys.stderr = ThreadStream('stderr', stderr)
+    for handler in handlers:
+        handler.addFilter(_is_server_record)
+    # Levels are set by the handlers, an action may log more than the server.
+    root_logger.addHandler(action_handler)
+    root_logger.setLevel(logging.DEBUG)
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        root_logger.removeHandler(action_handler)
+        root_logger.setLevel(level)
+        for handler in handlers:
+            handler.removeFilter(_is_server_record)
+
+
+@contextmanager
+def _bind_output(stdout, stderr):
+    _local.stdout, _local.stderr = stdout, stderr
+    try:
+        yield
+    finally:
+        _local.stdout = _local.stderr = None
+
+
+@contextmanager
+def _capture_logs(stream, log_name, loglevel, handler='stream', subdir='project_logs', log_dir='/tmp'):
+    """Log to the response or the log file of a command line, the same as set_logger."""
+    if handler != 'stream':
+        log_handler = logging.FileHandler(get_log_file(log_name, subdir=subdir, log_dir=log_dir))
+    else:
+        log_handler = logging.StreamHandler(stream)
+    log_handler.setFormatter(logging.Formatter(get_log_format(loglevel)))
+    log_handler.setLevel(logging.DEBUG if loglevel == logging.SPAM else loglevel)
+
+    _local.log_handler = log_handler
+    try:
+        yield
+    finally:
+        _local.log_handler = None
+        log_handler.close()
+
+
+def run_action(argv, cwd, stdout, stderr):
+    """Run a command line in the server, same as `choppy <argv>` in cwd.
+    The server must route its output by route_output.
+
+    :return: the exit code.
+    """
+    from choppy import choppy_pipe
+
+    with _bind_output(stdout, stderr):
+        try:
+            args = choppy_pipe.parse_args(argv, parser=get_parser(), working_dir=cwd)
+            log_name, log_kwargs = choppy_pipe.get_logger_args(args)
+            with _capture_logs(stderr, log_name, **log_kwargs):
+                choppy_pipe.clean_cache()
+                choppy_pipe.run(args)
+            return 0
+        except SystemExit as err:
+            if err.code is None or isinstance(err.code, int):
+                return err.code or 0
+            print(err.code, file=stderr)
+            return 1
+        except Exception as err:
+            logger.exception(err)
+            return 1
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/status':
+            from choppy.core.app_registry import get_registry
+
+            self._send_json(200, {'pid': os.getpid(), 'actions': SERVER_ACTIONS,
+                                  'apps': get_registry().names()})
+        else:
+            self._send_json(404, {'message': 'Not found.'})
+
+    def do_POST(self):
+        action = self.path[len('/api/'):] if self.path.startswith('/api/') else None
+        if action not in SERVER_ACTIONS:
+            self._send_json(404, {'message': 'Not supported action: %s' % action})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            argv = [action] + list(payload.get('args', []))
+            cwd = payload['cwd']
+        except (ValueError, KeyError, TypeError) as err:
+            self._send_json(400, {'message': 'Bad request: %s' % err})
+            return
+
+        exclusive = action in EXCLUSIVE_ACTIONS
+        if exclusive and not _exclusive_lock.acquire(blocking=False):
+            # The client runs it locally at once instead of waiting.
+            self._send_json(503, {'message': 'Choppy server is busy with another %s.' % action})
+            return
+
+        try:
+            # The output is streamed as json lines, and the last line is the exit code.
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            lock = threading.Lock()
+            stdout = ResponseStream(self.wfile, 'stdout', lock)
+            stderr = ResponseStream(self.wfile, 'stderr', lock)
+            code = run_action(argv, cwd, stdout, stderr)
+            with lock:
+                self.wfile.write((json.dumps({'exit_code': code}) + '\n').encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning('The client of %s is disconnected.' % action)
+        finally:
+            if exclusive:
+                _exclusive_lock.release()
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def process_request_thread(self, request, client_address):
+        # The global config is thread local, modules imported by actions need it.
+        set_global_config(global_config)
+        super(UnixHTTPServer, self).process_request_thread(request, client_address)
+
+    def get_request(self):
+        request, _ = super(UnixHTTPServer, self).get_request()
+        # BaseHTTPRequestHandler needs a (host, port) client address.
+        return request, ('local', 0)
+
+
+def warm_up():
+    """Load everything that is shared by actions."""
+    from choppy.core.app_registry import get_registry
+    from choppy.core.app_bundle import load_bundle
+    from choppy.core.models import get_engine
+
+    registry = get_registry()
+    for name in registry.names():
+        try:
+            load_bundle(registry.get_path(name))
+        except Exception as err:
+            logger.warning("Can't load the bundle of %s: %s" % (name, err))
+    get_engine()
+    get_parser()
+
+
+def serve(socket_path=None):
+    """Run the server until it's interrupted.
+
+    :param socket_path: the unix socket, the default is server_socket in [general].
+    """
+    socket_path = socket_path or get_socket_path()
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            raise OSError("Choppy server is already running: %s" % socket_path)
+        os.remove(socket_path)
+
+    warm_up()
+    # Only the owner can connect to the socket.
+    previous_umask = os.umask(0o177)
+    try:
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    finally:
+        os.umask(previous_umask)
+    logger.info("Choppy server is listening on %s" % socket_path)
+
+    # Clean up the socket when it's stopped by kill.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        with route_output():
+            server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def is_running(socket_path=None):
+    socket_path = socket_path or get_socket_path()
+    if not socket_path or not os.path.exists(socket_path):
+        return False
+    conn = UnixHTTPConnection(socket_path, timeout=1)
+    try:
+        conn.request('GET', '/api/status')
+        response = conn.getresponse()
+        response.read()
+        return response.status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+def forward(argv, socket_path=None):
+    """Run a command line by the server if it's running.
+
+    :return: the exit code, None if no server is running, it's busy or the action is not supported.
+    """
+    if not argv or argv[0] not in SERVER_ACTIONS or os.environ.get('CHOPPY_NO_SERVER'):
+        return None
+    if '-h' in argv or '--help' in argv:
+        return None
+
+    socket_path = socket_path or get_socket_path()
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+
+    stdout, stderr = sys.stdout, sys.stderr
+    conn = UnixHTTPConnection(socket_path)
+    body = json.dumps({'args': argv[1:], 'cwd': os.getcwd()})
+    try:
+        conn.request('POST', '/api/%s' % argv[0], body=body,
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+    except (OSError, http.client.HTTPException):
+        # A stale socket, run it locally.
+        conn.close()
+        return None
+
+    try:
+        if response.status == 503:
+            # The server is busy with another action, run it locally.
+            return None
+        if response.status != 200:
+            print(json.loads(response.read().decode('utf-8')).get('message'), file=stderr)
+            return 1
+
+        code = 1
+        for line in response:
+            message = json.loads(line.decode('utf-8'))
+            if 'exit_code' in message:
+                code = message['exit_code']
+            else:
+                stream = stderr if message['stream'] == 'stderr' else stdout
+                stream.write(message['data'])
+                stream.flush()
+        return code
+    finally:
+        conn.close()
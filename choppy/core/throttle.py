@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.throttle
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Rate limits and retries of requests to cromwell servers, the app store
+    and smtp servers. Limiters are scoped per server and endpoint class, so
+    a busy server or a heavy endpoint never slows down the others.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import time
+import asyncio
+import logging
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+ONE_MINUTE = 60
+# 429 Too Many Requests and 503 Service Unavailable are answered before a request is handled.
+RETRY_STATUS = (429, 503)
+# Requests per minute of cromwell endpoint classes when they are not set in choppy.conf,
+# metadata is the heaviest query, it's limited even without settings.
+DEFAULT_RATE_LIMITS = {
+    'metadata': 300,
+    'query': None,
+    'submit': None,
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """A token bucket, `rate` tokens are added every `per` seconds, and at most `burst` tokens are kept."""
+
+    def __init__(self, rate, per=ONE_MINUTE, burst=None):
+        self.rate = float(rate) / per
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def reserve(self):
+        """Take a token without blocking, it may be borrowed from the future.
+
+        :return: seconds to wait before the request is sent, 0 means now.
+                 An async caller awaits asyncio.sleep() with it, see RetryPolicy.send_async.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_acquire(self):
+        """Take a token if there is one, it never waits.
+
+        :return: True if a token is taken.
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Take a token, the calling thread waits for it."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_limiter(scope, endpoint_class, rate, per=ONE_MINUTE):
+    """Get the shared limiter of an endpoint class of a server.
+
+    :param scope: the server, e.g. host:port or an url.
+    :param endpoint_class: e.g. metadata, query or submit.
+    :param rate: requests per `per` seconds, 0 or None means no limit.
+    :return: a TokenBucket object or None.
+    """
+    if not rate:
+        return None
+
+    key = (scope, endpoint_class)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(rate, per=per)
+        return _limiters[key]
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header, it's seconds or a http date.
+
+    :return: seconds or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    now = datetime.datetime.now(retry_at.tzinfo)
+    return max((retry_at - now).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    """Retry a request answered by 429 or 503 with exponential backoff, Retry-After is honored."""
+
+    def __init__(self, max_retries=3, backoff=1.0, max_backoff=60.0, statuses=RETRY_STATUS):
+        """
+        :param max_retries: retries after the first request.
+        :param backoff: seconds to wait before the first retry, it's doubled for every retry.
+        :param max_backoff: the longest wait, Retry-After is capped by it too.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def get_delay(self, attempt, response):
+        """Get the wait before the next retry, it never waits.
+
+        :param attempt: 0 for the first request.
+        :param response: a requests.Response object.
+        :return: seconds, None means the response is final.
+        """
+        if response.status_code not in self.statuses or attempt >= self.max_retries:
+            return None
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is None:
+            retry_after = self.backoff * 2 ** attempt
+        return min(retry_after, self.max_backoff)
+
+    def _next_delay(self, attempt, response):
+        delay = self.get_delay(attempt, response)
+        if delay is not None:
+            logger.warning("Request to %s is throttled (%s), retry in %.1f seconds." %
+                           (response.url, response.status_code, delay))
+        return delay
+
+    def send(self, send_request, limiter=None):
+        """Send a request until it's not throttled, the calling thread waits between retries.
+
+        :param send_request: a function without arguments that returns a requests.Response object.
+        :param limiter: a TokenBucket object, a token is taken for every request.
+        :return: the last response.
+        """
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            response = send_request()
+            delay = self._next_delay(attempt, response)
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, send_request, limiter=None):
+        """The same as send for async callers, waits are awaited, the event loop is never blocked.
+
+        :param send_request: a coroutine function without arguments, it returns a response
+                             with status_code, headers and url like requests.Response.
+        :param limiter: a TokenBucket object, a token is reserved for every request.
+        :return: the last response.
+        """
+        attempt = 0
+        while True:
+            if limiter is not None:
+                delay = limiter.reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            response = await send_request()
+            delay = self._next_delay(attempt, response)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def get_throttle_settings(section):
+    """Read the rate limits and the retry policy from a server section of choppy.conf.
+
+    rate_limit is requests per minute for every endpoint class, <class>_rate_limit
+    overrides it, e.g. metadata_rate_limit. Empty values keep the defaults.
+
+    :param section: a dict of the section.
+    :return: (rate_limits, retry_policy), rate_limits is {endpoint_class: rate}.
+    """
+    def get_number(key, default, cast=int):
+        value = section.get(key)
+        return cast(value) if value not in (None, '') else default
+
+    rate_limit = get_number('rate_limit', None)
+    rate_limits = {'default': rate_limit}
+    for endpoint_class, default in DEFAULT_RATE_LIMITS.items():
+        rate_limits[endpoint_class] = get_number('%s_rate_limit' % endpoint_class,
+                                                 rate_limit if rate_limit is not None else default)
+    retry_policy = RetryPolicy(max_retries=get_number('max_retries', 3),
+                               backoff=get_number('retry_backoff', 1.0, cast=float))
+    return rate_limits, retry_policy
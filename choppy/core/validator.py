@@ -13,27 +13,35 @@ from __future__ import unicode_literals
 import logging
 import json
 import os
-import subprocess
 import csv
 import sys
 from choppy import exit_code
 from choppy.config import get_global_config
+from choppy.core.wdl_signature import get_wdl_signature
+from choppy.core.path_checker import check_paths
+from choppy.exceptions import WomtoolError
 
 global_config = get_global_config()
 module_logger = logging.getLogger(__name__)
 
 
+class FileError(object):
+    """An error that is kept only when the file doesn't exist."""
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
+
 class Validator:
     """Module to validate JSON inputs.
     """
 
-    def __init__(self, wdl, json):
+    def __init__(self, wdl, json=None):
         self.wdl = os.path.abspath(wdl)
-        self.json = os.path.abspath(json)
-        womtool_path = global_config.get('general', 'womtool_path')
-        if not womtool_path:
-            raise Exception('You need to tell choppy-pipe where womtool is.')
-        self.wdl_tool = os.path.abspath(womtool_path)
+        self.json = os.path.abspath(json) if json else None
+        # Womtool is only needed when the builtin WDL parser can't handle the WDL.
+        self.wdl_tool = global_config.get('general', 'womtool_path')
         self.logger = logging.getLogger('choppy.validator.Validator')
 
     def get_json(self):
@@ -53,40 +61,35 @@ class Validator:
         :return: Returns a dictionary of wdl arguments as keys and expected type as as value. # noqa
         """
         try:
-            os.chdir(os.path.dirname(self.wdl))
-        except OSError:
-            self.logger.warn('Warning: Could not navigate to WDL directory.')
-        cmd = ['java', '-jar', self.wdl_tool, 'inputs', self.wdl]
-        try:
-            run = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode("utf-8")
-        except subprocess.CalledProcessError:
+            # The signature is cached by the content of the WDL and its imports.
+            wdl_args = get_wdl_signature(self.wdl)
+        except (WomtoolError, OSError) as err:
+            self.logger.debug(str(err))
             self.logger.warn("Unable to execute womtool command. "
                              "Make sure any subworkflow wdl files are present and try again.")
             sys.exit(exit_code.WOMTOOL_CAN_NOT_EXECUTE)
 
-        try:
-            if optional:
-                return json.loads(run)
-            else:
-                d = json.loads(run)
-                ds = json.dumps(
-                    {k: v for k, v in d.items() if "optional" not in v})
-                return json.loads(ds)
-        except ValueError:
-            self.logger.error("Something went wrong with getting args. "
-                              "Note that if using validation, unzipped WDL dependencies "
-                              "must be in same directory as main WDL.\n "
-                              "Alternatively, turn off validation or use choppy.py validate")
-            sys.exit(exit_code.VALIDATE_ERROR)
+        if optional:
+            return wdl_args
+        else:
+            return {k: v for k, v in wdl_args.items() if "optional" not in v}
 
     def validate_json(self):
         """A function for validating a json file intended for WDL execution against the WDL file.
 
         :return: A list of errors found with the json file.
         """
+        return self.validate_inputs(self.get_json())
+
+    def validate_inputs(self, jdict, wdict=None):
+        """Validate inputs (a dict) against the WDL file.
+
+        :param jdict: inputs dict, e.g. rendered inputs of a sample.
+        :param wdict: dictionary of wdl args, the default is from get_wdl_args.
+        :return: A list of errors found with the inputs.
+        """
         errors = list()
-        jdict = self.get_json()
-        wdict = self.get_wdl_args()
+        wdict = self.get_wdl_args() if wdict is None else dict(wdict)
         # for every key/value pair in jdict
         # first make sure the key is in wdict. If it isn't, that's an error.
         # return a list of any errors uncovered.
@@ -94,15 +97,10 @@ class Validator:
             if self.validate_param(param, wdict):
                 # param is valid
                 if 'File' in wdict[param]:
-                    if isinstance(val, list):
-                        for f in val:
-                            if not self.validate_file(f):
-                                errors.append(
-                                    '{}: {} is not a valid file path.'.format(param, f))
-                    else:
-                        if not self.validate_file(val):
-                            errors.append(
-                                '{}: {} is not a valid file path.'.format(param, val))
+                    # Files are checked together at the end, see resolve_file_errors.
+                    for f in (val if isinstance(val, list) else [val]):
+                        errors.append(FileError(
+                            f, '{}: {} is not a valid file path.'.format(param, f)))
                 elif 'Array' in wdict[param]:
                     if not self.validate_array(val):
                         errors.append(
@@ -131,7 +129,7 @@ class Validator:
                     try:
                         fh = open(val, 'r')
                         s_reader = csv.reader(fh, delimiter='\t')
-                        errors += self.validate_samples_array(s_reader)
+                        errors += self.validate_samples_array(s_reader, deferred=True)
                         fh.close()
                     except IOError as e:
                         errors.append(str(e))
@@ -144,20 +142,29 @@ class Validator:
             if 'optional' not in v:
                 errors.append(
                     'Required parameter {} is missing from input json.'.format(k))
-        return errors
+        return self.resolve_file_errors(errors)
+
+    @staticmethod
+    def resolve_file_errors(errors):
+        """Check all deferred files at once, and keep the errors of missing files.
 
-    def validate_samples_array(self, samples_array):
+        :param errors: A list of errors and FileError objects.
+        :return: A list of errors.
+        """
+        results = check_paths(e.path for e in errors if isinstance(e, FileError))
+        return [e.message if isinstance(e, FileError) else e for e in errors
+                if not isinstance(e, FileError) or not results[e.path]]
+
+    def validate_samples_array(self, samples_array, deferred=False):
         """Validates a TSV sample file array (passed as an array) used in WDL inputs. Assumes that last column of each row contains an absolute path to a file.
 
         :param samples_array: an array with the last column of each row containing a file path.
+        :param deferred: return FileError objects instead of checking files immediately.
         :return: A list of errors. If list is empty, there were no errors.
         """
-        errors = []
-        for row in samples_array:
-            if not self.validate_file(row[-1]):
-                errors.append(
-                    'File path {} found in samples file does not exist.'.format(row[-1]))
-        return errors
+        errors = [FileError(row[-1], 'File path {} found in samples file does not exist.'.format(row[-1]))
+                  for row in samples_array if row]
+        return errors if deferred else self.resolve_file_errors(errors)
 
     @staticmethod
     def validate_array(i):
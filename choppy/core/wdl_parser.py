@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.wdl_parser
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    A lightweight WDL (draft-2 and 1.0) parser to extract workflow inputs without womtool.
+
+    Only the structure needed by `womtool inputs` is parsed: imports, tasks,
+    declarations and calls. WdlParseError is raised for anything else (e.g.
+    structs, sub-workflows, http imports), so that callers can fall back to womtool.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import re
+from collections import OrderedDict
+from choppy.exceptions import WdlParseError
+
+KNOWN_TYPES = ('String', 'Int', 'Float', 'Boolean', 'File', 'Array', 'Map', 'Pair', 'Object')
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+VERSION_PATTERN = re.compile(r'version[ \t]+(\S+)')
+IMPORT_PATTERN = re.compile(r'import\s+("[^"]*"|\'[^\']*\')(?:\s+as\s+([A-Za-z_]\w*))?')
+IMPORT_ALIAS_PATTERN = re.compile(r'\s+alias\s+\w+\s+as\s+\w+')
+BLOCK_PATTERN = re.compile(r'(task|workflow|struct)\s+([A-Za-z_]\w*)\s*\{')
+SECTION_PATTERN = re.compile(r'(input|output|runtime|meta|parameter_meta)\s*\{')
+CONTROL_PATTERN = re.compile(r'(scatter|if)\s*\(')
+CALL_PATTERN = re.compile(r'call\s+([A-Za-z_][\w.]*)(?:\s+as\s+([A-Za-z_]\w*))?')
+COMMAND_PATTERN = re.compile(r'command\s*(<<<|\{)')
+
+
+def _skip_string(text, pos):
+    """Skip a string literal (with nested placeholders), text[pos] is the quote.
+
+    :return: the position after the closing quote.
+    """
+    quote = text[pos]
+    i = pos + 1
+    while i < len(text):
+        c = text[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == quote:
+            return i + 1
+        if c in '$~' and text.startswith('{', i + 1):
+            i = _match_pair(text, i + 1)
+            continue
+        i += 1
+    raise WdlParseError('Unterminated string at %s' % pos)
+
+
+def _match_pair(text, pos, open_char=None, close_char=None, strings=True):
+    """Find the matching close char of text[pos].
+
+    :return: the position after the close char.
+    """
+    open_char = open_char or text[pos]
+    close_char = close_char or {'{': '}', '(': ')', '[': ']'}[open_char]
+    depth = 0
+    i = pos
+    while i < len(text):
+        c = text[i]
+        if strings and c in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if c == open_char:
+            depth += 1
+        elif c == close_char:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise WdlParseError('Unbalanced %s at %s' % (open_char, pos))
+
+
+def clean_source(text):
+    """Remove comments and command sections, they may contain anything."""
+    result = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in '"\'':
+            end = _skip_string(text, i)
+            result.append(text[i:end])
+            i = end
+        elif c == '#':
+            end = text.find('\n', i)
+            i = len(text) if end == -1 else end
+        elif c == 'c' and (i == 0 or not (text[i - 1].isalnum() or text[i - 1] == '_')) and \
+                COMMAND_PATTERN.match(text, i):
+            m = COMMAND_PATTERN.match(text, i)
+            if m.group(1) == '<<<':
+                end = text.find('>>>', m.end())
+                if end == -1:
+                    raise WdlParseError('Unterminated command section at %s' % i)
+                i = end + 3
+            else:
+                # Shell code is not WDL, quotes in it are not balanced strings.
+                i = _match_pair(text, m.end() - 1, strings=False)
+        else:
+            result.append(c)
+            i += 1
+    return ''.join(result)
+
+
+def _skip_ws(text, pos):
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _parse_type(text, pos):
+    """Parse a type, e.g. Array[Pair[String, File]]+?
+
+    :return: (type string without spaces, position after the type), or (None, pos)
+    """
+    m = IDENTIFIER.match(text, pos)
+    if not m:
+        return None, pos
+    i = m.end()
+    if text.startswith('[', i):
+        i = _match_pair(text, i)
+    while i < len(text) and text[i] in '?+':
+        i += 1
+    # Womtool style, e.g. Map[String, Int]
+    type_str = re.sub(r'\s+', '', text[pos:i]).replace(',', ', ')
+    for name in IDENTIFIER.findall(type_str):
+        if name not in KNOWN_TYPES:
+            raise WdlParseError('Unsupported type: %s' % type_str)
+    return type_str, i
+
+
+def _read_expression(text, pos):
+    """Read an expression until the end of line, brackets may span lines."""
+    depth = 0
+    i = pos
+    while i < len(text):
+        c = text[i]
+        if c in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+            if depth < 0:
+                break
+        elif c == '\n' and depth == 0:
+            break
+        i += 1
+    return text[pos:i].strip(), i
+
+
+def _split_top_level(text, sep=','):
+    parts = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if c in '([{':
+            depth += 1
+        elif c in ')]}':
+            depth -= 1
+        elif c == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def parse_body(body):
+    """Parse statements of a task/workflow body.
+
+    :return: A list of tuples:
+             ('decl', type, name, expression or None)
+             ('section', name, body)
+             ('control', keyword, body)
+             ('call', target, alias, bound input names)
+    """
+    items = []
+    pos = 0
+    while True:
+        pos = _skip_ws(body, pos)
+        if pos >= len(body):
+            return items
+
+        m = SECTION_PATTERN.match(body, pos)
+        if m:
+            end = _match_pair(body, m.end() - 1)
+            items.append(('section', m.group(1), body[m.end():end - 1]))
+            pos = end
+            continue
+
+        m = CONTROL_PATTERN.match(body, pos)
+        if m:
+            i = _skip_ws(body, _match_pair(body, m.end() - 1))
+            if not body.startswith('{', i):
+                raise WdlParseError('Expect { after %s' % m.group(1))
+            end = _match_pair(body, i)
+            items.append(('control', m.group(1), body[i + 1:end - 1]))
+            pos = end
+            continue
+
+        m = CALL_PATTERN.match(body, pos)
+        if m:
+            target = m.group(1)
+            alias = m.group(2) or target.split('.')[-1]
+            bound = []
+            i = _skip_ws(body, m.end())
+            pos = m.end()
+            if body.startswith('{', i):
+                end = _match_pair(body, i)
+                inner = body[i + 1:end - 1].strip()
+                if inner.startswith('input'):
+                    inner = inner[len('input'):].lstrip()
+                    if not inner.startswith(':'):
+                        raise WdlParseError('Expect input: in call %s' % alias)
+                    inner = inner[1:]
+                for part in _split_top_level(inner):
+                    bound.append(part.split('=', 1)[0].strip())
+                pos = end
+            items.append(('call', target, alias, bound))
+            continue
+
+        type_str, i = _parse_type(body, pos)
+        name = IDENTIFIER.match(body, _skip_ws(body, i)) if type_str else None
+        if not name:
+            raise WdlParseError('Unsupported statement: %s' % body[pos:pos + 40].split('\n')[0])
+        i = _skip_ws(body, name.end())
+        expression = None
+        if body.startswith('=', i) and not body.startswith('==', i):
+            expression, i = _read_expression(body, i + 1)
+        items.append(('decl', type_str, name.group(0), expression))
+        pos = i
+
+
+class WdlDocument(object):
+    """Tasks, workflows and imports of a WDL file (and its imports)."""
+
+    def __init__(self, path, cache=None):
+        self.path = os.path.abspath(path)
+        # Shared by all imported documents.
+        self.cache = {} if cache is None else cache
+        self.version = 'draft-2'
+        self.imports = OrderedDict()
+        self.tasks = OrderedDict()
+        self.workflows = OrderedDict()
+        self._parse()
+
+    def _parse(self):
+        try:
+            with open(self.path, 'r') as f:
+                text = clean_source(f.read())
+        except (IOError, OSError) as err:
+            raise WdlParseError(str(err))
+
+        pos = 0
+        while True:
+            pos = _skip_ws(text, pos)
+            if pos >= len(text):
+                break
+
+            m = VERSION_PATTERN.match(text, pos)
+            if m:
+                self.version = m.group(1)
+                if self.version != '1.0':
+                    raise WdlParseError('Unsupported WDL version: %s' % self.version)
+                pos = m.end()
+                continue
+
+            m = IMPORT_PATTERN.match(text, pos)
+            if m:
+                if IMPORT_ALIAS_PATTERN.match(text, m.end()):
+                    raise WdlParseError('Struct aliases in imports are not supported.')
+                uri = m.group(1)[1:-1]
+                alias = m.group(2) or os.path.splitext(os.path.basename(uri))[0]
+                self.imports[alias] = self._import(uri)
+                pos = m.end()
+                continue
+
+            m = BLOCK_PATTERN.match(text, pos)
+            if m:
+                if m.group(1) == 'struct':
+                    raise WdlParseError('Structs are not supported.')
+                end = _match_pair(text, m.end() - 1)
+                items = parse_body(text[m.end():end - 1])
+                if m.group(1) == 'task':
+                    self.tasks[m.group(2)] = items
+                else:
+                    self.workflows[m.group(2)] = items
+                pos = end
+                continue
+
+            raise WdlParseError('Unsupported statement: %s' % text[pos:pos + 40].split('\n')[0])
+
+    def _import(self, uri):
+        if '://' in uri:
+            raise WdlParseError('Http imports are not supported: %s' % uri)
+        path = os.path.abspath(os.path.join(os.path.dirname(self.path), uri))
+        if path not in self.cache:
+            self.cache[path] = None
+            self.cache[path] = WdlDocument(path, cache=self.cache)
+        elif self.cache[path] is None:
+            raise WdlParseError('Circular import: %s' % uri)
+        return self.cache[path]
+
+    def task_inputs(self, name):
+        """Get inputs of a task.
+
+        :return: A list of (name, type, expression or None)
+        """
+        items = self.tasks[name]
+        if self.version == '1.0':
+            inputs = []
+            for item in items:
+                if item[0] == 'section' and item[1] == 'input':
+                    inputs.extend(i[1:] for i in parse_body(item[2]) if i[0] == 'decl')
+            return [(n, t, e) for t, n, e in inputs]
+        else:
+            return [(item[2], item[1], item[3]) for item in items if item[0] == 'decl']
+
+    def resolve_call(self, target):
+        """Find the document and the task name of a call target."""
+        parts = target.split('.')
+        if len(parts) == 1:
+            doc, name = self, parts[0]
+        elif len(parts) == 2 and parts[0] in self.imports:
+            doc, name = self.imports[parts[0]], parts[1]
+        else:
+            raise WdlParseError('Unknown call target: %s' % target)
+
+        if name in doc.workflows:
+            raise WdlParseError('Sub-workflows are not supported: %s' % target)
+        if name not in doc.tasks:
+            raise WdlParseError('Unknown task: %s' % target)
+        return doc, name
+
+
+def format_type(type_str, expression=None, optional=False):
+    """Format a type as `womtool inputs` does."""
+    if expression is not None:
+        return '%s (optional, default = %s)' % (type_str, re.sub(r'\s*\n\s*', ' ', expression))
+    if optional or type_str.endswith('?'):
+        return '%s (optional)' % type_str
+    return type_str
+
+
+def _walk_calls(items):
+    for item in items:
+        if item[0] == 'call':
+            yield item
+        elif item[0] == 'control':
+            for call in _walk_calls(parse_body(item[2])):
+                yield call
+
+
+def get_inputs(wdl_path):
+    """Extract workflow inputs from a WDL file, the result is the same as `womtool inputs`.
+
+    :param wdl_path: path of the main WDL file, imports must be in the right places.
+    :return: an OrderedDict, {'workflow.param': 'Type (optional, default = ...)'}
+    """
+    doc = WdlDocument(wdl_path)
+    if len(doc.workflows) != 1:
+        raise WdlParseError('Expect one workflow in %s, found %s.' % (wdl_path, len(doc.workflows)))
+
+    workflow_name, items = list(doc.workflows.items())[0]
+    calls = list(_walk_calls(items))
+    call_aliases = set(call[2] for call in calls)
+    inputs = OrderedDict()
+
+    if doc.version == '1.0':
+        for item in items:
+            if item[0] == 'section' and item[1] == 'input':
+                for decl in parse_body(item[2]):
+                    if decl[0] == 'decl':
+                        inputs['%s.%s' % (workflow_name, decl[2])] = format_type(decl[1], decl[3])
+    else:
+        for item in items:
+            if item[0] != 'decl':
+                continue
+            _, type_str, name, expression = item
+            if expression is not None and any(re.search(r'\b%s\.' % re.escape(alias), expression)
+                                              for alias in call_aliases):
+                # It depends on the output of a call, it's not an input.
+                continue
+            inputs['%s.%s' % (workflow_name, name)] = format_type(type_str, expression)
+
+    for _, target, alias, bound in calls:
+        task_doc, task_name = doc.resolve_call(target)
+        for name, type_str, expression in task_doc.task_inputs(task_name):
+            if name not in bound:
+                inputs['%s.%s.%s' % (workflow_name, alias, name)] = format_type(type_str, expression)
+    return inputs
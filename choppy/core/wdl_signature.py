@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.wdl_signature
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Get the input signature of WDL files by the builtin parser or womtool,
+    cached by the content of a WDL and its imports.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import re
+import json
+import copy
+import hashlib
+import logging
+import threading
+from choppy.config import get_global_config
+from choppy.core.womtool import get_womtool_path, run_womtool
+from choppy.core.wdl_parser import get_inputs
+from choppy.exceptions import WomtoolError, WdlParseError
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+IMPORT_PATTERN = re.compile(r'^\s*import\s+"([^"]+)"', re.MULTILINE)
+
+_signatures = {}
+_signatures_lock = threading.Lock()
+
+
+def get_imports(wdl_str):
+    return IMPORT_PATTERN.findall(wdl_str)
+
+
+def wdl_digest(wdl_path):
+    """Get sha256 of a WDL file and all its imports (recursively).
+
+    The rendered workflow.wdl of each sample lives in its own directory,
+    so only the import names and contents are hashed, not the absolute paths.
+    """
+    sha = hashlib.sha256()
+    visited = set()
+
+    def update(path, name):
+        path = os.path.abspath(path)
+        if path in visited:
+            return
+        visited.add(path)
+
+        sha.update(name.encode('utf-8') + b'\0')
+        if not os.path.isfile(path):
+            # Womtool will complain about it, but the key is still stable.
+            sha.update(b'<missing>\0')
+            return
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        sha.update(str(len(data)).encode('utf-8') + b'\0' + data)
+
+        for import_name in get_imports(data.decode('utf-8', 'replace')):
+            if '://' in import_name:
+                # Http imports, only the url is hashed.
+                sha.update(import_name.encode('utf-8') + b'\0')
+            else:
+                update(os.path.join(os.path.dirname(path), import_name), import_name)
+
+    update(wdl_path, '')
+    return sha.hexdigest()
+
+
+def womtool_digest(digest):
+    """Different womtool may give different signatures, so the jar is a part of the key."""
+    womtool_path = get_womtool_path()
+    identity = os.path.basename(womtool_path)
+    if os.path.isfile(womtool_path):
+        stat = os.stat(womtool_path)
+        identity = '%s:%s:%s' % (identity, stat.st_size, int(stat.st_mtime))
+    return hashlib.sha256(('%s:%s' % (digest, identity)).encode('utf-8')).hexdigest()
+
+
+def is_parser_enabled():
+    value = global_config.get('general', 'wdl_parser')
+    return value in (None, '') or str(value).upper() in ('T', 'TRUE')
+
+
+def get_cache_dir():
+    app_root_dir = global_config.get_path('general', 'app_root_dir')
+    return os.path.join(app_root_dir, '.cache', 'wdl_signatures')
+
+
+def _load(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _save(cache_file, signature):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(signature, f)
+    os.replace(tmp_file, cache_file)
+
+
+def get_wdl_signature(wdl_path, use_parser=None):
+    """Get the input signature of a WDL file, it's computed only once for the same content.
+
+    The builtin parser is tried first, womtool is used for what it can't handle.
+
+    :param wdl_path: path of WDL file, its imports must be in the right places.
+    :param use_parser: set False to always use womtool, the default is wdl_parser in general section.
+    :return: a dict, {param: type}, the same as `womtool inputs`.
+    """
+    wdl_path = os.path.abspath(wdl_path)
+    use_parser = is_parser_enabled() if use_parser is None else use_parser
+    digest = wdl_digest(wdl_path)
+    with _signatures_lock:
+        signature = _signatures.get((digest, use_parser))
+
+    if signature is None and use_parser:
+        try:
+            signature = get_inputs(wdl_path)
+        except WdlParseError as err:
+            logger.debug('Parse %s failed, fall back to womtool: %s' % (wdl_path, err))
+
+    if signature is None:
+        signature = get_womtool_signature(wdl_path, digest)
+
+    with _signatures_lock:
+        _signatures[(digest, use_parser)] = signature
+    # Callers may change it, e.g. Validator.validate_json.
+    return copy.deepcopy(signature)
+
+
+def get_womtool_signature(wdl_path, digest):
+    cache_file = os.path.join(get_cache_dir(), '%s.json' % womtool_digest(digest))
+    signature = _load(cache_file)
+    if signature is None:
+        # Imports are resolved relative to the WDL.
+        returncode, output = run_womtool(['inputs', wdl_path], cwd=os.path.dirname(wdl_path))
+        if returncode != 0:
+            raise WomtoolError(output)
+
+        try:
+            signature = json.loads(output)
+        except ValueError:
+            raise WomtoolError('Womtool output is not a valid json: %s' % output)
+
+        _save(cache_file, signature)
+        logger.debug('Cache WDL signature %s: %s' % (digest, wdl_path))
+    return signature
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.core.womtool
+    ~~~~~~~~~~~~~~~~~~~
+
+    Module to run womtool commands in a long-lived JVM.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import re
+import atexit
+import logging
+import tempfile
+import threading
+import subprocess
+from choppy.config import get_global_config
+from choppy.exceptions import WomtoolError
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+# A worker is restarted at most MAX_RESTARTS times, and then subprocess is always used.
+MAX_RESTARTS = 3
+IMPORT_PATTERN = re.compile(r'^(\s*import\s+)(["\'])([^"\']+)\2', re.MULTILINE)
+
+
+class WomtoolWorkerError(Exception):
+    pass
+
+
+def get_womtool_path():
+    womtool_path = global_config.get('general', 'womtool_path')
+    if not womtool_path:
+        raise WomtoolError('You need to tell choppy-pipe where womtool is.')
+    return os.path.abspath(os.path.expanduser(womtool_path))
+
+
+class WomtoolWorker(object):
+    """Keep a JVM alive with womtool loaded, womtool commands are sent by stdin/stdout.
+
+    See choppy/resources/womtool/WomtoolWorker.java for the protocol.
+    """
+
+    def __init__(self, womtool_path, java='java'):
+        self.womtool_path = womtool_path
+        self.java = java
+        self.worker_src = os.path.join(global_config.resource_dir, 'womtool', 'WomtoolWorker.java')
+        self.cmd = [self.java, '-cp', self.womtool_path, self.worker_src]
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        ready = self.process.stdout.readline()
+        if ready.strip() != b'READY':
+            self.stop()
+            raise WomtoolWorkerError('Womtool worker failed to start.')
+        logger.debug('Womtool worker is started (pid %s).' % self.process.pid)
+        return self
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+            self.process = None
+
+    def run(self, args):
+        """Run a womtool command.
+
+        :param args: womtool arguments, e.g. ['inputs', '/path/workflow.wdl']
+        :return: (returncode, output)
+        """
+        if any('\t' in arg or '\n' in arg for arg in args):
+            raise WomtoolWorkerError('Womtool arguments must not contain tab or newline.')
+
+        with self.lock:
+            if not self.is_alive():
+                raise WomtoolWorkerError('Womtool worker is not running.')
+            try:
+                self.process.stdin.write(('\t'.join(args) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+                header = self.process.stdout.readline().split()
+                returncode, length = int(header[0]), int(header[1])
+                output = self.process.stdout.read(length)
+            except (IOError, OSError, ValueError, IndexError) as err:
+                self.stop()
+                raise WomtoolWorkerError('Womtool worker died: %s' % err)
+        return returncode, output.decode('utf-8')
+
+
+_worker = None
+_restarts = 0
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """Get the shared womtool worker, start it when it's not running.
+
+    :return: WomtoolWorker object, or None when it can't be started.
+    """
+    global _worker, _restarts
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return _worker
+        if _restarts >= MAX_RESTARTS:
+            return None
+
+        _restarts += 1
+        try:
+            _worker = WomtoolWorker(get_womtool_path()).start()
+            return _worker
+        except (WomtoolWorkerError, OSError) as err:
+            logger.debug('Womtool worker is not available, use subprocess instead: %s' % err)
+            _worker = None
+            if isinstance(err, OSError):
+                # No java, it's no use to retry.
+                _restarts = MAX_RESTARTS
+            return None
+
+
+def stop_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop()
+            _worker = None
+
+
+atexit.register(stop_worker)
+
+
+def is_worker_enabled():
+    value = global_config.get('general', 'womtool_worker')
+    return value in (None, '') or str(value).upper() in ('T', 'TRUE')
+
+
+def _is_relative_import(uri):
+    return '://' not in uri and not os.path.isabs(uri)
+
+
+def get_relative_imports(source):
+    """Get the imports of a WDL that are resolved by its dependency zip, not URLs or absolute paths."""
+    return [match.group(3) for match in IMPORT_PATTERN.finditer(source)
+            if _is_relative_import(match.group(3))]
+
+
+def _read_relative_imports(wdl_path):
+    with open(wdl_path, 'r') as f:
+        source = f.read()
+    return source, get_relative_imports(source)
+
+
+def get_worker_args(args, cwd=None):
+    """Make womtool arguments independent of the working directory, the worker can't change it.
+
+    The WDL is the first argument after the command. Its relative imports are
+    resolved against cwd in a temporary copy of the WDL.
+
+    :return: (args, tmp_file), args is None if the worker can't run it, e.g.
+             an imported WDL has relative imports too. tmp_file must be removed by the caller.
+    """
+    if cwd is None or len(args) < 2:
+        return list(args), None
+
+    wdl_path = os.path.join(cwd, args[1])
+    if not os.path.isfile(wdl_path):
+        return None, None
+    source, imports = _read_relative_imports(wdl_path)
+    if not imports:
+        return [args[0], wdl_path] + list(args[2:]), None
+
+    for uri in imports:
+        imported_path = os.path.join(cwd, uri)
+        if not os.path.isfile(imported_path) or _read_relative_imports(imported_path)[1]:
+            return None, None
+
+    def absolutize(match):
+        uri = match.group(3)
+        if _is_relative_import(uri):
+            uri = os.path.abspath(os.path.join(cwd, uri))
+        return match.group(1) + match.group(2) + uri + match.group(2)
+
+    fd, tmp_file = tempfile.mkstemp(prefix='womtool-', suffix='.wdl')
+    with os.fdopen(fd, 'w') as f:
+        f.write(IMPORT_PATTERN.sub(absolutize, source))
+    return [args[0], tmp_file] + list(args[2:]), tmp_file
+
+
+def run_womtool(args, cwd=None, use_worker=None):
+    """Run a womtool command, the shared worker is used when possible.
+
+    :param args: womtool arguments, e.g. ['inputs', '/path/workflow.wdl']
+    :param cwd: the directory that relative paths and imports are resolved against,
+                the current process is never changed.
+    :param use_worker: set False to always use subprocess, the default is womtool_worker in general section.
+    :return: (returncode, output)
+    """
+    use_worker = is_worker_enabled() if use_worker is None else use_worker
+    worker = get_worker() if use_worker else None
+    if worker is not None:
+        worker_args, tmp_file = get_worker_args(args, cwd)
+        try:
+            if worker_args is not None:
+                return worker.run(worker_args)
+        except WomtoolWorkerError as err:
+            logger.warning('%s, fall back to subprocess.' % err)
+        finally:
+            if tmp_file is not None:
+                os.remove(tmp_file)
+
+    cmd = ['java', '-jar', get_womtool_path()] + list(args)
+    process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output, _ = process.communicate()
+    return process.returncode, output.decode('utf-8')
@@ -12,22 +12,76 @@
 from __future__ import unicode_literals
 import csv
 import os
+import sys
 import json
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from choppy import exit_code
+from choppy.config import get_global_config, set_global_config
 from choppy.check_utils import check_dir, is_valid_label
 from choppy.core.app_utils import (parse_samples, render_app, write,
-                                   generate_dependencies_zip, submit_workflow,
+                                   build_dependencies_zip, submit_workflow,
                                    AppDefaultVar, is_valid_app, get_version)
-from choppy.core.json_checker import check_json
+from choppy.core.app_bundle import load_bundle
+from choppy.core.cromwell import CALL_CACHING_OPTIONS, RESTARTED_LABEL, get_cromwell
+from choppy.core.cromwell_pool import (ALL_SERVERS, Router, fan_out, find_workflow_server,
+                                       merge_query_results, resolve_servers)
+from choppy.core.json_checker import load_json
 from choppy.utils import copy_and_overwrite
 
+global_config = get_global_config()
 logger = logging.getLogger(__name__)
 
+# Workflows in these states are submitted again by a rerun.
+RERUN_STATES = ('Failed', 'Aborted')
+
+
+def validate_samples(rendered_samples, jobs=None, bundle=None):
+    """Validate rendered inputs of all samples against their WDL in parallel.
+
+    :param rendered_samples: a list of dicts, {'sample', 'wdl', 'wdl_path', 'inputs'}, inputs is a parsed dict.
+    :param jobs: the number of parallel workers.
+    :param bundle: the bundle of the app, its signature is used if it's the same for all samples.
+    :return: an OrderedDict, {sample_id: [errors]}, only samples with errors are included.
+    """
+    from choppy.core.validator import Validator
+
+    def validate(rendered):
+        validator = Validator(rendered['wdl_path'])
+        # Otherwise the WDL signature is cached, so womtool runs only once for the same WDL.
+        wdict = bundle.get_signature(rendered['wdl']) if bundle else None
+        return validator.validate_inputs(rendered['inputs'], wdict=wdict)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(validate, rendered_samples)
+        errors = OrderedDict()
+        for rendered, sample_errors in zip(rendered_samples, results):
+            if sample_errors:
+                errors[rendered['sample'].get('sample_id')] = sample_errors
+    return errors
+
+
+def write_validation_report(report_path, errors):
+    with open(report_path, 'wt') as f:
+        for sample_id, sample_errors in errors.items():
+            f.write('[%s]\n' % sample_id)
+            for error in sample_errors:
+                f.write('%s\n' % error.rstrip('\n'))
+            f.write('\n')
+
+
+def wait_futures(futures):
+    """Wait for all futures, errors are raised."""
+    for future in futures:
+        future.result()
+
 
 def run_batch(project_name, app_dir, samples, label, server='localhost',
-              username=None, dry_run=False, force=False):
+              username=None, dry_run=False, force=False, validate=False, working_dir=None):
     is_valid_app(app_dir)
-    working_dir = os.getcwd()
+    working_dir = working_dir or os.getcwd()
     project_path = os.path.join(working_dir, project_name)
     check_dir(project_path, skip=force)
 
@@ -35,15 +89,34 @@ def run_batch(project_name, app_dir, samples, label, server='localhost',
     successed_samples = []
     failed_samples = []
 
+    if label is None:
+        label = []
+
+    # 用户可通过samples文件覆写default文件中已定义的变量
+    # 只有samples文件中缺少的变量才从default文件中取值
+    app_default_var = AppDefaultVar(app_dir)
+    all_default_value = app_default_var.show_default_value()
+
+    # The prebuilt bundle (choppy build) saves compiling templates and zipping tasks.
+    bundle = load_bundle(app_dir)
+    if bundle:
+        logger.debug("Use the bundle %s" % bundle.bundle_dir)
+
+        def render(template_file, data):
+            return bundle.render(template_file, data)
+    else:
+        def render(template_file, data):
+            return render_app(app_dir, template_file, data)
+
+    # Render all samples before submitting anything.
+    rendered_samples = []
+    json_errors = OrderedDict()
+    audit_writer = ThreadPoolExecutor(max_workers=4)
+    audit_futures = []
     for sample in samples_data:
         if 'sample_id' not in sample.keys():
             raise Exception("Your samples file must contain sample_id column.")
         else:
-            # 用户可通过samples文件覆写default文件中已定义的变量
-            # 只有samples文件中缺少的变量才从default文件中取值
-            app_default_var = AppDefaultVar(app_dir)
-            all_default_value = app_default_var.show_default_value()
-
             for key in all_default_value.keys():
                 if key not in sample.keys():
                     sample[key] = all_default_value.get(key)
@@ -55,50 +128,110 @@ def run_batch(project_name, app_dir, samples, label, server='localhost',
             sample['project_name'] = project_name
 
             # inputs
-            inputs = render_app(app_dir, 'inputs', sample)
-            check_json(string=inputs)  # Json Syntax Checker
-            write(sample_path, 'inputs', inputs)
-            inputs_path = os.path.join(sample_path, 'inputs')
+            inputs = render('inputs', sample)
+            # Json Syntax Checker, errors of all samples are reported together.
+            inputs_dict, json_error = load_json(string=inputs, source=sample.get('sample_id'))
+            if json_error:
+                json_errors[sample.get('sample_id')] = [str(json_error)]
 
             # workflow.wdl
-            wdl = render_app(app_dir, 'workflow.wdl', sample)
-            write(sample_path, 'workflow.wdl', wdl)
+            wdl = render('workflow.wdl', sample)
             wdl_path = os.path.join(sample_path, 'workflow.wdl')
 
-            # defaults
+            # Workflows are submitted from memory, the files in sample directory
+            # are only an audit copy, so they are written in background.
             src_defaults_file = os.path.join(app_dir, 'defaults')
             dest_defaults_file = os.path.join(sample_path, 'defaults')
-            copy_and_overwrite(src_defaults_file, dest_defaults_file, is_file=True)
-
             src_dependencies = os.path.join(app_dir, 'tasks')
             dest_dependencies = os.path.join(sample_path, 'tasks')
-            copy_and_overwrite(src_dependencies, dest_dependencies)
-
-            if label is None:
-                label = []
+            audit_futures.extend([
+                audit_writer.submit(write, sample_path, 'inputs', inputs),
+                audit_writer.submit(write, sample_path, 'workflow.wdl', wdl),
+                audit_writer.submit(copy_and_overwrite, src_defaults_file,
+                                    dest_defaults_file, is_file=True),
+                audit_writer.submit(copy_and_overwrite, src_dependencies, dest_dependencies)
+            ])
 
             is_valid_label(sample["sample_id"])
-            label.append("sample-id:%s" % sample["sample_id"].lower())
-
-            if not dry_run:
-                try:
-                    dep_path = os.path.join(app_dir, 'tasks')
-                    dep_zip_file = generate_dependencies_zip(dep_path)
-                    result = submit_workflow(wdl_path, inputs_path,
-                                             dep_zip_file,
-                                             label, username=username,
-                                             server=server)
-
-                    sample['workflow_id'] = result['id']
+            sample_label = label + ["sample-id:%s" % sample["sample_id"].lower()]
+
+            rendered_samples.append({
+                'sample': sample,
+                'inputs': inputs_dict,
+                'wdl': wdl,
+                'wdl_path': wdl_path,
+                'label': sample_label
+            })
+
+    if json_errors or validate:
+        # The rendered files are needed by the report and the validation.
+        wait_futures(audit_futures)
+
+    if json_errors:
+        report_path = os.path.join(project_path, 'validation_errors.txt')
+        write_validation_report(report_path, json_errors)
+        logger.critical("Inputs of %s samples are invalid JSON, nothing is submitted. See %s" %
+                        (len(json_errors), report_path))
+        sys.exit(exit_code.JSON_NOT_VALID)
+
+    if validate:
+        errors = validate_samples(rendered_samples, bundle=bundle)
+        if errors:
+            report_path = os.path.join(project_path, 'validation_errors.txt')
+            write_validation_report(report_path, errors)
+            logger.critical("%s of %s samples are invalid, nothing is submitted. See %s" %
+                            (len(errors), len(rendered_samples), report_path))
+            sys.exit(exit_code.VALIDATE_ERROR)
+        logger.info("All %s samples are valid." % len(rendered_samples))
+
+    # All samples share the same tasks, the zip is built only once.
+    dep_path = os.path.join(app_dir, 'tasks')
+    if dry_run or not os.path.isdir(dep_path):
+        dep_zip = None
+    elif bundle:
+        dep_zip = bundle.dependencies_zip()
+    else:
+        dep_zip = build_dependencies_zip(dep_path)
+
+    # Samples are spread across all servers by their running and queued workflows.
+    router = None
+    if server == ALL_SERVERS and not dry_run:
+        try:
+            router = Router.from_servers(resolve_servers(server))
+        except ValueError as err:
+            logger.critical(str(err))
+            sys.exit(exit_code.GENERAL_ERROR)
+
+    for rendered in rendered_samples:
+        sample = rendered['sample']
+        if not dry_run:
+            sample_server = router.next() if router else server
+            try:
+                result = submit_workflow(rendered['wdl'], rendered['inputs'],
+                                         dep_zip,
+                                         rendered['label'], username=username,
+                                         server=sample_server, wdl_string=True)
+
+                sample['workflow_id'] = result['id']
+                if router:
+                    sample['server'] = sample_server
+                    logger.info("Sample ID: %s, Workflow ID: %s, Server: %s" %
+                                (sample.get('sample_id'), result['id'], sample_server))
+                else:
                     logger.info("Sample ID: %s, Workflow ID: %s" %
                                 (sample.get('sample_id'), result['id']))
-                except Exception as e:
-                    logger.error("Sample ID: %s, %s" %
-                                 (sample.get('sample_id'), str(e)))
-                    failed_samples.append(sample)
-                    continue
+            except Exception as e:
+                if router:
+                    router.release(sample_server)
+                logger.error("Sample ID: %s, %s" %
+                             (sample.get('sample_id'), str(e)))
+                failed_samples.append(sample)
+                continue
 
-            successed_samples.append(sample)
+        successed_samples.append(sample)
+
+    wait_futures(audit_futures)
+    audit_writer.shutdown()
 
     submitted_file_path = os.path.join(project_path, 'submitted.csv')
     failed_file_path = os.path.join(project_path, 'failed.csv')
@@ -139,3 +272,182 @@ def run_batch(project_name, app_dir, samples, label, server='localhost',
         "successed": successed_samples,
         "failed": failed_samples
     }
+
+
+def query_project_workflows(project_name, servers):
+    """Get the workflows of a project by one paged query for each server.
+
+    :return: a dict, {workflow_id: query result with labels and its server}.
+    """
+    def query(server):
+        return {'results': get_cromwell(server).query_pages({
+            'name': project_name, 'additionalQueryResultFields': ['labels']})}
+
+    responses, _ = fan_out(query, servers)
+    return dict((result['id'], result) for result in merge_query_results(responses)['results']
+                if not result.get('parentWorkflowId'))
+
+
+def write_submitted(submitted_file_path, fieldnames, rows):
+    tmp_path = '%s.%s.tmp' % (submitted_file_path, os.getpid())
+    with open(tmp_path, 'wt') as f:
+        dict_writer = csv.DictWriter(f, fieldnames)
+        dict_writer.writeheader()
+        dict_writer.writerows(rows)
+    os.replace(tmp_path, submitted_file_path)
+
+
+def rerun_project(project_name, server='localhost', username=None, jobs=8, dry_run=False):
+    """Submit the failed and aborted workflows of a project again.
+
+    The rendered files in the project are submitted with call caching enabled,
+    so only the calls that didn't succeed are run again. submitted.csv is
+    updated with the new workflow ids, the old ones are kept in previous_workflow_id.
+
+    :param server: the server of samples without a server column, all means all servers.
+    :param jobs: the number of workflows that are submitted at the same time.
+    :return: a dict, {'rerun': [...], 'failed': [...]}, samples of submitted.csv.
+    """
+    project_path = os.path.join(os.getcwd(), project_name)
+    submitted_file_path = os.path.join(project_path, 'submitted.csv')
+    if not os.path.isfile(submitted_file_path):
+        logger.critical("No submitted.csv in %s." % project_path)
+        sys.exit(exit_code.GENERAL_ERROR)
+
+    with open(submitted_file_path, 'rt') as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames)
+        all_rows = list(reader)
+    rows = [row for row in all_rows if row.get('workflow_id')]
+
+    def get_server(row):
+        return row.get('server') or server
+
+    servers = set(resolve_servers(server)) if any(not row.get('server') for row in rows) else set()
+    servers.update(row['server'] for row in rows if row.get('server'))
+    workflows = query_project_workflows(project_name, [name for name in resolve_servers(ALL_SERVERS)
+                                                       if name in servers])
+
+    config = get_global_config()
+
+    # Workflows of another name, e.g. renamed by the app, are looked up one by one.
+    def query_status(row):
+        set_global_config(config)
+        row_server = get_server(row)
+        if row_server == ALL_SERVERS:
+            row_server = find_workflow_server(row['workflow_id'])
+            if row_server is None:
+                return None
+        status = get_cromwell(row_server).query_status(row['workflow_id'])
+        return dict(status, server=row_server) if status.get('id') else None
+
+    missing = [row for row in rows if row['workflow_id'] not in workflows]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for row, status in zip(missing, executor.map(query_status, missing)):
+            if status is None:
+                logger.warning("Sample ID: %s, workflow %s is not found, it's skipped." %
+                               (row.get('sample_id'), row['workflow_id']))
+            else:
+                workflows[row['workflow_id']] = status
+
+    def get_labels(row):
+        workflow = workflows[row['workflow_id']]
+        if 'labels' not in workflow:
+            # Found by query_status, it has no labels.
+            response = get_cromwell(workflow['server']).get('labels', row['workflow_id'])
+            workflow['labels'] = response.get('labels') or {}
+        return workflow['labels']
+
+    failed_rows = [row for row in rows
+                   if workflows.get(row['workflow_id'], {}).get('status') in RERUN_STATES]
+    # A workflow labeled restarted-as is submitted again by a rerun that stopped
+    # before submitted.csv was saved, it's not submitted twice.
+    restarted_rows = [row for row in failed_rows if get_labels(row).get(RESTARTED_LABEL)]
+    rerun_rows = [row for row in failed_rows if row not in restarted_rows]
+    for row in restarted_rows:
+        logger.info("Sample ID: %s, Workflow ID: %s, already restarted as %s" %
+                    (row.get('sample_id'), row['workflow_id'], get_labels(row)[RESTARTED_LABEL]))
+    logger.info("%s of %s samples will be rerun." % (len(rerun_rows), len(rows)))
+    if dry_run:
+        for row in rerun_rows:
+            logger.info("Sample ID: %s, Workflow ID: %s, %s" %
+                        (row.get('sample_id'), row['workflow_id'],
+                         workflows[row['workflow_id']]['status']))
+        return {"rerun": [], "failed": []}
+
+    # Samples share the tasks of the app, the zip is built only once.
+    tasks_dir = next((path for path in (os.path.join(project_path, row['sample_id'], 'tasks')
+                                        for row in rerun_rows) if os.path.isdir(path)), None)
+    dep_zip = build_dependencies_zip(tasks_dir) if tasks_dir else None
+
+    lock = threading.Lock()
+    progress = {'finished': 0}
+
+    def resubmit(row):
+        set_global_config(config)
+        old_workflow = workflows[row['workflow_id']]
+        sample_path = os.path.join(project_path, row['sample_id'])
+        try:
+            with open(os.path.join(sample_path, 'workflow.wdl'), 'rt') as f:
+                wdl = f.read()
+            with open(os.path.join(sample_path, 'inputs'), 'rt') as f:
+                inputs = json.load(f)
+
+            cromwell = get_cromwell(old_workflow['server'])
+            if old_workflow.get('labels'):
+                labels = cromwell.process_metadata_label(old_workflow, username=username)
+            else:
+                labels = {'username': username or global_config.getuser(),
+                          'sample-id': row['sample_id'].lower()}
+            result = cromwell.jstart_workflow(wdl, inputs, dependencies=dep_zip, wdl_string=True,
+                                              extra_options=dict(CALL_CACHING_OPTIONS),
+                                              custom_labels=labels)
+            message = None
+        except SystemExit:
+            result, message = None, 'Unable to submit to %s' % old_workflow['server']
+        except Exception as err:
+            result, message = None, str(err)
+
+        if result and result.get('id'):
+            try:
+                cromwell.label_workflow(row['workflow_id'], {RESTARTED_LABEL: result['id']})
+            except Exception as err:
+                logger.debug("Can't label %s: %s" % (row['workflow_id'], err))
+
+        with lock:
+            progress['finished'] += 1
+            if result and result.get('id'):
+                logger.info("[%s/%s] Sample ID: %s, Workflow ID: %s" %
+                            (progress['finished'], len(rerun_rows), row['sample_id'], result['id']))
+            else:
+                logger.error("[%s/%s] Sample ID: %s, %s" %
+                             (progress['finished'], len(rerun_rows), row['sample_id'],
+                              message or result))
+        return result.get('id') if result else None
+
+    rerun_samples = []
+    failed_samples = []
+    for row in restarted_rows:
+        row['previous_workflow_id'] = row['workflow_id']
+        row['workflow_id'] = get_labels(row)[RESTARTED_LABEL]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for row, workflow_id in zip(rerun_rows, executor.map(resubmit, rerun_rows)):
+            if workflow_id:
+                row['previous_workflow_id'] = row['workflow_id']
+                row['workflow_id'] = workflow_id
+                rerun_samples.append(row)
+            else:
+                failed_samples.append(row)
+
+    if rerun_samples or restarted_rows:
+        if 'previous_workflow_id' not in fieldnames:
+            fieldnames.append('previous_workflow_id')
+        write_submitted(submitted_file_path, fieldnames, all_rows)
+        logger.info("Rerun: %s, %s" % (len(rerun_samples), submitted_file_path))
+    if failed_samples:
+        logger.error("Failed: %s" % len(failed_samples))
+
+    return {
+        "rerun": rerun_samples,
+        "failed": failed_samples
+    }
@@ -82,3 +82,15 @@ class NoSuchSchema(Exception):
 
 class NoProperConfig(Exception):
     pass
+
+
+class WomtoolError(Exception):
+    pass
+
+
+class WdlParseError(Exception):
+    pass
+
+
+class ChecksumError(Exception):
+    pass
@@ -10,4 +10,6 @@
 """
 
 from .email_notification import EmailNotification
+from .digest_notification import DigestNotification
 from .messenger import Messenger
+from .dispatcher import NotificationDispatcher
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.notification.attachments
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Module to generate size-capped email attachments from workflow logs.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import io
+import time
+import zlib
+import logging
+import zipfile
+from email import encoders
+from email.mime.base import MIMEBase
+from choppy.config import get_global_config
+from choppy.utils import read_tail
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+# Only the last attachment_tail_kb of each log file will be attached,
+# and the whole zip file will be no more than attachment_max_kb.
+DEFAULT_TAIL_KB = 64
+DEFAULT_MAX_KB = 5 * 1024
+# Bytes of a zip file besides compressed data: a local file header and a central
+# directory header (both with the file name) for each file, and the end record.
+ZIP_ENTRY_OVERHEAD = 30 + 46
+ZIP_END_OVERHEAD = 22
+
+
+def get_entry_size(name, data):
+    """The exact number of bytes that a file takes in a deflated zip file."""
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_size = len(compressor.compress(data)) + len(compressor.flush())
+    return ZIP_ENTRY_OVERHEAD + 2 * len(name.encode('utf-8')) + compressed_size
+
+
+def get_attachment_limits():
+    """Get (tail_bytes, max_bytes) from the email section of config file."""
+    def get_kb(attr_name, default):
+        try:
+            value = global_config.get('email', attr_name)
+            return int(value) if value else default
+        except Exception:
+            return default
+
+    return (get_kb('attachment_tail_kb', DEFAULT_TAIL_KB) * 1024,
+            get_kb('attachment_max_kb', DEFAULT_MAX_KB) * 1024)
+
+
+def generate_logs_archive(file_dict, data_dict=None, archive_name='workflow_logs.zip',
+                          tail_bytes=None, max_bytes=None):
+    """Pack the tail of several files into a single zip attachment.
+
+    :param file_dict: A dictionary of filename:filepath pairs.
+    :param data_dict: A dictionary of filename:bytes pairs, e.g. metadata.
+    :param archive_name: The name of the zip attachment.
+    :param tail_bytes: The maximum bytes of each file to be packed.
+    :param max_bytes: The maximum (compressed) size of the zip attachment.
+    :return: An attachment object.
+    """
+    default_tail_bytes, default_max_bytes = get_attachment_limits()
+    tail_bytes = tail_bytes or default_tail_bytes
+    max_bytes = max_bytes or default_max_bytes
+
+    def iter_entries():
+        for name, data in (data_dict or {}).items():
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            # Data in memory is only limited by the size of the attachment.
+            truncated = len(data) > max_bytes
+            yield name, data[-max_bytes:] if truncated else data, truncated
+
+        for name, path in file_dict.items():
+            try:
+                data, truncated = read_tail(path, tail_bytes)
+                yield name, data, truncated
+            except (IOError, OSError) as e:
+                logger.warning('Unable to generate attachment for {}:\n{}'.format(name, e))
+
+    buf = io.BytesIO()
+    skipped = []
+    truncated_files = []
+    date_time = time.localtime(time.time())[:6]
+    # The size is counted exactly, so the attachment is never larger than max_bytes.
+    zip_size = ZIP_END_OVERHEAD
+    with zipfile.ZipFile(buf, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data, truncated in iter_entries():
+            entry_size = get_entry_size(name, data)
+            if zip_size + entry_size > max_bytes:
+                skipped.append(name)
+                continue
+
+            zf.writestr(zipfile.ZipInfo(name, date_time=date_time), data,
+                        compress_type=zipfile.ZIP_DEFLATED)
+            zip_size += entry_size
+            if truncated:
+                truncated_files.append(name)
+
+        if skipped or truncated_files:
+            notes = ['Only the tail of these files are attached:']
+            notes.extend(truncated_files)
+            if skipped:
+                notes.append('These files are skipped, the attachment is limited to %s bytes:'
+                             % max_bytes)
+                notes.extend(skipped)
+            readme = '\n'.join(notes).encode('utf-8')
+            if zip_size + get_entry_size('README.txt', readme) <= max_bytes:
+                zf.writestr(zipfile.ZipInfo('README.txt', date_time=date_time), readme,
+                            compress_type=zipfile.ZIP_DEFLATED)
+
+    attachment = MIMEBase('application', 'zip')
+    attachment.set_payload(buf.getvalue())
+    encoders.encode_base64(attachment)
+    attachment.add_header('Content-Disposition', 'attachment', filename=archive_name)
+    return attachment
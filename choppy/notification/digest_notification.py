@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.notification.digest_notification
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Module to batch many workflow transitions into one email.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import html
+import time
+import logging
+import threading
+from collections import OrderedDict
+from choppy.config import get_global_config
+from choppy.core.cromwell import Cromwell
+from .messenger import Messenger
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+# Only a short excerpt of each failed shard's stderr is included.
+EXCERPT_BYTES = 2 * 1024
+
+
+def get_digest_window():
+    """Get digest window (seconds) from the email section, 0 means digest mode is disabled."""
+    try:
+        return int(global_config.get('email', 'digest_window') or 0)
+    except ValueError:
+        logger.warning('digest_window in email section of config file must be integer.')
+        return 0
+
+
+class DigestNotification(object):
+    """Group terminal workflows per user and project, and send one summary
+    email for each group when the digest window is elapsed.
+    """
+
+    def __init__(self, cromwell, dispatcher=None, window=None):
+        self.messenger = Messenger("", dispatcher=dispatcher)
+        self.window = window if window is not None else get_digest_window()
+        self.groups = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_project(metadata):
+        labels = metadata.get('labels') or {}
+        return labels.get('project') or labels.get('project-name') or \
+            metadata.get('workflowName') or 'unknown'
+
+    @staticmethod
+    def summarize(metadata, host, port):
+        """Keep what is needed by the summary table, not the whole metadata."""
+        labels = metadata.get('labels') or {}
+        entry = {
+            'id': metadata['id'],
+            'sample_id': labels.get('sample-id', ''),
+            'status': metadata['status'],
+            'start': metadata.get('start', ''),
+            'end': metadata.get('end', ''),
+            'metadata_link': 'http://{}:{}/api/workflows/v1/{}/metadata'.format(host, port, metadata['id']),
+            'timing_link': 'http://{}:{}/api/workflows/v2/{}/timing'.format(host, port, metadata['id']),
+            'excerpts': []
+        }
+
+        if metadata['status'] == 'Failed' and metadata.get('calls'):
+            failed_jobs = Cromwell.getCalls('Failed', metadata['calls'], full_logs=True,
+                                            max_log_bytes=EXCERPT_BYTES)
+            for log in failed_jobs:
+                stderr = log.get('stderr')
+                if isinstance(stderr, dict):
+                    entry['excerpts'].append((stderr['label'], str(stderr.get('log', ''))))
+        return entry
+
+    def on_changed_workflow_status(self, workflow, metadata, host, port):
+        if workflow.status not in ("Aborted", "Failed", "Succeeded") or \
+                workflow.person_id in ("", None):
+            return
+
+        sender_user = global_config.get('email', 'sender_user')
+        user = sender_user if sender_user else workflow.person_id
+        key = (user, self.get_project(metadata))
+        entry = self.summarize(metadata, host, port)
+        with self.lock:
+            group = self.groups.setdefault(key, {'first_time': time.time(), 'entries': []})
+            group['entries'].append(entry)
+
+    def flush(self, force=False):
+        """Send digest emails for the groups that are older than the window.
+
+        :param force: send all groups immediately.
+        :return: the number of emails.
+        """
+        now = time.time()
+        with self.lock:
+            keys = [key for key, group in self.groups.items()
+                    if force or now - group['first_time'] >= self.window]
+            groups = [(key, self.groups.pop(key)) for key in keys]
+
+        for (user, project), group in groups:
+            content = self.generate_content(user, project, group['entries'])
+            msg = self.messenger.compose_email(content, template_name='digest_email.template')
+            email_domain = global_config.get('email', 'email_domain')
+            logger.info("Digest e-mail notification for %s workflows to %s" %
+                        (len(group['entries']), user))
+            self.messenger.send_email(msg, user + "@{}".format(email_domain))
+        return len(groups)
+
+    def generate_content(self, user, project, entries):
+        """A method for generating the digest email content.
+
+        :return: a dictionary containing the email contents for the digest template.
+        """
+        status_count = OrderedDict()
+        for entry in entries:
+            status_count[entry['status']] = status_count.get(entry['status'], 0) + 1
+        status_summary = ', '.join('%s %s' % (count, status) for status, count in status_count.items())
+
+        rows = ['<tr><th>Sample ID</th><th>Workflow ID</th><th>Status</th>'
+                '<th>Started</th><th>Ended</th><th>Links</th></tr>']
+        for entry in entries:
+            rows.append('<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td>'
+                        '<td><a href="{}">metadata</a> <a href="{}">timing</a></td></tr>'
+                        .format(html.escape(entry['sample_id']), entry['id'], entry['status'],
+                                entry['start'], entry['end'], entry['metadata_link'],
+                                entry['timing_link']))
+        table = '<table border="1" cellspacing="0" cellpadding="4">%s</table>' % ''.join(rows)
+
+        failures = []
+        for entry in entries:
+            for label, excerpt in entry['excerpts']:
+                failures.append('<b>{} ({})</b><pre>{}</pre>'.format(
+                    html.escape(label), entry['id'], html.escape(excerpt)))
+
+        return {
+            'subject': 'Project ({}) {} workflows finished: {}'.format(
+                project, len(entries), status_summary),
+            'user': user,
+            'project': html.escape(project),
+            'count': len(entries),
+            'window': '%s seconds' % self.window,
+            'status_summary': status_summary,
+            'table': table,
+            'failures': '<br><b>Failed shards:</b><br>%s' % ''.join(failures) if failures else ''
+        }
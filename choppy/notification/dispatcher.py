@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+    choppy.notification.dispatcher
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A background dispatcher that sends emails with a reused SMTP connection.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+
+from __future__ import unicode_literals
+import os
+import json
+import time
+import uuid
+import queue
+import smtplib
+import logging
+import itertools
+import threading
+from choppy.config import get_global_config
+
+global_config = get_global_config()
+logger = logging.getLogger(__name__)
+
+
+def get_smtp_settings():
+    """Get smtp settings from the email section of config file.
+
+    :return: A dict, {'host', 'port', 'ssl', 'user', 'password'}
+    """
+    def get(attr_name, default=None):
+        value = global_config.get('email', attr_name)
+        return value if value not in (None, '') else default
+
+    return {
+        'host': get('email_smtp_server'),
+        'port': int(get('email_smtp_port', 0)),
+        'ssl': str(get('email_smtp_ssl', True)).upper() in ('T', 'TRUE'),
+        'user': get('sender_user'),
+        'password': get('sender_password')
+    }
+
+
+def connect_smtp(settings):
+    """Make a logged-in smtp connection.
+
+    :param settings: the dict returned by get_smtp_settings.
+    :return: smtplib.SMTP or smtplib.SMTP_SSL object.
+    """
+    smtp_class = smtplib.SMTP_SSL if settings['ssl'] else smtplib.SMTP
+    mailer = smtp_class(settings['host'], settings['port'])
+    if settings['user'] and settings['password']:
+        mailer.login(settings['user'], settings['password'])
+    return mailer
+
+
+class Job(object):
+    def __init__(self, from_addr, to_addr, message, attempts=0, job_id=None):
+        self.id = job_id or '%s-%s' % (int(time.time() * 1000), uuid.uuid4().hex)
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+        self.message = message
+        self.attempts = attempts
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'from_addr': self.from_addr,
+            'to_addr': self.to_addr,
+            'message': self.message,
+            'attempts': self.attempts
+        }
+
+
+class NotificationDispatcher(object):
+    """Send emails in a worker thread, so that a slow smtp server never blocks the caller.
+
+    Every message is spooled to disk before it is queued, so pending messages
+    are recovered when the dispatcher is restarted. The worker reuses one
+    logged-in smtp connection, reconnects on failure and retries with
+    exponential backoff.
+    """
+
+    def __init__(self, spool_dir=None, max_retries=5, backoff_factor=2,
+                 max_backoff=300, idle_timeout=60, smtp_settings=None):
+        if spool_dir is None:
+            spool_dir = os.path.join(global_config.get_path('general', 'log_dir'),
+                                     'mail_spool')
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, 'failed')
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.smtp_settings = smtp_settings
+        self.logger = logging.getLogger('choppy.notification.NotificationDispatcher')
+
+        self.queue = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.connection = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.pending = 0
+        self.pending_cond = threading.Condition()
+
+    def start(self):
+        """Recover spooled messages and start the worker thread."""
+        if self.thread is not None and self.thread.is_alive():
+            return self
+
+        self.stopped.clear()
+        for job in self._load_spool():
+            self._put(job)
+
+        self.thread = threading.Thread(target=self._run, name='choppy-mail-dispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the worker thread, unsent messages are kept in the spool."""
+        self.stopped.set()
+        self.queue.put((0, -1, None))
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self._close()
+
+    def submit(self, msg, to_addr, from_addr):
+        """Queue a message, it never blocks on the smtp server.
+
+        :param msg: A MIMEMultipart message object.
+        :param to_addr: The recipient.
+        :param from_addr: The sender.
+        :return: job id.
+        """
+        job = Job(from_addr, to_addr, msg.as_string())
+        self._save_job(job)
+        self._put(job)
+        return job.id
+
+    def join(self, timeout=None):
+        """Wait until all queued messages are sent or given up.
+
+        :return: True if nothing is pending.
+        """
+        with self.pending_cond:
+            return self.pending_cond.wait_for(lambda: self.pending == 0, timeout)
+
+    def _put(self, job, due=0):
+        with self.pending_cond:
+            self.pending += 1
+        self.queue.put((due, next(self.counter), job))
+
+    def _done(self):
+        with self.pending_cond:
+            self.pending -= 1
+            self.pending_cond.notify_all()
+
+    def _job_path(self, job, failed=False):
+        return os.path.join(self.failed_dir if failed else self.spool_dir,
+                            '%s.json' % job.id)
+
+    def _save_job(self, job):
+        tmp_file = self._job_path(job) + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_file, self._job_path(job))
+
+    def _load_spool(self):
+        jobs = []
+        for filename in sorted(os.listdir(self.spool_dir)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, filename), 'r') as f:
+                    job_dict = json.load(f)
+                jobs.append(Job(job_dict['from_addr'], job_dict['to_addr'],
+                                job_dict['message'], attempts=job_dict['attempts'],
+                                job_id=job_dict['id']))
+            except (ValueError, KeyError, IOError) as err:
+                self.logger.warning('Skip broken spool file %s: %s' % (filename, err))
+        if jobs:
+            self.logger.info('Recover %s messages from %s' % (len(jobs), self.spool_dir))
+        return jobs
+
+    def _connect(self):
+        if self.connection is None:
+            settings = self.smtp_settings or get_smtp_settings()
+            self.connection = connect_smtp(settings)
+        return self.connection
+
+    def _close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except Exception:
+                pass
+            self.connection = None
+
+    def _send(self, job):
+        try:
+            self._connect().sendmail(job.from_addr, job.to_addr, job.message)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+            # The connection may be closed by the server, reconnect once.
+            self._close()
+            self._connect().sendmail(job.from_addr, job.to_addr, job.message)
+
+    def _handle(self, job):
+        try:
+            self._send(job)
+            os.remove(self._job_path(job))
+            self.logger.info("Send email to %s successfully." % job.to_addr)
+            self._done()
+        except Exception as err:
+            self._close()
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                os.replace(self._job_path(job), self._job_path(job, failed=True))
+                self.logger.warning("Can't send email to %s, give up after %s retries: %s"
+                                    % (job.to_addr, self.max_retries, err))
+                self._done()
+            else:
+                delay = min(self.backoff_factor * (2 ** (job.attempts - 1)), self.max_backoff)
+                self._save_job(job)
+                self.logger.warning("Can't send email to %s, retry in %s seconds: %s"
+                                    % (job.to_addr, delay, err))
+                self.queue.put((time.time() + delay, next(self.counter), job))
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                due, _, job = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Don't keep an idle connection, the server will close it anyway.
+                self._close()
+                continue
+
+            if job is None:
+                break
+
+            wait = due - time.time()
+            if wait > 0:
+                # Not yet, put it back and wait for the next due or a new message.
+                self.queue.put((due, next(self.counter), job))
+                self.stopped.wait(min(wait, 1))
+                continue
+
+            self._handle(job)
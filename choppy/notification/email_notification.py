@@ -15,18 +15,18 @@ import logging
 import datetime
 import calendar
 from dateutil.parser import parse
-from email.mime.text import MIMEText
 from choppy.config import get_global_config
 from choppy.core.cromwell import Cromwell
 from .messenger import Messenger
+from .attachments import generate_logs_archive
 
 global_config = get_global_config()
 
 
 class EmailNotification(object):
 
-    def __init__(self, cromwell):
-        self.messenger = Messenger("")
+    def __init__(self, cromwell, dispatcher=None):
+        self.messenger = Messenger("", dispatcher=dispatcher)
 
     def on_changed_workflow_status(self, workflow, metadata, host, port):
         if (workflow.status == "Aborted" or workflow.status == "Failed" or workflow.status == "Succeeded") and \
@@ -47,25 +47,18 @@ class EmailNotification(object):
 
     @staticmethod
     def attach_logs(msg, metadata):
-        failed_jobs = Cromwell.getCalls(
-            'Failed', metadata['calls'], full_logs=True)
+        """Attach the tail of failed jobs' logs and the metadata as a zip file."""
+        failed_jobs = Cromwell.getCalls('Failed', metadata['calls'])
 
+        file_dict = {}
         for log in failed_jobs:
-            stdout_attachment = MIMEText(str(log["stdout"]['log']))
-            stdout_attachment.add_header(
-                'Content-Disposition', 'attachment', filename=log["stdout"]["label"])
-            msg.attach(stdout_attachment)
-
-            stderr_attachment = MIMEText(str(log["stderr"]['log']))
-            stderr_attachment.add_header(
-                'Content-Disposition', 'attachment', filename=log["stderr"]["label"])
-            msg.attach(stderr_attachment)
-
-        metadata_attachment = MIMEText(
-            str(json.dumps(metadata, indent=4, default=EmailNotification.json_serializer)))
-        metadata_attachment.add_header(
-            'Content-Disposition', 'attachment', filename=metadata["id"] + ".metadata")
-        msg.attach(metadata_attachment)
+            for key in ('stdout', 'stderr'):
+                if isinstance(log.get(key), dict):
+                    file_dict[log[key]['label']] = log[key]['name']
+
+        metadata_str = json.dumps(metadata, indent=4, default=EmailNotification.json_serializer)
+        data_dict = {metadata["id"] + ".metadata": metadata_str}
+        msg.attach(generate_logs_archive(file_dict, data_dict=data_dict))
 
     @staticmethod
     def json_serializer(obj):
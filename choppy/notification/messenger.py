@@ -10,7 +10,6 @@
 """
 
 from __future__ import unicode_literals
-import smtplib
 import os
 import logging
 from email.mime.text import MIMEText
@@ -18,46 +17,49 @@ from string import Template
 from email.mime.multipart import MIMEMultipart
 from email.utils import formatdate
 from choppy.config import get_global_config
-from ratelimit import rate_limited
+from choppy.core.throttle import get_limiter
+from .dispatcher import connect_smtp, get_smtp_settings
 
 __author__ = "Amr Abouelleil"
 
 global_config = get_global_config()
 logger = logging.getLogger(__name__)
-ONE_MINUTE = 60
+# Emails per minute to a smtp server.
+SMTP_RATE_LIMIT = 300
 
 
 class Messenger(object):
     """A class for generating and sending messages with workflow results to users.
     """
 
-    def __init__(self, user):
+    def __init__(self, user, dispatcher=None):
         email_domain = global_config.get('email', 'email_domain')
         sender_user = global_config.get('email', 'sender_user')
         self.user_email = "{}@{}".format(user, email_domain)
         self.sender = "{}@{}".format(sender_user, email_domain)
+        self.dispatcher = dispatcher
 
-    def compose_email(self, content_dict):
+    def compose_email(self, content_dict, template_name='email.template'):
         """Composes an e-mail to be sent containing workflow ID, result of the workflow, and workflow metadata. # noqa
 
-        :param content_dict: A dictionary of key/value pairs that fulfill the requirements of email.template. The keys are: workflow_id, user, status, and metadata.
+        :param content_dict: A dictionary of key/value pairs that fulfill the requirements of email.template. The keys are: workflow_id, user, status, and metadata. An optional subject key overrides the default subject.
+        :param template_name: The name of template file in the resources directory.
         :return: A MIMEMultipart message object.
         """
-        subject = "Workflow ({}) {}".format(
+        subject = content_dict.get('subject') or "Workflow ({}) {}".format(
             content_dict['workflow_id'], content_dict['status'])
         msg = MIMEMultipart(From=self.sender, To=self.user_email, Date=formatdate(localtime=True),
                             Subject=subject)
         msg["Subject"] = subject
-        template = open(os.path.join(global_config.resource_dir, 'email.template'), 'r')
+        template = open(os.path.join(global_config.resource_dir, template_name), 'r')
         src = Template(template.read())
         text = src.safe_substitute(content_dict)
         msg.attach(MIMEText(text, 'html'))
         template.close()
         return msg
 
-    @rate_limited(300, ONE_MINUTE)
     def send_email(self, msg, user=None):
-        """Sends an e-mail to recipients using the localhosts smtp server.
+        """Sends an e-mail to recipients. The message will be queued when a dispatcher is set, otherwise it will be sent by a new smtp connection.
 
         :param msg: A MIMEMultipart message object.
         :return: None
@@ -65,13 +67,20 @@ class Messenger(object):
         if not user:
             user = self.user_email
 
+        if self.dispatcher is not None:
+            self.dispatcher.submit(msg, user, self.sender)
+            logger.info("Queue email to %s." % user)
+        else:
+            self._send_email(msg, user)
+
+    def _send_email(self, msg, user):
         try:
-            email_smtp_server = global_config.get('email', 'email_smtp_server')
-            sender_password = global_config.get('email', 'sender_password')
-            sender_user = global_config.get('email', 'sender_user')
-            mailer = smtplib.SMTP_SSL(email_smtp_server)
-            mailer.login(sender_user, sender_password)
+            settings = get_smtp_settings()
+            # Only the calling thread waits, emails to other smtp servers are not delayed.
+            get_limiter(settings['host'], 'smtp', SMTP_RATE_LIMIT).acquire()
+            mailer = connect_smtp(settings)
             mailer.sendmail(self.sender, user, msg.as_string())
+            mailer.quit()
             logger.info("Send email to %s successfully." % user)
         except Exception as e:
             logger.warn("Can't send email to %s" % user)
@@ -0,0 +1,100 @@
+/*
+ * A long-lived womtool worker used by choppy.core.womtool.
+ *
+ * Run it with java 11+ in single-file source mode:
+ *     java -cp womtool.jar WomtoolWorker.java
+ *
+ * Protocol (stdin/stdout):
+ *     worker -> client: "READY\n" once womtool is loaded.
+ *     client -> worker: womtool arguments separated by tab, ended with "\n".
+ *     worker -> client: "<return code> <length>\n" and <length> bytes (UTF-8) of output.
+ *
+ * Anything printed by womtool itself goes to stderr, so it never breaks the protocol.
+ */
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+
+public class WomtoolWorker {
+    private static Object womtool;
+    private static Method runWomtool;
+    private static Object predef;
+    private static Method wrapRefArray;
+
+    private static void load() throws Exception {
+        Class<?> mainClass = Class.forName("womtool.WomtoolMain$");
+        womtool = mainClass.getField("MODULE$").get(null);
+        for (Method method : mainClass.getMethods()) {
+            if (method.getName().equals("runWomtool") && method.getParameterCount() == 1) {
+                runWomtool = method;
+            }
+        }
+        if (runWomtool == null) {
+            throw new NoSuchMethodException("womtool.WomtoolMain.runWomtool");
+        }
+
+        Class<?> predefClass = Class.forName("scala.Predef$");
+        predef = predefClass.getField("MODULE$").get(null);
+        wrapRefArray = predefClass.getMethod("wrapRefArray", Object[].class);
+    }
+
+    private static Object call(Object obj, String name) throws Exception {
+        return obj.getClass().getMethod(name).invoke(obj);
+    }
+
+    private static String getOutput(Object termination) throws Exception {
+        try {
+            // Old womtool: Termination.output
+            return String.valueOf(call(termination, "output"));
+        } catch (NoSuchMethodException e) {
+            // New womtool: Termination.stdout and Termination.stderr are options.
+            StringBuilder output = new StringBuilder();
+            for (String name : new String[] {"stdout", "stderr"}) {
+                Object option = call(termination, name);
+                if ((Boolean) call(option, "isDefined")) {
+                    output.append(call(option, "get"));
+                }
+            }
+            return output.toString();
+        }
+    }
+
+    private static void respond(OutputStream out, int returnCode, String output) throws Exception {
+        byte[] data = output.getBytes(StandardCharsets.UTF_8);
+        out.write((returnCode + " " + data.length + "\n").getBytes(StandardCharsets.UTF_8));
+        out.write(data);
+        out.flush();
+    }
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(System.out, false, "UTF-8");
+        System.setOut(System.err);
+
+        load();
+        protocol.print("READY\n");
+        protocol.flush();
+
+        BufferedReader reader = new BufferedReader(
+            new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = reader.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+
+            try {
+                Object seq = wrapRefArray.invoke(predef, (Object) line.split("\t"));
+                Object termination = runWomtool.invoke(womtool, seq);
+                int returnCode = (Integer) call(termination, "returnCode");
+                respond(protocol, returnCode, getOutput(termination));
+            } catch (Throwable e) {
+                Throwable cause = e.getCause() != null ? e.getCause() : e;
+                respond(protocol, 1, String.valueOf(cause));
+            }
+        }
+    }
+}
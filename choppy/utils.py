@@ -32,27 +32,34 @@ logging.setLoggerClass(verboselogs.VerboseLogger)
 logger = logging.getLogger('choppy.utils')
 
 
-def set_logger(log_name, loglevel, handler='stream', subdir="project_logs", log_dir='/tmp'):
+def get_log_file(log_name, subdir="project_logs", log_dir='/tmp'):
     if subdir:
         project_logs = os.path.join(log_dir, "project_logs")
         check_dir(project_logs, skip=True)
-        logfile = os.path.join(project_logs, '{}_choppy.log'.format(log_name))
-    else:
-        logfile = os.path.join(log_dir, '{}_{}_choppy.log'.format(str(time.strftime("%Y-%m-%d")), log_name))
+        return os.path.join(project_logs, '{}_choppy.log'.format(log_name))
+    return os.path.join(log_dir, '{}_{}_choppy.log'.format(str(time.strftime("%Y-%m-%d")), log_name))
+
+
+def get_log_format(loglevel):
+    if loglevel == logging.SPAM:
+        return '%(asctime)s - %(name)s(%(lineno)d) - %(levelname)s - %(message)s'
+    elif loglevel == logging.DEBUG:
+        return '%(name)s - %(levelname)s - %(message)s'
+    return '%(message)s'
+
+
+def set_logger(log_name, loglevel, handler='stream', subdir="project_logs", log_dir='/tmp'):
+    logfile = get_log_file(log_name, subdir=subdir, log_dir=log_dir)
 
     if handler != 'stream':
         fhandler = logging.FileHandler(logfile)
     else:
         fhandler = None
 
+    fmt = get_log_format(loglevel)
     if loglevel == logging.SPAM:
-        fmt = '%(asctime)s - %(name)s(%(lineno)d) - %(levelname)s - %(message)s'
         coloredlogs.install(level=logging.DEBUG, fmt=fmt, stream=fhandler)
-    elif loglevel == logging.DEBUG:
-        fmt = '%(name)s - %(levelname)s - %(message)s'
-        coloredlogs.install(level=loglevel, fmt=fmt, stream=fhandler)
     else:
-        fmt = '%(message)s'
         coloredlogs.install(level=loglevel, fmt=fmt, stream=fhandler)
 
 
@@ -299,3 +306,25 @@ class Process:
 def clean_temp_files():
     choppy_temp = '/tmp/choppy'
     shutil.rmtree(choppy_temp, ignore_errors=True)
+
+
+def read_tail(filepath, max_bytes):
+    """Read at most the last max_bytes of a file without loading the whole file.
+
+    :param filepath: the path of a file.
+    :param max_bytes: the maximum number of bytes to read.
+    :return: (data, truncated), data is bytes and truncated is True when the file is larger than max_bytes. # noqa
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        truncated = size > max_bytes
+        f.seek(max(0, size - max_bytes))
+        data = f.read(max_bytes)
+
+    if truncated:
+        # Skip the partial first line.
+        newline = data.find(b'\n')
+        if 0 <= newline < len(data) - 1:
+            data = data[newline + 1:]
+    return data, truncated
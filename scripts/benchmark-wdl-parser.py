@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Compare the builtin WDL parser with `womtool inputs`.
+
+Usage:
+    python scripts/benchmark-wdl-parser.py [app_dir_or_wdl ...] [-n 20]
+
+Without arguments, the draft-2 and 1.0 WDL fixtures of the tests and all
+installed apps are used. App templates are rendered with their default variables (missing ones are
+filled with placeholders) into a temporary directory before parsing.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.app_utils import (AppDefaultVar, get_all_variables, get_app_root_dir,  # noqa
+                                   listapps, render_app)
+from choppy.core.wdl_parser import get_inputs  # noqa
+from choppy.core.womtool import run_womtool  # noqa
+from choppy.exceptions import WdlParseError, WomtoolError  # noqa
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                            'tests', 'core', 'wdl_fixtures')
+
+
+def render(app_dir, dest_dir):
+    variables = dict((var, 'placeholder') for var in get_all_variables(app_dir))
+    if os.path.isfile(os.path.join(app_dir, 'defaults')):
+        variables.update(AppDefaultVar(app_dir).show_default_value())
+    variables['project_name'] = 'benchmark'
+    wdl_path = os.path.join(dest_dir, 'workflow.wdl')
+    with open(wdl_path, 'w') as f:
+        f.write(render_app(app_dir, 'workflow.wdl', variables))
+    if os.path.isdir(os.path.join(app_dir, 'tasks')):
+        shutil.copytree(os.path.join(app_dir, 'tasks'), os.path.join(dest_dir, 'tasks'))
+    return wdl_path
+
+
+def timeit(func, times):
+    start = time.time()
+    for _ in range(times):
+        result = func()
+    return result, (time.time() - start) / times * 1000
+
+
+def bench(name, wdl_path, times):
+    try:
+        parsed, parser_ms = timeit(lambda: get_inputs(wdl_path), times)
+    except WdlParseError as err:
+        parsed, parser_ms = 'fallback: %s' % err, None
+
+    try:
+        # The first call of womtool pays the JVM start.
+        (code, output), womtool_ms = timeit(
+            lambda: run_womtool(['inputs', wdl_path], cwd=os.path.dirname(wdl_path),
+                                use_worker=False), 1)
+        expected = json.loads(output) if code == 0 else 'womtool error'
+    except (WomtoolError, OSError, ValueError) as err:
+        expected, womtool_ms = 'womtool unavailable: %s' % err, None
+
+    same = parsed == expected if isinstance(parsed, dict) and isinstance(expected, dict) else '-'
+    print('%-40s parser: %10s ms  womtool: %10s ms  same: %s' % (
+        name, '%.2f' % parser_ms if parser_ms else '-',
+        '%.2f' % womtool_ms if womtool_ms else '-', same))
+    if same is False:
+        for key in sorted(set(parsed) | set(expected)):
+            if parsed.get(key) != expected.get(key):
+                print('    %s: parser=%s womtool=%s' % (key, parsed.get(key), expected.get(key)))
+    elif not isinstance(parsed, dict):
+        print('    %s' % parsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='*', help='App directories or WDL files.')
+    parser.add_argument('-n', '--times', type=int, default=20, help='Repeat times of the parser.')
+    args = parser.parse_args()
+
+    paths = args.paths
+    if not paths:
+        paths = [os.path.join(FIXTURES_DIR, name, 'workflow.wdl') for name in sorted(os.listdir(FIXTURES_DIR))]
+        paths += [os.path.join(get_app_root_dir(), app) for app in listapps()]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for idx, path in enumerate(paths):
+            if os.path.isdir(path):
+                dest_dir = os.path.join(tmp_dir, str(idx))
+                os.makedirs(dest_dir)
+                try:
+                    wdl_path = render(path, dest_dir)
+                except Exception as err:
+                    print('%-40s render failed: %s' % (os.path.basename(path), err))
+                    continue
+            else:
+                wdl_path = path
+            name = os.path.basename(path.rstrip('/'))
+            if name == 'workflow.wdl':
+                name = os.path.basename(os.path.dirname(path))
+            bench(name, wdl_path, args.times)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -71,8 +71,11 @@ setup(
     },
     extras_require={
         "dotenv": ["python-dotenv"],
+        "postgresql": ["psycopg2-binary"],
+        "fastjson": ["orjson"],
         "dev": [
             "pytest>=3",
+            "aiosmtpd",
             "tox",
             "sphinx",
             "pallets-sphinx-themes",
@@ -101,16 +104,16 @@ setup(
         "configparser>=3.5.0",
         "Jinja2>=2.10",
         "python-dateutil>=2.7.5",
-        "ratelimit>=2.2.0",
         "requests>=2.21.0",
         "coloredlogs>=10.0",
         "argcomplete>=1.9.4",
         "markdown2>=2.3.7",
         "GitPython>=2.1.11",
-        "SQLAlchemy >= 1.3.1",
+        "SQLAlchemy >= 1.4",
         "docker",
         "verboselogs>=1.7",
         "psutil>=5.5.1",
+        "crcmod",
         "jsonschema",
         "pytest>=4.4.1",
         "pytest-html"
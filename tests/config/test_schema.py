@@ -61,3 +61,29 @@ def test_is_port():
 
     with pytest.raises(ValidationError):
         validate(instance, schema, cls=ChoppyValidator)
+
+
+def test_general_schema():
+    import os
+    import json
+    import configparser
+    from jsonschema.exceptions import ValidationError
+    from choppy.config import ChoppyConfig
+    from choppy.config.schema import ChoppyValidator
+    from jsonschema import validate
+
+    schema_file = os.path.join(os.path.dirname(ChoppyConfig.get_conf_example(return_path=True)),
+                               'schemas', 'config_general.json')
+    with open(schema_file, 'r') as f:
+        schema = json.load(f)
+
+    # The example agrees with the defaults of the schema.
+    parser = configparser.ConfigParser()
+    parser.read(ChoppyConfig.get_conf_example(return_path=True))
+    general = dict(parser.items('general'))
+    validate(general, schema, cls=ChoppyValidator)
+    assert int(general['cromwell_version_ttl']) == schema['properties']['cromwell_version_ttl']['default']
+
+    validate(dict(general, cromwell_version_ttl=3600), schema, cls=ChoppyValidator)
+    with pytest.raises(ValidationError):
+        validate(dict(general, cromwell_version_ttl='1h'), schema, cls=ChoppyValidator)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.conftest
+    ~~~~~~~~~
+
+    Fake cromwell responses and clients shared by the tests of choppy.core.
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import sys
+import json
+import pytest
+from collections import OrderedDict
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.cromwell import Cromwell  # noqa
+
+
+class FakeResponse:
+    """A requests.Response with a json body, or a text body if text is given."""
+
+    def __init__(self, data=None, status_code=200, headers=None, text=None):
+        self.text = text if text is not None else json.dumps({} if data is None else data)
+        self.content = self.text.encode('utf-8')
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = 'http://localhost:8000/api'
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeCromwell:
+    """A cromwell client of one server.
+
+    :param workflows: {workflow_id: workflow}, a workflow is a dict of status, labels (optional),
+                      name (optional, a project name), parent (optional, the parent workflow id)
+                      and wdl (optional, the submitted WDL).
+    :param down: every request exits like an unreachable server.
+    """
+
+    def __init__(self, workflows=None, server='localhost', down=False):
+        self.workflows = OrderedDict() if workflows is None else workflows
+        self.server = server
+        self.down = down
+        # (action, workflow_id, ...) of every change.
+        self.calls = []
+        # (wdl, inputs, dependencies, extra_options, custom_labels) of every submitted workflow.
+        self.submitted = []
+
+    def _check(self):
+        if self.down:
+            sys.exit(1)
+
+    def _results(self, query_dict):
+        self._check()
+        statuses = query_dict.get('status', [])
+        name = query_dict.get('name')
+        return [dict(id=workflow_id, name=workflow.get('name', name), status=workflow['status'],
+                     labels=dict(workflow.get('labels', {})), parentWorkflowId=workflow.get('parent'))
+                for workflow_id, workflow in self.workflows.items()
+                if (not statuses or workflow['status'] in statuses) and workflow.get('name', name) == name]
+
+    def query(self, query_dict):
+        results = self._results(query_dict)
+        return {'results': results[:query_dict.get('pageSize')], 'totalResultsCount': len(results)}
+
+    def query_pages(self, query_dict):
+        self.calls.append(('query', query_dict.get('name')))
+        return self._results(query_dict)
+
+    def query_status(self, workflow_id):
+        self._check()
+        if workflow_id not in self.workflows:
+            return {'status': 'fail', 'message': 'Unrecognized workflow ID: %s' % workflow_id}
+        return {'id': workflow_id, 'status': self.workflows[workflow_id]['status']}
+
+    def get(self, rtype, workflow_id):
+        return {'id': workflow_id, 'labels': dict(self.workflows[workflow_id].get('labels', {}))}
+
+    def query_metadata(self, workflow_id, include_keys=None):
+        workflow = self.workflows[workflow_id]
+        return {'id': workflow_id, 'labels': dict(workflow.get('labels', {})),
+                'submittedFiles': {'workflow': workflow.get('wdl', 'workflow w {}')}}
+
+    def process_metadata_label(self, metadata, username=None):
+        return Cromwell.process_metadata_label(self, metadata, username=username)
+
+    def stop_workflow(self, workflow_id):
+        self.calls.append(('abort', workflow_id))
+        self.workflows[workflow_id]['status'] = 'Aborted'
+        return {'id': workflow_id, 'status': 'Aborting'}
+
+    def label_workflow(self, workflow_id, labels):
+        self.calls.append(('label', workflow_id))
+        self.workflows[workflow_id].setdefault('labels', {}).update(labels)
+        return FakeResponse(status_code=200)
+
+    def restart_workflow(self, workflow_id, disable_caching=False, dependencies=None, metadata=None):
+        self.calls.append(('restart', workflow_id, dependencies))
+        return {'id': 'new-%s' % workflow_id, 'status': 'Submitted'}
+
+    def jstart_workflow(self, wdl, inputs, dependencies=None, wdl_string=False,
+                        extra_options=None, custom_labels=None):
+        self.submitted.append((wdl, inputs, dependencies, extra_options, custom_labels))
+        return {'id': 'new-%s' % custom_labels['sample-id'], 'status': 'Submitted'}
+
+
+@pytest.fixture
+def fake_response():
+    """The FakeResponse class, e.g. fake_response({'id': 'wf1'}, status_code=200)."""
+    return FakeResponse
+
+
+@pytest.fixture
+def fake_cromwell(monkeypatch):
+    """Make fake servers, get_cromwell of the given modules returns their clients.
+
+    e.g. clients = fake_cromwell({'localhost': {'wf1': {'status': 'Running'}}}, bulk, down=['hpc'])
+
+    :return: a function, (workflows_by_server, *modules, down=()) -> {server: FakeCromwell}.
+    """
+    def make(workflows_by_server, *modules, **kwargs):
+        down = kwargs.get('down', ())
+        clients = OrderedDict((server, FakeCromwell(workflows, server=server, down=server in down))
+                              for server, workflows in workflows_by_server.items())
+        for module in modules:
+            monkeypatch.setattr(module, 'get_cromwell', lambda server: clients[server])
+        return clients
+    return make
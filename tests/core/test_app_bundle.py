@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_app_bundle
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.app_bundle import build_bundle, load_bundle  # noqa
+from choppy.core.app_utils import build_dependencies_zip, get_all_variables, render_app  # noqa
+
+INPUTS = '{"wf.sample_id": "{{ sample_id }}", "wf.threads": {{ threads }}}\n'
+WORKFLOW = '''import "./tasks/hello.wdl" as hello
+
+workflow wf {
+    String sample_id
+    Int threads
+    call hello.hello {input: name=sample_id}
+}
+'''
+TASK = '''task hello {
+    String name
+    command { echo ${name} }
+}
+'''
+
+
+def make_app(tmpdir):
+    app = tmpdir.mkdir('app')
+    app.join('inputs').write(INPUTS)
+    app.join('workflow.wdl').write(WORKFLOW + '# {{ project_name }}\n')
+    app.mkdir('tasks').join('hello.wdl').write(TASK)
+    return str(app)
+
+
+def test_build_bundle(tmpdir):
+    app_dir = make_app(tmpdir)
+    assert load_bundle(app_dir) is None
+
+    bundle = build_bundle(app_dir)
+    assert bundle.get_vars('inputs') == {'sample_id', 'threads'}
+    assert bundle.signature == {'sample_id': 'String', 'threads': 'Int'}
+    assert bundle.dependencies_zip() == build_dependencies_zip(tmpdir.join('app', 'tasks'))
+    assert load_bundle(app_dir) is bundle
+
+    data = {'sample_id': 'S1', 'threads': 4, 'project_name': 'test'}
+    for template_file in ('inputs', 'workflow.wdl'):
+        assert bundle.render(template_file, data) == render_app(app_dir, template_file, data)
+
+    # The variables are read from the bundle.
+    bundle.manifest['variables'] = {'inputs': ['from_bundle'], 'workflow.wdl': []}
+    assert sorted(get_all_variables(app_dir)) == ['from_bundle', 'sample_id']
+
+
+def test_bundle_signature(tmpdir):
+    app_dir = make_app(tmpdir)
+    # Samples name the workflow by their project.
+    tmpdir.join('app', 'workflow.wdl').write(WORKFLOW.replace('workflow wf', 'workflow {{ project_name }}'))
+    bundle = build_bundle(app_dir)
+    wdl = bundle.render('workflow.wdl', {'project_name': 'rnaseq'})
+    assert bundle.get_signature(wdl) == {'rnaseq.sample_id': 'String', 'rnaseq.threads': 'Int'}
+
+    # A variable changes the inputs, every sample gets its own signature.
+    tmpdir.join('app', 'workflow.wdl').write(WORKFLOW.replace('Int threads', '{{ threads_type }} threads'))
+    bundle = build_bundle(app_dir)
+    assert bundle.signature is None
+    assert bundle.get_signature(bundle.render('workflow.wdl', {'threads_type': 'Int'})) is None
+
+
+def test_stale_bundle(tmpdir):
+    app_dir = make_app(tmpdir)
+    old_bundle = build_bundle(app_dir)
+
+    tmpdir.join('app', 'inputs').write(INPUTS.replace('threads', 'cpu'))
+    assert load_bundle(app_dir) is None
+    assert sorted(get_all_variables(app_dir)) == ['cpu', 'sample_id']
+
+    bundle = build_bundle(app_dir)
+    assert bundle.manifest['key'] != old_bundle.manifest['key']
+    assert [p.basename for p in tmpdir.join('app', '.choppy-build').listdir()] == [bundle.manifest['key']]
+
+    # A changed bundle file is not used.
+    tmpdir.join('app', '.choppy-build', bundle.manifest['key'], 'tasks.zip').write('broken')
+    assert not bundle.verify()
+    assert build_bundle(app_dir).verify()
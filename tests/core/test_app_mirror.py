@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_app_mirror
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import os
+import subprocess
+from subprocess import check_call, check_output
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.app_utils import clone_from_mirror, get_version, update_mirror  # noqa
+
+
+def git(cwd, *args):
+    check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args), cwd=cwd)
+
+
+def make_repo(tmpdir):
+    repo = tmpdir.mkdir('repo')
+    git(str(repo), 'init', '-q', '-b', 'master')
+    repo.join('workflow.wdl').write('workflow w {}')
+    git(str(repo), 'add', '-A')
+    git(str(repo), 'commit', '-q', '-m', 'init')
+    git(str(repo), 'tag', 'v0.1.0')
+    return repo
+
+
+def test_install_from_mirror(tmpdir):
+    repo = make_repo(tmpdir)
+    mirror_dir = str(tmpdir.join('.mirrors', 'choppy', 'app.git'))
+
+    assert update_mirror(str(repo), mirror_dir)
+    assert clone_from_mirror(mirror_dir, 'v0.1.0', str(tmpdir.join('app-v0.1.0')),
+                             origin_url='http://example.com/choppy/app.git') == 0
+    remote = check_output(['git', 'remote', 'get-url', 'origin'], cwd=str(tmpdir.join('app-v0.1.0')))
+    assert remote.decode().strip() == 'http://example.com/choppy/app.git'
+
+    # A new version only needs a fetch.
+    repo.join('workflow.wdl').write('workflow w2 {}')
+    git(str(repo), 'commit', '-q', '-am', 'v2')
+    git(str(repo), 'tag', 'v0.2.0')
+    assert update_mirror(str(repo), mirror_dir)
+    assert clone_from_mirror(mirror_dir, 'v0.2.0', str(tmpdir.join('app-v0.2.0'))) == 0
+    assert tmpdir.join('app-v0.2.0', 'workflow.wdl').read() == 'workflow w2 {}'
+
+    # The cached mirror is still used when the remote is unreachable.
+    repo.remove()
+    assert update_mirror(str(repo), mirror_dir)
+    assert clone_from_mirror(mirror_dir, 'master', str(tmpdir.join('app-latest'))) == 0
+
+
+def test_failed_mirror(tmpdir):
+    mirror_dir = str(tmpdir.join('.mirrors', 'choppy', 'app.git'))
+    assert not update_mirror(str(tmpdir.join('not_exist')), mirror_dir)
+    assert os.listdir(str(tmpdir.join('.mirrors', 'choppy'))) == []
+
+
+def test_get_version(tmpdir, monkeypatch):
+    import git as gitpython  # noqa: F401, GitPython checks the git executable on import.
+
+    repo = make_repo(tmpdir)
+    git(str(repo), 'remote', 'add', 'origin', 'http://example.com/choppy/app.git')
+    head = check_output(['git', 'rev-parse', 'HEAD'], cwd=str(repo)).decode().strip()
+
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError('git should not be spawned')
+
+    monkeypatch.setattr(subprocess.Popen, '__init__', no_subprocess)
+    version = get_version(str(repo))
+    assert version['app_name'] == 'http://example.com/choppy/app.git'
+    assert version['commit_id'] == head
+    assert version['version'] == 'v0.1.0'
+    assert len(version['template_hash']) == 64
+    monkeypatch.undo()
+
+    # A new commit is a new key of the memo, the template hash always follows the files.
+    repo.join('inputs').write('{}')
+    git(str(repo), 'add', '-A')
+    git(str(repo), 'commit', '-q', '-m', 'inputs')
+    new_version = get_version(str(repo))
+    assert new_version['commit_id'] != head
+    assert new_version['template_hash'] != version['template_hash']
+
+    zip_app = tmpdir.mkdir('zip_app')
+    zip_app.join('workflow.wdl').write('workflow w {}')
+    assert get_version(str(zip_app))['commit_id'] is None
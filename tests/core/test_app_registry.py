@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_app_registry
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import json
+import zipfile
+import pytest
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.app_registry import AppRegistry, get_registry, split_app_name  # noqa
+from choppy.core.app_utils import install_app_by_zip  # noqa
+from choppy.exceptions import AppInstallationFailed, InValidApp  # noqa
+
+
+def make_app(root, name):
+    app_dir = root.ensure_dir(*name.split('/'))
+    app_dir.join('inputs').write('{}')
+    app_dir.join('workflow.wdl').write('workflow %s {}' % name.replace('/', '_').replace('-', '_'))
+    app_dir.mkdir('tasks')
+    return app_dir
+
+
+def test_split_app_name():
+    assert split_app_name('choppy/dna-seq-v0.1.0') == ('choppy', 'dna-seq', 'v0.1.0')
+    assert split_app_name('rna') == (None, 'rna', None)
+
+
+def test_registry(tmpdir):
+    make_app(tmpdir, 'rna')
+    make_app(tmpdir, 'choppy/wgs-latest')
+    tmpdir.mkdir('.cache').mkdir('wdl_signatures')
+    tmpdir.mkdir('not_an_app')
+
+    registry = AppRegistry(str(tmpdir))
+    assert registry.names() == ['choppy/wgs-latest', 'rna']
+    record = registry.get('choppy/wgs-latest')
+    assert (record['namespace'], record['app_name'], record['version']) == ('choppy', 'wgs', 'latest')
+    assert set(record['templates']) == {'inputs', 'workflow.wdl'}
+    assert registry.get_path('rna') == str(tmpdir.join('rna'))
+
+    # Changes are saved, another registry sees them without scanning.
+    make_app(tmpdir, 'choppy/dna-seq-v1.0')
+    registry.add('choppy/dna-seq-v1.0', version='v1.0')
+    registry.remove('rna')
+    with open(str(tmpdir.join('.registry.json'))) as f:
+        assert sorted(json.load(f)['apps']) == ['choppy/dna-seq-v1.0', 'choppy/wgs-latest']
+    assert AppRegistry(str(tmpdir)).names() == ['choppy/dna-seq-v1.0', 'choppy/wgs-latest']
+
+    # Apps copied by hand are found by a reindex.
+    assert 'rna' not in registry
+    assert registry.reindex() == ['choppy/dna-seq-v1.0', 'choppy/wgs-latest', 'rna']
+    assert registry.get('choppy/dna-seq-v1.0')['version'] == 'v1.0'
+
+
+def test_broken_registry(tmpdir):
+    make_app(tmpdir, 'rna')
+    tmpdir.join('.registry.json').write('{')
+    assert AppRegistry(str(tmpdir)).names() == ['rna']
+
+
+def test_concurrent_registries(tmpdir):
+    make_app(tmpdir, 'rna')
+    make_app(tmpdir, 'wgs')
+    make_app(tmpdir, 'dna')
+    # Two processes loaded the registry before either of them installed an app.
+    first = AppRegistry(str(tmpdir))
+    second = AppRegistry(str(tmpdir))
+    first.remove('rna')
+    second.remove('wgs')
+    assert AppRegistry(str(tmpdir)).names() == ['dna']
+    assert second.names() == ['dna']
+
+    # The shared registry is reloaded when another process installs an app.
+    shared = get_registry(str(tmpdir))
+    make_app(tmpdir, 'choppy/rna-v1.0')
+    first.add('choppy/rna-v1.0')
+    assert get_registry(str(tmpdir)) is shared
+    assert shared.names() == ['choppy/rna-v1.0', 'dna']
+
+
+def make_zip(tmpdir, name, files):
+    zip_path = str(tmpdir.join('%s.zip' % name))
+    with zipfile.ZipFile(zip_path, 'w') as zfile:
+        for filename, content in files.items():
+            zfile.writestr('%s/%s' % (name, filename), content)
+    return zip_path
+
+
+def test_install_app_by_zip(tmpdir):
+    root = tmpdir.mkdir('apps')
+    files = {'inputs': '{}', 'workflow.wdl': 'workflow w {}', 'README.md': '# rna',
+             'tasks/mapping.wdl': 'task mapping {}', 'tasks/sub/qc.wdl': 'task qc {}'}
+    assert install_app_by_zip(str(root), make_zip(tmpdir, 'rna', files)) == 'rna'
+    assert root.join('rna', 'tasks', 'sub', 'qc.wdl').read() == 'task qc {}'
+    assert not root.join('rna', 'README.md').exists()
+    assert [p.basename for p in root.listdir()] == ['rna']
+
+    with pytest.raises(InValidApp):
+        install_app_by_zip(str(root), make_zip(tmpdir, 'no_inputs', {'workflow.wdl': ''}))
+
+    # A corrupted member fails the install, nothing is left in the app root directory.
+    zip_path = make_zip(tmpdir, 'broken', dict(files, **{'tasks/big.wdl': 'task big {}' * 100}))
+    with open(zip_path, 'rb') as f:
+        data = f.read()
+    with open(zip_path, 'wb') as f:
+        f.write(data.replace(b'task big {}task big {}', b'task bad {}task bad {}', 1))
+    with pytest.raises(AppInstallationFailed):
+        install_app_by_zip(str(root), zip_path)
+    assert [p.basename for p in root.listdir()] == ['rna']
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_batch_validation
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import validator, workflow  # noqa
+
+SIGNATURE = {
+    'wf.sample_id': 'String',
+    'wf.threads': 'Int',
+    'wf.debug': 'Boolean (optional)'
+}
+
+
+class FakeBundle:
+    def get_signature(self, wdl):
+        return dict(SIGNATURE) if wdl == 'workflow wf {}' else None
+
+
+def make_samples():
+    rendered_samples = []
+    for idx in range(100):
+        inputs = {'wf.sample_id': 'S%s' % idx, 'wf.threads': 4}
+        if idx == 42:
+            inputs['wf.threads'] = '4'
+        if idx == 87:
+            inputs.pop('wf.threads')
+        rendered_samples.append({'sample': {'sample_id': 'S%s' % idx},
+                                 'wdl': 'workflow wf {}',
+                                 'wdl_path': '/tmp/workflow.wdl',
+                                 'inputs': inputs})
+    return rendered_samples
+
+
+def test_validate_samples(monkeypatch):
+    monkeypatch.setattr(validator, 'get_wdl_signature', lambda wdl: dict(SIGNATURE))
+
+    errors = workflow.validate_samples(make_samples(), jobs=4)
+    assert list(errors.keys()) == ['S42', 'S87']
+    assert errors['S42'] == ['wf.threads: 4 is not a valid Int.']
+    assert errors['S87'] == ['Required parameter wf.threads is missing from input json.']
+
+
+def test_validate_samples_by_bundle(monkeypatch):
+    signatures = []
+    monkeypatch.setattr(validator, 'get_wdl_signature', lambda wdl: signatures.append(wdl) or dict(SIGNATURE))
+
+    # The signature of the bundle is used, the WDL of samples is not parsed.
+    rendered_samples = make_samples()
+    errors = workflow.validate_samples(rendered_samples, jobs=4, bundle=FakeBundle())
+    assert list(errors.keys()) == ['S42', 'S87']
+    assert signatures == []
+
+    # Unless a sample has another WDL.
+    rendered_samples[3]['wdl'] = 'workflow wf { Int cpu }'
+    workflow.validate_samples(rendered_samples, jobs=4, bundle=FakeBundle())
+    assert signatures == ['/tmp/workflow.wdl']
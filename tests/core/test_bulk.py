@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_bulk
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import app_utils, bulk, cromwell_pool  # noqa
+from choppy.core.bulk import query_workflow_ids, read_workflow_ids, run_bulk, unique_targets  # noqa
+
+
+def make_cromwell(fake_cromwell, *modules):
+    clients = fake_cromwell({'localhost': {
+        'wf1': {'status': 'Running', 'labels': {}},
+        'wf2': {'status': 'Succeeded', 'labels': {'batch': 'b1'}},
+        'wf3': {'status': 'Failed', 'labels': {}},
+    }}, bulk, *modules)
+    return clients['localhost']
+
+
+def test_read_workflow_ids(tmpdir):
+    submitted = tmpdir.join('submitted.csv')
+    submitted.write('sample_id,workflow_id,server\nS1,wf1,hpc\nS2,wf2,\n')
+    assert read_workflow_ids(str(submitted)) == [('wf1', 'hpc'), ('wf2', None)]
+
+    ids = tmpdir.join('ids.txt')
+    ids.write('# failed workflows\nwf1\n\nwf3\n')
+    assert read_workflow_ids(str(ids)) == [('wf1', None), ('wf3', None)]
+
+    assert unique_targets([('wf1', None), ('wf2', None), ('wf1', 'hpc')]) == [('wf1', 'hpc'), ('wf2', None)]
+
+
+def test_query_workflow_ids(fake_cromwell):
+    cromwell = make_cromwell(fake_cromwell, cromwell_pool)
+    cromwell.workflows['sub1'] = {'status': 'Running', 'labels': {}, 'parent': 'wf1'}
+    assert query_workflow_ids(['localhost'], project_name='p1') == [
+        ('wf1', 'localhost'), ('wf2', 'localhost'), ('wf3', 'localhost')]
+    assert cromwell.calls == [('query', 'p1')]
+
+
+def test_bulk_abort(fake_cromwell):
+    cromwell = make_cromwell(fake_cromwell)
+    targets = [('wf1', None), ('wf2', None), ('wf4', None), ('wf5', None)]
+    reports = run_bulk('abort', targets, jobs=2)
+    assert [(r['workflow_id'], r['server'], r['result']) for r in reports] == [
+        ('wf1', 'localhost', 'done'), ('wf2', 'localhost', 'skipped'), ('wf4', 'localhost', 'failed'),
+        ('wf5', 'localhost', 'failed')]
+    assert [r['message'] for r in reports[2:]] == ['Unrecognized workflow ID: wf4', 'Unrecognized workflow ID: wf5']
+
+    # Aborted workflows are skipped by a second run.
+    assert [r['result'] for r in run_bulk('abort', targets[:1])] == ['skipped']
+    assert cromwell.calls == [('abort', 'wf1')]
+
+
+def test_bulk_label_and_restart(fake_cromwell):
+    cromwell = make_cromwell(fake_cromwell)
+    targets = [('wf1', None), ('wf2', None)]
+    assert [r['result'] for r in run_bulk('label', targets, labels={'batch': 'b1'})] == ['done', 'skipped']
+
+    assert run_bulk('restart', [('wf5', None)])[0]['result'] == 'failed'
+    targets = [('wf1', None), ('wf3', None)]
+    reports = run_bulk('restart', targets)
+    assert [(r['result'], r['message']) for r in reports] == [('skipped', 'It is Running'), ('done', 'new-wf3')]
+    assert cromwell.workflows['wf3']['labels'] == {'restarted-as': 'new-wf3'}
+    assert [r['result'] for r in run_bulk('restart', targets)] == ['skipped', 'skipped']
+    assert cromwell.calls.count(('restart', 'wf3', None)) == 1
+
+
+def test_restart_with_dependencies(tmpdir, monkeypatch, fake_cromwell):
+    cromwell = make_cromwell(fake_cromwell)
+    wdl = 'import "tasks/mapping.wdl" as mapping\nimport "https://example.com/qc.wdl" as qc\nworkflow w {}'
+    cromwell.workflows['wf3'].update({'wdl': wdl, 'labels': {'sample-id': 's1'}})
+    cromwell.workflows['wf4'] = {'status': 'Aborted', 'wdl': wdl, 'labels': {'sample-id': 's2'}}
+    zips = []
+    monkeypatch.setattr(app_utils, 'build_dependencies_zip', lambda path: zips.append(path) or b'zip')
+    project = tmpdir.mkdir('project')
+    project.mkdir('S1').mkdir('tasks').join('mapping.wdl').write('task mapping {}')
+
+    # The tasks of a sample are found by its sample-id, the zip isn't kept by Cromwell.
+    reports = run_bulk('restart', [('wf3', None), ('wf4', None)], project_dir=str(project))
+    assert [(r['result'], r['message']) for r in reports] == [
+        ('done', 'new-wf3'),
+        ('failed', 'No dependencies for the imports of the WDL, '
+                   'set the project directory or the app of the workflow.')]
+    assert zips == [str(project.join('S1', 'tasks'))]
+    assert ('restart', 'wf3', b'zip') in cromwell.calls
+
+    # Then the tasks of the app.
+    app = tmpdir.mkdir('app')
+    app.mkdir('tasks')
+    reports = run_bulk('restart', [('wf4', None)], project_dir=str(project), app_dir=str(app))
+    assert reports[0]['result'] == 'done'
+    assert zips[-1] == str(app.join('tasks'))
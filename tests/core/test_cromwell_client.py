@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_cromwell_client
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import threading
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import cromwell  # noqa
+
+
+def test_lazy_version(monkeypatch, fake_response):
+    monkeypatch.setattr(cromwell, '_versions', {})
+    monkeypatch.setattr(cromwell, 'get_version_ttl', lambda: 0)
+    urls = []
+
+    def request(self, method, url, **kwargs):
+        urls.append(url)
+        return fake_response({'cromwell': '36-abcdef'})
+
+    monkeypatch.setattr(cromwell.requests.Session, 'request', request)
+
+    client = cromwell.Cromwell('127.0.0.1', 8000)
+    assert urls == []
+
+    threads = [threading.Thread(target=lambda: client.long_version) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.short_version == 36
+    assert urls == ['http://127.0.0.1:8000/engine/v1/version']
+
+    # Another client of the same server doesn't probe it again.
+    assert cromwell.Cromwell('127.0.0.1', 8000).long_version == '36-abcdef'
+    assert len(urls) == 1
+
+
+def test_version_cache_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(cromwell, '_versions', {})
+    monkeypatch.setattr(cromwell, 'get_version_ttl', lambda: 3600)
+    monkeypatch.setattr(cromwell, 'get_version_cache_file', lambda: str(tmpdir.join('versions.json')))
+
+    cromwell.set_cached_version('127.0.0.1:8000', '36-abcdef')
+    monkeypatch.setattr(cromwell, '_versions', {})
+    assert cromwell.get_cached_version('127.0.0.1:8000') == '36-abcdef'
+    assert cromwell.get_cached_version('127.0.0.1:8001') is None
+
+
+def test_shared_clients(monkeypatch):
+    monkeypatch.setattr(cromwell, '_clients', {})
+    client = cromwell.get_cromwell('localhost')
+    assert cromwell.get_cromwell('localhost') is client
+
+
+def test_build_query_url():
+    url = cromwell.Cromwell.build_query_url('query?', {'status': ['Running', 'Submitted'], 'name': 'p1'})
+    assert url == 'query?status=Running&status=Submitted&name=p1'
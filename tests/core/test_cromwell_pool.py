@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_cromwell_pool
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import pytest
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import cromwell_pool  # noqa
+from choppy.core.cromwell_pool import Router, fan_out, merge_query_results  # noqa
+
+
+@pytest.fixture
+def servers(fake_cromwell):
+    clients = fake_cromwell({
+        'localhost': {'a1': {'status': 'Running'}, 'a2': {'status': 'Submitted'}, 'a3': {'status': 'Succeeded'}},
+        'hpc': {'b1': {'status': 'Running'}},
+        'down': {},
+    }, cromwell_pool, down=['down'])
+    return list(clients)
+
+
+def test_fan_out(servers):
+    results, errors = fan_out(lambda server: server.upper(), servers)
+    assert list(results.items()) == [('localhost', 'LOCALHOST'), ('hpc', 'HPC'), ('down', 'DOWN')]
+
+    loads = cromwell_pool.get_loads(servers)
+    assert list(loads.items()) == [('localhost', 2), ('hpc', 1)]
+
+    merged = cromwell_pool.query_all(servers, lambda cromwell: cromwell.query({}))
+    assert [(r['id'], r['server']) for r in merged['results']] == [
+        ('a1', 'localhost'), ('a2', 'localhost'), ('a3', 'localhost'), ('b1', 'hpc')]
+    assert merged['totalResultsCount'] == 4
+
+    assert cromwell_pool.find_workflow_server('b1', servers) == 'hpc'
+    assert cromwell_pool.find_workflow_server('c1', servers) is None
+
+
+def test_router(servers):
+    router = Router.from_servers(servers)
+    routes = [router.next() for _ in range(5)]
+    # hpc has the fewest workflows, then both servers are filled evenly.
+    assert routes == ['hpc', 'localhost', 'hpc', 'localhost', 'hpc']
+    router.release('hpc')
+    assert router.next() == 'hpc'
+
+    with pytest.raises(ValueError):
+        Router.from_servers(['down'])
+
+
+def test_merge_query_results():
+    merged = merge_query_results({'localhost': {'results': []}, 'hpc': {'message': 'error'}})
+    assert merged == {'results': [], 'totalResultsCount': 0}
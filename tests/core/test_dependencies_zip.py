@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_dependencies_zip
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.app_utils import build_dependencies_zip, generate_dependencies_zip  # noqa
+
+
+def make_tasks(tmpdir):
+    tasks = tmpdir.mkdir('tasks')
+    tasks.join('mapping.wdl').write('task mapping {}')
+    tasks.mkdir('sub').join('qc.wdl').write('task qc {}')
+    tasks.join('a.wdl').write('task a {}')
+    return str(tasks)
+
+
+def test_build_dependencies_zip(tmpdir):
+    tasks = make_tasks(tmpdir)
+    cwd = os.getcwd()
+    data = build_dependencies_zip(tasks)
+    assert os.getcwd() == cwd
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zfile:
+        assert zfile.namelist() == ['tasks/', 'tasks/sub/', 'tasks/a.wdl', 'tasks/mapping.wdl',
+                                    'tasks/sub/qc.wdl']
+        assert zfile.read('tasks/sub/qc.wdl') == b'task qc {}'
+
+    # Same tree, same bytes, even if the files are touched.
+    later = time.time() + 100
+    os.utime(os.path.join(tasks, 'a.wdl'), (later, later))
+    assert build_dependencies_zip(tasks) == data
+
+    with open(generate_dependencies_zip(tasks), 'rb') as f:
+        assert f.read() == data
+
+
+def test_build_dependencies_zip_in_threads(tmpdir):
+    tasks = make_tasks(tmpdir)
+    expected = build_dependencies_zip(tasks)
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(build_dependencies_zip, [tasks] * 32))
+    assert all(data == expected for data in results)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_json_checker
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import pytest
+from choppy.core import json_checker
+
+
+def test_load_json():
+    obj, error = json_checker.load_json(string='{"a": [1, 2], "b": "c"}')
+    assert obj == {'a': [1, 2], 'b': 'c'} and error is None
+
+    # Accepted by the stdlib json, even if the fast backend rejects it.
+    obj, error = json_checker.load_json(string='{"a": NaN}')
+    assert error is None
+
+
+def test_json_error_context(tmpdir):
+    string = '{\n  "a": 1,\n  "b": 2\n  "c": 3\n}'
+    obj, error = json_checker.load_json(string=string, source='sample1')
+    assert obj is None
+    assert (error.lineno, error.colno, error.line) == (4, 3, '  "c": 3')
+    assert error.source == 'sample1'
+    assert str(error).endswith('  "c": 3\n  ^-- %s\n' % error.msg)
+
+    json_file = tmpdir.join('inputs.json')
+    json_file.write(string)
+    assert json_checker.load_json(json_file=str(json_file))[1].to_dict() == \
+        dict(error.to_dict(), source=str(json_file))
+
+
+def test_check_json_exits():
+    assert json_checker.check_json(string='[1]') == [1]
+    with pytest.raises(SystemExit):
+        json_checker.check_json(string='[1,')
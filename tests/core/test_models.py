@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_models
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import sqlite3
+from choppy.config import init_config
+
+init_config()
+
+from sqlalchemy import inspect  # noqa
+from choppy.core import models  # noqa
+
+
+def make_result(w_id, status, username='choppy'):
+    return {'id': w_id, 'name': 'wf', 'status': status,
+            'start': '2019-01-01T00:00:00.000Z', 'labels': {'username': username}}
+
+
+def test_migrate_legacy_db(tmpdir):
+    db_file = str(tmpdir.join('workflow.db'))
+    # The first schema, no index besides the primary key.
+    conn = sqlite3.connect(db_file)
+    conn.execute('CREATE TABLE workflow (id VARCHAR(60) NOT NULL, name VARCHAR(250), '
+                 'status VARCHAR(30) NOT NULL, start DATETIME, "end" DATETIME, '
+                 'person_id VARCHAR(250), notified BOOLEAN NOT NULL, PRIMARY KEY (id))')
+    conn.execute("INSERT INTO workflow VALUES ('w1', 'wf', 'Running', NULL, NULL, 'choppy', 0)")
+    conn.commit()
+    conn.close()
+
+    engine = models.get_engine(db_file)
+    indexed = set(index['column_names'][0] for index in inspect(engine).get_indexes('workflow'))
+    assert indexed == {'start', 'status', 'person_id'}
+    assert models.migrate(engine) == models.SCHEMA_VERSION
+
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+
+
+def test_bulk_upsert(tmpdir):
+    session = models.get_session(str(tmpdir.join('workflow.db')))
+    rows = [models.Workflow.from_query_result(make_result('w%s' % i, 'Running')).to_dict()
+            for i in range(100)]
+    models.bulk_upsert(session, rows)
+    session.commit()
+
+    changed = models.Workflow.from_query_result(make_result('w1', 'Failed'), person_id='other')
+    changed.update_status('Failed')
+    models.bulk_upsert(session, [changed.to_dict()])
+    session.commit()
+
+    assert session.query(models.Workflow).count() == 100
+    workflow = session.get(models.Workflow, 'w1')
+    assert (workflow.status, workflow.person_id, workflow.notified) == ('Failed', 'other', True)
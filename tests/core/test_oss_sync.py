@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_oss_sync
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import pytest
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import oss, oss_sync  # noqa
+from choppy.exceptions import ChecksumError  # noqa
+
+needs_crc64 = pytest.mark.skipif(oss_sync.crc64 is None, reason='crcmod with its C extension is not installed')
+
+
+@needs_crc64
+def test_crc64():
+    # Check value of CRC-64/XZ (ECMA-182), the same as X-Oss-Hash-Crc64ecma.
+    assert oss_sync.crc64(b'123456789') == 0x995DC9BBDF1939FA
+    assert oss_sync.crc64(b'56789', oss_sync.crc64(b'1234')) == 0x995DC9BBDF1939FA
+
+
+def test_is_md5_etag():
+    assert oss_sync.is_md5_etag('4F16FDAE7AC404CEC8B727FCC67779D6')
+    assert not oss_sync.is_md5_etag('4F16FDAE7AC404CEC8B727FCC67779D6-3')
+    assert not oss_sync.is_md5_etag(None)
+
+
+def test_digest_cache(tmpdir, monkeypatch):
+    data_file = tmpdir.join('data.txt')
+    data_file.write('123456789')
+    cache = oss_sync.DigestCache(str(tmpdir.join('cache.json')))
+    digest = cache.get(str(data_file))
+    assert digest['md5'] == '25F9E794323B453885F5181F1B624D0B'
+    cache.save()
+
+    # Unchanged files must not be re-hashed.
+    def fail(*args, **kwargs):
+        raise AssertionError('File is re-hashed.')
+
+    reloaded = oss_sync.DigestCache(str(tmpdir.join('cache.json')))
+    monkeypatch.setattr(oss_sync.DigestCache, '_hash_file', staticmethod(fail))
+    assert reloaded.get(str(data_file))['md5'] == digest['md5']
+
+
+@needs_crc64
+def test_digest_cache_crc64(tmpdir):
+    data_file = tmpdir.join('data.txt')
+    data_file.write('123456789')
+    cache = oss_sync.DigestCache(str(tmpdir.join('cache.json')))
+    assert cache.get(str(data_file), with_crc64=True)['crc64'] == str(0x995DC9BBDF1939FA)
+
+
+def test_multipart_without_crc64(tmpdir, monkeypatch):
+    monkeypatch.setattr(oss_sync, 'crc64', None)
+    data_file = tmpdir.join('data.txt')
+    data_file.write('123456789')
+    cache = oss_sync.DigestCache(str(tmpdir.join('cache.json')))
+    remote = {'url': 'oss://bucket/data.txt', 'size': 9, 'etag': 'ABC-2'}
+
+    # Multipart objects are never verified by anything weaker than crc64.
+    with pytest.raises(ChecksumError):
+        oss_sync.is_same(str(data_file), remote, cache)
+    with pytest.raises(ChecksumError):
+        cache.get(str(data_file), with_crc64=True)
+    with pytest.raises(ChecksumError):
+        oss_sync.sync(str(data_file), 'oss://bucket/data.txt')
+
+    # Single PUT objects are still compared by md5.
+    remote['etag'] = '25F9E794323B453885F5181F1B624D0B'
+    assert oss_sync.is_same(str(data_file), remote, cache) == (True, 'md5')
+
+
+def test_ls_pattern():
+    line = '2016-04-08 14:50:47 +0800 CST    6476984  Standard   ' \
+           '4F16FDAE7AC404CEC8B727FCC67779D6      oss://bucket1/test dir/test.txt'
+    matched = oss.OSS_LS_PATTERN.match(line)
+    assert matched.group('size') == '6476984'
+    assert matched.group('etag') == '4F16FDAE7AC404CEC8B727FCC67779D6'
+    assert matched.group('key') == 'oss://bucket1/test dir/test.txt'
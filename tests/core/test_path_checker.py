@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_path_checker
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import os
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import path_checker  # noqa
+
+
+def test_check_local_paths(tmpdir):
+    paths = []
+    for idx in range(10):
+        data_file = tmpdir.join('%s.fastq' % idx)
+        data_file.write('')
+        paths.append(str(data_file))
+    os.symlink(str(tmpdir.join('nonexistent')), str(tmpdir.join('broken')))
+
+    missing = [str(tmpdir.join('missing.fastq')), str(tmpdir.join('broken')),
+               str(tmpdir.join('nodir', 'a.fastq'))]
+    # Duplicated paths and trailing spaces.
+    results = path_checker.check_paths(paths + paths + missing + [paths[0] + ' '])
+    assert all(results[p] for p in paths)
+    assert results[paths[0] + ' ']
+    assert not any(results[p] for p in missing)
+
+
+def test_probe_local_dir(tmpdir, monkeypatch):
+    names = set('%s.fastq' % idx for idx in range(20))
+    for name in names:
+        tmpdir.join(name).write('')
+    names.add('missing.fastq')
+    expected = dict((name, name != 'missing.fastq') for name in names)
+    scanned = []
+    scandir = os.scandir
+
+    def fake_scandir(path):
+        scanned.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(path_checker.os, 'scandir', fake_scandir)
+    assert path_checker._probe_local_dir(str(tmpdir), names) == expected
+    assert scanned == [str(tmpdir)]
+
+    # A few files of a large directory are checked one by one.
+    monkeypatch.setattr(path_checker, '_estimate_entries', lambda stat: 100000)
+    assert path_checker._probe_local_dir(str(tmpdir), names) == expected
+    assert scanned == [str(tmpdir)]
+
+    # A directory that can be traversed but not read (--x).
+    def denied(path):
+        raise PermissionError(13, 'Permission denied', path)
+
+    monkeypatch.setattr(path_checker, '_estimate_entries', lambda stat: 1)
+    monkeypatch.setattr(path_checker.os, 'scandir', denied)
+    assert path_checker._probe_local_dir(str(tmpdir), names) == expected
+    assert not any(path_checker._probe_local_dir(str(tmpdir.join('nodir')), names).values())
+
+
+def test_check_oss_paths(monkeypatch):
+    listed = []
+    objects = dict(('oss://bucket/data/%s.fastq' % idx, {'size': 1, 'etag': ''})
+                   for idx in range(40))
+
+    def fake_list_objects(oss_link):
+        listed.append(oss_link)
+        return dict((k, v) for k, v in objects.items() if k.startswith(oss_link))
+
+    monkeypatch.setattr(path_checker, 'list_objects', fake_list_objects)
+    paths = ['oss://bucket/data/%s.fastq' % idx for idx in range(35)] + \
+        ['oss://bucket/data/missing.fastq', 'oss://bucket/data/']
+    results = path_checker.check_paths(paths)
+    # One listing for the files, and one for the directory itself.
+    assert sorted(listed) == ['oss://bucket/data', 'oss://bucket/data/']
+    assert [results[p] for p in paths] == [True] * 35 + [False, True]
+
+    # A few objects are listed by themselves, not the whole prefix.
+    del listed[:]
+    results = path_checker.check_paths(paths[:2] + paths[-2:-1])
+    assert sorted(listed) == sorted(paths[:2] + paths[-2:-1])
+    assert [results[p] for p in paths[:2] + paths[-2:-1]] == [True, True, False]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_project_revision
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import json
+from choppy.core.project_revision import Git, LARGE_FILES_MANIFEST
+
+
+def make_project(tmpdir):
+    project = tmpdir.mkdir('project')
+    for idx in range(3):
+        sample = project.mkdir('S%s' % idx)
+        sample.join('inputs').write('{"sample_id": "S%s"}' % idx)
+        sample.join('workflow.wdl').write('workflow w {}')
+    project.join('submitted.csv').write('sample_id\n')
+    return project
+
+
+def committed_files(repo):
+    return sorted(item.path for item in repo.head.commit.tree.traverse() if item.type == 'blob')
+
+
+def test_incremental_commit(tmpdir, monkeypatch):
+    monkeypatch.setenv('GIT_AUTHOR_NAME', 'test')
+    monkeypatch.setenv('GIT_AUTHOR_EMAIL', 'test@example.com')
+    project = make_project(tmpdir)
+    project.join('.gitignore').write('.git/*\noutputs/\n')
+    project.mkdir('outputs').join('huge.bam').write('x')
+
+    git = Git()
+    git.init_repo(str(project))
+    git.commit('init')
+    assert 'outputs/huge.bam' not in committed_files(git.repo)
+    assert 'S1/inputs' in committed_files(git.repo)
+
+    # Only changed files are added.
+    project.join('submitted.csv').write('sample_id\nS0\n')
+    project.join('S2', 'workflow.wdl').remove()
+    assert git.get_changes() == (['submitted.csv'], ['S2/workflow.wdl'])
+    git.commit('submitted')
+    assert sorted(git.repo.head.commit.stats.files) == ['S2/workflow.wdl', 'submitted.csv']
+    assert not git.is_dirty()
+
+    # Nothing is committed without changes.
+    head = git.repo.head.commit
+    git.commit('nothing')
+    assert git.repo.head.commit == head
+
+
+def test_large_files(tmpdir, monkeypatch):
+    monkeypatch.setenv('GIT_AUTHOR_NAME', 'test')
+    monkeypatch.setenv('GIT_AUTHOR_EMAIL', 'test@example.com')
+    project = make_project(tmpdir)
+    project.join('S0', 'report.html').write('x' * 100)
+
+    git = Git(max_file_size=50)
+    git.init_repo(str(project))
+    git.commit('init')
+    assert 'S0/report.html' not in committed_files(git.repo)
+    manifest = json.loads(project.join(LARGE_FILES_MANIFEST).read())
+    assert list(manifest) == ['S0/report.html'] and manifest['S0/report.html']['size'] == 100
+    assert not git.is_dirty()
+
+    project.join('S0', 'report.html').write('y' * 200)
+    git.commit('report')
+    manifest = json.loads(project.join(LARGE_FILES_MANIFEST).read())
+    assert manifest['S0/report.html']['size'] == 200
+    assert LARGE_FILES_MANIFEST in committed_files(git.repo)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_rerun
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import csv
+import json
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import cromwell, workflow  # noqa
+from choppy.core.workflow import rerun_project  # noqa
+
+
+def make_project(tmpdir):
+    project = tmpdir.mkdir('project')
+    statuses = {}
+    rows = []
+    for sample_id, workflow_id, status in (('s1', 'wf1', 'Succeeded'), ('s2', 'wf2', 'Failed'),
+                                           ('s3', 'wf3', 'Running'), ('s4', 'wf4', 'Aborted')):
+        sample = project.mkdir(sample_id)
+        sample.join('workflow.wdl').write('workflow %s {}' % sample_id)
+        sample.join('inputs').write(json.dumps({'sample': sample_id}))
+        sample.mkdir('tasks').join('task.wdl').write('task t {}')
+        statuses[workflow_id] = {'status': status, 'labels': {
+            'username': 'choppy', 'sample-id': sample_id, 'cromwell-workflow-id': 'cromwell-%s' % workflow_id}}
+        rows.append('%s,%s' % (sample_id, workflow_id))
+    project.join('submitted.csv').write('sample_id,workflow_id\n' + '\n'.join(rows) + '\n')
+    return project, statuses
+
+
+def test_rerun_project(tmpdir, monkeypatch, fake_cromwell):
+    project, statuses = make_project(tmpdir)
+    # A rerun stopped after s4 was submitted again, before submitted.csv was saved,
+    # so the project doesn't find it any more.
+    statuses['wf4']['labels']['restarted-as'] = 'wf6'
+    statuses['wf4']['name'] = 'another-project'
+    client = fake_cromwell({'localhost': statuses}, workflow)['localhost']
+    zips = []
+    monkeypatch.setattr(workflow, 'build_dependencies_zip', lambda path: zips.append(path) or b'zip')
+    monkeypatch.chdir(tmpdir)
+
+    assert rerun_project('project', dry_run=True) == {'rerun': [], 'failed': []}
+    assert client.submitted == []
+
+    result = rerun_project('project', username='alice', jobs=2)
+    assert [row['sample_id'] for row in result['rerun']] == ['s2']
+    assert result['failed'] == []
+    # The tasks zip is shared by all samples.
+    assert zips == [str(project.join('s2', 'tasks'))]
+
+    assert [submitted[0] for submitted in client.submitted] == ['workflow s2 {}']
+    _, _, dependencies, options, labels = client.submitted[0]
+    assert dependencies == b'zip'
+    assert options == {'read_from_cache': True, 'write_to_cache': True}
+    assert labels == {'username': 'alice', 'sample-id': 's2'}
+    assert [call for call in client.calls if call[0] == 'label'] == [('label', 'wf2')]
+    assert client.workflows['wf2']['labels']['restarted-as'] == 'new-s2'
+
+    with open(str(project.join('submitted.csv'))) as f:
+        rows = [(row['sample_id'], row['workflow_id'], row['previous_workflow_id']) for row in csv.DictReader(f)]
+    assert rows == [('s1', 'wf1', ''), ('s2', 'new-s2', 'wf2'), ('s3', 'wf3', ''), ('s4', 'wf6', 'wf4')]
+
+
+def test_restart_workflow(monkeypatch, fake_response):
+    requests = []
+    client = cromwell.Cromwell('127.0.0.1', 8000)
+    client._long_version = '36'
+    submitted_files = {'workflow': 'workflow w {}', 'inputs': '{"w.a": 1}',
+                       'options': '{"final_workflow_outputs_dir": "/out"}'}
+
+    def request(method, url, **kwargs):
+        requests.append((method, url, kwargs))
+        if method == 'GET':
+            return fake_response({'id': 'wf1', 'submittedFiles': submitted_files,
+                                 'labels': {'cromwell-workflow-id': 'cromwell-wf1', 'sample-id': 's1'}})
+        return fake_response({'id': 'wf2', 'status': 'Submitted'})
+
+    monkeypatch.setattr(client.session, 'request', request)
+    assert client.restart_workflow('wf1', dependencies=b'zip')['id'] == 'wf2'
+
+    method, url, kwargs = requests[0]
+    assert url == 'http://127.0.0.1:8000/api/workflows/v1/wf1/metadata'
+    assert [value for key, value in kwargs['params'] if key == 'includeKey'] == ['submittedFiles', 'labels']
+
+    method, url, kwargs = requests[1]
+    assert (method, url) == ('POST', 'http://127.0.0.1:8000/api/workflows/v1')
+    options = json.loads(kwargs['files']['workflowOptions'][1])
+    assert options == {'final_workflow_outputs_dir': '/out', 'read_from_cache': True, 'write_to_cache': True}
+    assert kwargs['files']['wdlDependencies'][1] == b'zip'
+    labels = json.loads(kwargs['files']['labels'][1])
+    assert 'cromwell-workflow-id' not in labels and labels['sample-id'] == 's1'
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_server
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import os
+import sys
+import logging
+import argparse
+import threading
+from choppy.config import init_config
+
+init_config()
+
+from choppy import choppy_pipe  # noqa
+from choppy.core import server  # noqa
+
+
+def test_forward(tmpdir, monkeypatch, capsys):
+    socket_path = str(tmpdir.join('choppy.sock'))
+    assert server.forward(['batch', 'app', 'samples'], socket_path=socket_path) is None
+    assert server.forward(['install', 'app.zip'], socket_path=socket_path) is None
+
+    calls = []
+    # A slow query is still running while the others are answered.
+    slow_query = threading.Event()
+
+    def parse_args(argv, parser=None, working_dir=None):
+        return argparse.Namespace(argv=argv, working_dir=working_dir, debug=False, verbose=argv.count('-v'),
+                                  quite=False, handler='stream')
+
+    def run(args):
+        calls.append((args.argv, args.working_dir))
+        if 'slow' in args.argv:
+            assert slow_query.wait(5)
+            sys.exit(3)
+        print('Sample ID: S1')
+        logging.getLogger('choppy').error('Sample ID: S2, failed')
+        logging.getLogger('choppy').debug('Not shown by -v')
+        sys.exit(6)
+
+    monkeypatch.setattr(choppy_pipe, 'parse_args', parse_args)
+    monkeypatch.setattr(choppy_pipe, 'run', run)
+    monkeypatch.setattr(choppy_pipe, 'clean_cache', lambda: None)
+    monkeypatch.setattr(server, 'get_parser', lambda: None)
+
+    httpd = server.UnixHTTPServer(socket_path, server.RequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    with server.route_output():
+        thread.start()
+        try:
+            assert server.is_running(socket_path)
+            workdir = tmpdir.mkdir('workdir')
+            with workdir.as_cwd():
+                code = server.forward(['batch', 'app', 'samples', '-v'], socket_path=socket_path)
+            assert code == 6
+            # The server doesn't change its cwd, the working directory is passed down.
+            assert calls == [(['batch', 'app', 'samples', '-v'], str(workdir))]
+            assert os.getcwd() != str(workdir)
+            out, err = capsys.readouterr()
+            assert out == 'Sample ID: S1\n'
+            assert 'Sample ID: S2, failed' in err
+            assert 'Not shown by -v' not in err
+
+            codes = []
+            slow = threading.Thread(target=lambda: codes.append(
+                server.forward(['query', 'slow'], socket_path=socket_path)))
+            slow.start()
+            assert server.forward(['search', '-p', 'project'], socket_path=socket_path) == 6
+            slow_query.set()
+            slow.join()
+            assert codes == [3]
+
+            # Only one batch runs at a time, a busy server answers 503 at once and it's run locally.
+            with server._exclusive_lock:
+                assert server.forward(['batch', 'app', 'samples'], socket_path=socket_path) is None
+                assert server.forward(['query', '-s', 'Running'], socket_path=socket_path) == 6
+            assert [argv for argv, _ in calls].count(['batch', 'app', 'samples']) == 0
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+
+    # A stale socket is ignored.
+    assert not server.is_running(socket_path)
+    assert server.forward(['batch', 'app', 'samples'], socket_path=socket_path) is None
+
+
+def test_get_parser(monkeypatch):
+    from choppy.core import app_registry
+
+    class Registry(object):
+        apps = ['rna']
+
+        def names(self):
+            return list(self.apps)
+
+    registry = Registry()
+    built = []
+    monkeypatch.setattr(app_registry, 'get_registry', lambda: registry)
+    monkeypatch.setattr(choppy_pipe, 'build_parser', lambda: built.append(1) or object())
+    monkeypatch.setattr(server, '_parser', None)
+
+    parser = server.get_parser()
+    assert server.get_parser() is parser
+    assert len(built) == 1
+    # The choices of app names are changed by an installed app.
+    registry.apps = ['rna', 'wgs']
+    assert server.get_parser() is not parser
+    assert len(built) == 2
+
+
+def test_project_log(tmpdir):
+    handlers = logging.getLogger().handlers[:]
+    with server.route_output():
+        with server._capture_logs(None, 'proj', logging.INFO, handler='file', log_dir=str(tmpdir)):
+            logging.getLogger('choppy').info('Sample ID: S1, submitted')
+            logging.getLogger('choppy').debug('Not logged by info')
+    log = tmpdir.join('project_logs', 'proj_choppy.log').read()
+    assert 'Sample ID: S1, submitted' in log
+    assert 'Not logged by info' not in log
+    assert logging.getLogger().handlers == handlers
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_throttle
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import asyncio
+import datetime
+from email.utils import format_datetime
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import throttle  # noqa
+from choppy.core.cromwell import Cromwell  # noqa
+from choppy.core.throttle import RetryPolicy, TokenBucket, get_throttle_settings, parse_retry_after  # noqa
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(throttle.time, 'sleep', clock.sleep)
+
+    bucket = TokenBucket(2, per=1)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    # A reservation never blocks, it tells when the token can be used.
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    clock.now += 0.5
+    bucket.acquire()
+    assert clock.sleeps == [1.0]
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+
+def test_retry_policy(monkeypatch, fake_response):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, 'sleep', clock.sleep)
+    policy = RetryPolicy(max_retries=3, backoff=1, max_backoff=10)
+
+    responses = [fake_response(status_code=503), fake_response(status_code=429, headers={'Retry-After': '5'}), fake_response(status_code=200)]
+    assert policy.send(lambda: responses.pop(0)).status_code == 200
+    assert clock.sleeps == [1, 5.0]
+
+    # Other errors are final, and retries are limited.
+    assert policy.send(lambda: fake_response(status_code=400)).status_code == 400
+    clock.sleeps = []
+    assert policy.send(lambda: fake_response(status_code=429, headers={'Retry-After': '600'})).status_code == 429
+    assert clock.sleeps == [10, 10, 10]
+
+
+def test_retry_policy_async(monkeypatch, fake_response):
+    clock = Clock()
+    sleeps = []
+
+    def blocking_sleep(seconds):
+        raise AssertionError('The event loop is blocked.')
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(throttle.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(throttle.time, 'sleep', blocking_sleep)
+    monkeypatch.setattr(throttle.asyncio, 'sleep', fake_sleep)
+    policy = RetryPolicy(max_retries=3, backoff=1, max_backoff=10)
+    limiter = TokenBucket(1, per=4)
+    responses = [fake_response(status_code=503), fake_response(status_code=429, headers={'Retry-After': '5'}), fake_response(status_code=200)]
+
+    async def send_request():
+        return responses.pop(0)
+
+    response = asyncio.run(policy.send_async(send_request, limiter=limiter))
+    assert response.status_code == 200
+    # Backoff, a token of the limiter and Retry-After are all awaited.
+    assert sleeps == [1, 3.0, 5.0]
+    assert limiter.reserve() == 4.0
+
+
+def test_throttle_settings():
+    rate_limits, policy = get_throttle_settings({'port': '8000'})
+    assert rate_limits == {'default': None, 'metadata': 300, 'query': None, 'submit': None}
+    assert (policy.max_retries, policy.backoff) == (3, 1.0)
+
+    rate_limits, policy = get_throttle_settings({'rate_limit': '600', 'submit_rate_limit': '60',
+                                                 'max_retries': '0', 'retry_backoff': ''})
+    assert rate_limits == {'default': 600, 'metadata': 600, 'query': 600, 'submit': 60}
+    assert (policy.max_retries, policy.backoff) == (0, 1.0)
+
+
+def test_cromwell_patch_retries(monkeypatch, fake_response):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, 'sleep', clock.sleep)
+    responses = [fake_response(status_code=503, headers={'Retry-After': '2'}), fake_response(status_code=200)]
+    requests = []
+
+    def request(method, url, **kwargs):
+        requests.append((method, url))
+        return responses.pop(0)
+
+    cromwell = Cromwell('127.0.0.1', 8000)
+    monkeypatch.setattr(cromwell.session, 'request', request)
+    assert cromwell.patch('labels', 'wf1', '{}', {}).status_code == 200
+    assert requests == [('PATCH', 'http://127.0.0.1:8000/api/workflows/v1/wf1/labels')] * 2
+    assert clock.sleeps == [2.0]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_wdl_parser
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import os
+import pytest
+from choppy.core.wdl_parser import get_inputs
+from choppy.exceptions import WdlParseError
+
+# Real WDLs with imports, they are used by scripts/benchmark-wdl-parser.py too.
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wdl_fixtures')
+
+
+def make_wdl(tmpdir, workflow, tasks):
+    tmpdir.join('workflow.wdl').write(workflow)
+    tasks_dir = tmpdir.mkdir('tasks')
+    for name, task in tasks.items():
+        tasks_dir.join(name).write(task)
+    return str(tmpdir.join('workflow.wdl'))
+
+
+def test_draft2_inputs():
+    assert get_inputs(os.path.join(FIXTURES_DIR, 'draft2', 'workflow.wdl')) == {
+        'wgs.sample_id': 'String',
+        'wgs.fastqs': 'Array[File]+',
+        'wgs.threads': 'Int? (optional)',
+        'wgs.prefix': 'String (optional, default = "${sample_id}_out")',
+        'wgs.sizes': 'Map[String, Int] (optional, default = {"a": 1, "b": 2})',
+        'wgs.mapping.args': 'String? (optional)',
+        'wgs.mapping.cpu': 'Int (optional, default = 4)',
+        'wgs.remapping.fastq': 'File',
+        'wgs.remapping.sample': 'String',
+        'wgs.remapping.args': 'String? (optional)',
+        'wgs.remapping.cpu': 'Int (optional, default = 4)'
+    }
+
+
+def test_v1_inputs():
+    assert get_inputs(os.path.join(FIXTURES_DIR, 'v1', 'workflow.wdl')) == {
+        'w.name': 'String',
+        'w.n': 'Int (optional, default = 3)',
+        'w.opt': 'File? (optional)',
+        'w.hello.greeting': 'String? (optional)'
+    }
+
+
+def test_unsupported(tmpdir):
+    struct_wdl = 'version 1.0\nstruct Sample {\n String id\n}\nworkflow w {\n input {\n Sample s\n }\n}\n'
+    wdl_path = make_wdl(tmpdir, struct_wdl, {})
+    with pytest.raises(WdlParseError):
+        get_inputs(wdl_path)
+
+    # Sub-workflows are left to womtool.
+    sub_wdl = 'version 1.0\nworkflow sub {\n input {\n String x\n }\n}\n'
+    tmpdir.join('tasks', 'sub.wdl').write(sub_wdl)
+    tmpdir.join('workflow.wdl').write('version 1.0\nimport "tasks/sub.wdl" as sub\n'
+                                      'workflow w {\n call sub.sub\n}\n')
+    with pytest.raises(WdlParseError):
+        get_inputs(wdl_path)
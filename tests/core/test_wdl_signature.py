@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_wdl_signature
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import wdl_signature  # noqa
+
+WORKFLOW = '''import "./tasks/hello.wdl" as hello
+
+workflow wf {
+    String name
+    call hello.hello {input: name=name}
+}
+'''
+
+TASK = '''task hello {
+    String name
+    command { echo ${name} }
+}
+'''
+
+
+def make_sample(tmpdir, name, task=TASK):
+    sample_dir = tmpdir.mkdir(name)
+    sample_dir.join('workflow.wdl').write(WORKFLOW)
+    sample_dir.mkdir('tasks').join('hello.wdl').write(task)
+    return str(sample_dir.join('workflow.wdl'))
+
+
+def test_wdl_signature_cache(tmpdir, monkeypatch):
+    calls = []
+
+    def fake_womtool(args, cwd=None):
+        calls.append(args)
+        return 0, '{"wf.name": "String"}'
+
+    monkeypatch.setattr(wdl_signature, 'get_womtool_path', lambda: '/nonexistent/womtool.jar')
+    monkeypatch.setattr(wdl_signature, 'run_womtool', fake_womtool)
+    monkeypatch.setattr(wdl_signature, 'get_cache_dir', lambda: str(tmpdir.join('cache')))
+
+    sample1 = make_sample(tmpdir, 'sample1')
+    sample2 = make_sample(tmpdir, 'sample2')
+    changed = make_sample(tmpdir, 'sample3', task=TASK.replace('echo', 'printf'))
+    assert wdl_signature.wdl_digest(sample1) == wdl_signature.wdl_digest(sample2)
+    assert wdl_signature.wdl_digest(sample1) != wdl_signature.wdl_digest(changed)
+
+    signature = wdl_signature.get_wdl_signature(sample1, use_parser=False)
+    signature.pop('wf.name')
+    assert wdl_signature.get_wdl_signature(sample2, use_parser=False) == {'wf.name': 'String'}
+    assert len(calls) == 1
+
+    # Cached on disk.
+    wdl_signature._signatures.clear()
+    assert wdl_signature.get_wdl_signature(sample2, use_parser=False) == {'wf.name': 'String'}
+    assert len(calls) == 1
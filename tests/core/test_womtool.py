@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.core.test_womtool
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import sys
+import pytest
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core import womtool  # noqa
+from choppy.core.womtool import WomtoolWorker, WomtoolWorkerError, get_worker_args, run_womtool  # noqa
+
+# A worker that speaks the protocol of WomtoolWorker.java, `inputs` answers the WDL source.
+FAKE_WORKER = '''
+import os
+import sys
+
+out = sys.stdout.buffer
+out.write(b"READY\\n")
+out.flush()
+for line in sys.stdin:
+    args = line.rstrip("\\n").split("\\t")
+    if args[0] == "exit":
+        sys.exit(1)
+    if args[0] == "inputs" and os.path.isfile(args[1]):
+        with open(args[1], "rb") as f:
+            code, data = 0, f.read()
+    else:
+        code, data = 1, ("Unable to run: %s" % " ".join(args)).encode("utf-8")
+    out.write(("%s %s\\n" % (code, len(data))).encode("utf-8") + data)
+    out.flush()
+'''
+
+
+@pytest.fixture
+def worker(tmpdir):
+    script = tmpdir.join('fake_worker.py')
+    script.write(FAKE_WORKER)
+    worker = WomtoolWorker('womtool.jar')
+    worker.cmd = [sys.executable, str(script)]
+    yield worker.start()
+    worker.stop()
+
+
+def make_app(tmpdir):
+    app = tmpdir.mkdir('app')
+    app.mkdir('tasks').join('mapping.wdl').write('task mapping {}')
+    app.join('workflow.wdl').write('import "tasks/mapping.wdl" as mapping\n'
+                                   'import "https://example.com/qc.wdl" as qc\n\nworkflow w {}\n')
+    return app
+
+
+def test_worker_protocol(tmpdir, worker):
+    wdl = tmpdir.join('workflow.wdl')
+    wdl.write('workflow w {}\n')
+    assert worker.run(['inputs', str(wdl)]) == (0, 'workflow w {}\n')
+    assert worker.run(['validate', 'missing.wdl']) == (1, 'Unable to run: validate missing.wdl')
+
+    with pytest.raises(WomtoolWorkerError):
+        worker.run(['inputs', 'a\tb'])
+    with pytest.raises(WomtoolWorkerError):
+        worker.run(['exit'])
+    assert not worker.is_alive()
+
+
+def test_worker_resolves_imports(tmpdir, worker, monkeypatch):
+    app = make_app(tmpdir)
+    monkeypatch.setattr(womtool, 'get_worker', lambda: worker)
+    tmp_dir = tmpdir.mkdir('tmp')
+    monkeypatch.setattr(womtool.tempfile, 'tempdir', str(tmp_dir))
+    # The worker runs in another directory, relative paths are resolved against cwd.
+    returncode, output = run_womtool(['inputs', 'workflow.wdl'], cwd=str(app), use_worker=True)
+    assert returncode == 0
+    assert output.splitlines()[:2] == ['import "%s" as mapping' % app.join('tasks', 'mapping.wdl'),
+                                       'import "https://example.com/qc.wdl" as qc']
+    # The copy with absolute imports is removed.
+    assert tmp_dir.listdir() == []
+
+
+def test_get_worker_args(tmpdir):
+    app = make_app(tmpdir)
+    assert get_worker_args(['inputs', str(app.join('tasks', 'mapping.wdl'))]) == \
+        (['inputs', str(app.join('tasks', 'mapping.wdl'))], None)
+    assert get_worker_args(['inputs', 'tasks/mapping.wdl'], cwd=str(app)) == \
+        (['inputs', str(app.join('tasks', 'mapping.wdl'))], None)
+
+    # Nested relative imports are left to womtool in a subprocess.
+    app.join('tasks', 'mapping.wdl').write('import "common.wdl"\ntask mapping {}')
+    assert get_worker_args(['inputs', 'workflow.wdl'], cwd=str(app)) == (None, None)
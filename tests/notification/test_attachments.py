@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.notification.test_attachments
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import io
+import os
+import zipfile
+from choppy.config import init_config
+
+init_config()
+
+from choppy.notification.attachments import generate_logs_archive  # noqa
+from choppy.utils import read_tail  # noqa
+
+
+def read_archive(attachment):
+    data = attachment.get_payload(decode=True)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        return len(data), dict((name, zf.read(name)) for name in zf.namelist())
+
+
+def test_read_tail(tmpdir):
+    log = tmpdir.join('stderr')
+    log.write(''.join('line %s\n' % i for i in range(100)))
+    assert read_tail(str(log), 10000) == (log.read_binary(), False)
+
+    # The partial first line is skipped.
+    data, truncated = read_tail(str(log), 20)
+    assert truncated
+    assert data == b'line 98\nline 99\n'
+
+
+def test_logs_archive(tmpdir):
+    stdout = tmpdir.join('stdout')
+    stdout.write('progress\n' * 10000)
+    stderr = tmpdir.join('stderr')
+    stderr.write_binary(os.urandom(3000))
+    files = {'stdout': str(stdout), 'stderr': str(stderr), 'missing': str(tmpdir.join('missing'))}
+
+    size, members = read_archive(generate_logs_archive(files, {'metadata.json': '{}'},
+                                                       tail_bytes=1000, max_bytes=100 * 1024))
+    assert sorted(members) == ['README.txt', 'metadata.json', 'stderr', 'stdout']
+    assert members['stdout'] == b'progress\n' * 111
+    assert b'stdout' in members['README.txt']
+
+    # Random data can't be compressed, it's skipped when it doesn't fit.
+    size, members = read_archive(generate_logs_archive(files, tail_bytes=3000, max_bytes=2048))
+    assert size <= 2048
+    assert 'stderr' not in members
+    assert b'These files are skipped' in members['README.txt']
+
+
+def test_logs_archive_size_cap(tmpdir):
+    files = {}
+    for i in range(5):
+        log = tmpdir.join('log%s' % i)
+        log.write_binary(os.urandom(300) + b'retry\n' * (i * 100))
+        files['log%s' % i] = str(log)
+
+    # The cap is a hard limit, whatever the sizes of the files are.
+    for max_bytes in range(100, 3000, 37):
+        size, _ = read_archive(generate_logs_archive(files, tail_bytes=4096, max_bytes=max_bytes))
+        assert size <= max_bytes
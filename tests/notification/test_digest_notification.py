@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.notification.test_digest_notification
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import threading
+from collections import namedtuple
+from choppy.config import init_config
+
+init_config()
+
+from choppy.core.monitor import Monitor  # noqa
+from choppy.notification import digest_notification  # noqa
+from choppy.notification.digest_notification import DigestNotification  # noqa
+
+FakeWorkflow = namedtuple('FakeWorkflow', ['status', 'person_id'])
+
+
+class FakeDispatcher(object):
+    def __init__(self):
+        self.messages = []
+        self.stopped = False
+
+    def submit(self, msg, to_addr, from_addr):
+        self.messages.append((msg['Subject'], to_addr))
+
+    def stop(self, timeout=None):
+        self.stopped = True
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def make_metadata(workflow_id, status, project='rnaseq'):
+    return {'id': workflow_id, 'status': status, 'workflowName': 'wf',
+            'labels': {'project': project, 'sample-id': 'S-%s' % workflow_id}}
+
+
+def notify(notification, workflow_id, status, person_id='alice', project='rnaseq'):
+    notification.on_changed_workflow_status(FakeWorkflow(status, person_id),
+                                            make_metadata(workflow_id, status, project),
+                                            'localhost', 8000)
+
+
+def test_digest_window(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(digest_notification.time, 'time', clock.time)
+    monkeypatch.setattr(digest_notification.global_config, 'get',
+                        lambda section, key: {'email_domain': 'example.com'}.get(key))
+    dispatcher = FakeDispatcher()
+    notification = DigestNotification(None, dispatcher=dispatcher, window=60)
+
+    notify(notification, 'wf1', 'Succeeded')
+    notify(notification, 'wf2', 'Failed')
+    notify(notification, 'wf3', 'Running')
+    notify(notification, 'wf4', 'Succeeded', person_id='')
+    notify(notification, 'wf5', 'Aborted', project='wgs')
+    assert notification.flush() == 0
+
+    # Workflows of a user and a project are sent in one email after the window.
+    clock.now += 60
+    notify(notification, 'wf6', 'Succeeded', person_id='bob')
+    assert notification.flush() == 2
+    assert dispatcher.messages == [
+        ('Project (rnaseq) 2 workflows finished: 1 Succeeded, 1 Failed', 'alice@example.com'),
+        ('Project (wgs) 1 workflows finished: 1 Aborted', 'alice@example.com')]
+
+    # The rest is sent at once by a forced flush.
+    assert notification.flush(force=True) == 1
+    assert dispatcher.messages[-1] == ('Project (rnaseq) 1 workflows finished: 1 Succeeded', 'bob@example.com')
+    assert notification.flush(force=True) == 0
+
+
+def test_monitor_flushes_on_stop(monkeypatch):
+    monkeypatch.setattr(digest_notification.global_config, 'get',
+                        lambda section, key: {'email_domain': 'example.com'}.get(key))
+    dispatcher = FakeDispatcher()
+    notification = DigestNotification(None, dispatcher=dispatcher, window=3600)
+
+    monitor = Monitor.__new__(Monitor)
+    monitor.interval = 3600
+    monitor.stopped = threading.Event()
+    monitor.dispatcher = dispatcher
+    monitor.event_subscribers = [notification]
+
+    def sync_workflows(start_time):
+        notify(notification, 'wf1', 'Failed')
+        # Stopped by a signal while it's polling.
+        monitor.stop()
+        return []
+
+    monitor.sync_workflows = sync_workflows
+    monitor.run()
+    assert dispatcher.messages == [('Project (rnaseq) 1 workflows finished: 1 Failed', 'alice@example.com')]
+    assert dispatcher.stopped
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.notification.test_dispatcher
+    ~~~~~~~~~
+
+    :copyright: © 2019 by the Choppy team.
+    :license: AGPL, see LICENSE.md for more details.
+"""
+import os
+import socket
+import pytest
+from email.mime.text import MIMEText
+from choppy.config import init_config
+
+init_config()
+
+from choppy.notification.dispatcher import NotificationDispatcher  # noqa
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+
+class RecordingHandler(object):
+    def __init__(self):
+        self.messages = []
+        # The client address of every message, one for each SMTP session.
+        self.peers = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.peers.append(session.peer)
+        return '250 OK'
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def make_msg(subject):
+    msg = MIMEText('body')
+    msg['Subject'] = subject
+    return msg
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = aiosmtpd_controller.Controller(handler, hostname='127.0.0.1',
+                                                port=get_free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def get_settings(port):
+    return {'host': '127.0.0.1', 'port': port, 'ssl': False,
+            'user': None, 'password': None}
+
+
+def test_send_with_one_connection(tmpdir, smtp_server):
+    controller, handler = smtp_server
+    dispatcher = NotificationDispatcher(spool_dir=str(tmpdir),
+                                        smtp_settings=get_settings(controller.port))
+    dispatcher.start()
+    for i in range(20):
+        dispatcher.submit(make_msg('Workflow %s' % i), 'user@example.com', 'choppy@example.com')
+    assert dispatcher.join(timeout=10)
+    dispatcher.stop()
+
+    assert len(handler.messages) == 20
+    # All messages are sent by a single SMTP session.
+    assert len(set(handler.peers)) == 1
+    assert [name for name in os.listdir(str(tmpdir)) if name.endswith('.json')] == []
+
+
+def test_retry_and_recover_spool(tmpdir, smtp_server):
+    controller, handler = smtp_server
+    # No smtp server on this port, the message must be kept in the spool.
+    dispatcher = NotificationDispatcher(spool_dir=str(tmpdir), backoff_factor=60,
+                                        smtp_settings=get_settings(get_free_port()))
+    dispatcher.start()
+    dispatcher.submit(make_msg('Workflow'), 'user@example.com', 'choppy@example.com')
+    assert not dispatcher.join(timeout=1)
+    dispatcher.stop()
+    assert len([name for name in os.listdir(str(tmpdir)) if name.endswith('.json')]) == 1
+
+    # Recover the spooled message when restarting.
+    dispatcher = NotificationDispatcher(spool_dir=str(tmpdir),
+                                        smtp_settings=get_settings(controller.port))
+    dispatcher.start()
+    assert dispatcher.join(timeout=10)
+    dispatcher.stop()
+    assert len(handler.messages) == 1